@@ -0,0 +1,90 @@
+""" authentication backend keeping the users in memory
+    AuthenticationMiddleware loads the user of every request with
+    get_user: each process keeps the users by id, with the version they
+    were loaded with. The versions are in the cache framework, changed
+    after a user is saved (password change, login), deleted or logged out
+    (authentication.signals): a warm request loads its user without query.
+
+    The versions must be seen by every process: with a shared cache
+    backend a change is seen at once, without it the settings load the
+    users on every request (USER_CACHE_SECONDS 0)
+"""
+import copy
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+
+USER_CACHE_SIZE = 10000
+
+
+def version_key(user_id):
+    return 'authentication:user:version:%s' % user_id
+
+
+def current_version(user_id):
+    """ shared version of the user, a new one if lost """
+    version = cache.get(version_key(user_id))
+    if version is None:
+        cache.add(version_key(user_id), uuid.uuid4().hex, None)
+        version = cache.get(version_key(user_id))
+    return version
+
+
+class UserCache:
+    """ users of the process by id: (version, load time, user) """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.users = {}
+
+    def get(self, user_id, version):
+        with self.lock:
+            entry = self.users.get(user_id)
+        if entry is None:
+            return None
+        loaded_version, loaded_at, user = entry
+        if loaded_version != version \
+                or time.monotonic() - loaded_at > settings.USER_CACHE_SECONDS:
+            return None
+        return user
+
+    def set(self, user_id, version, user):
+        with self.lock:
+            self.users.pop(user_id, None)
+            if len(self.users) >= USER_CACHE_SIZE:
+                # the oldest entry
+                del self.users[next(iter(self.users))]
+            self.users[user_id] = (version, time.monotonic(), user)
+
+    def discard(self, user_id):
+        with self.lock:
+            self.users.pop(user_id, None)
+
+
+users = UserCache()
+
+
+def invalidate(user_id):
+    """ the user is loaded again by every process """
+    cache.set(version_key(user_id), uuid.uuid4().hex, None)
+    users.discard(user_id)
+
+
+class CachedModelBackend(ModelBackend):
+    """ ModelBackend reading the users of the sessions from memory """
+
+    def get_user(self, user_id):
+        # read before the user, a change made meanwhile is seen next time
+        version = current_version(user_id)
+        user = users.get(user_id, version)
+        if user is None:
+            user = super().get_user(user_id)
+            if user is None:
+                return None
+            users.set(user_id, version, user)
+        # the requests may change their user (permissions cache...)
+        return copy.copy(user)
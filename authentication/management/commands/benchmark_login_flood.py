@@ -0,0 +1,146 @@
+import contextlib
+import io
+import json
+import logging
+import statistics
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from reviews import seeding
+
+
+class Flood:
+    """ threads posting wrong passwords to the login page from a few
+        ips, with a new username on every attempt, each at a fixed rate
+        whatever the answers (or as fast as answered when slower)
+    """
+
+    def __init__(self, attackers, ips, rate):
+        self.attackers = attackers
+        self.ips = ips
+        self.rate = rate
+        self.stop = threading.Event()
+        self.lock = threading.Lock()
+        self.statuses = {}
+        self.threads = []
+
+    def attack(self, number):
+        client = Client()
+        attempt = 0
+        next_at = time.perf_counter()
+        try:
+            while not self.stop.wait(max(0, next_at - time.perf_counter())):
+                next_at = max(next_at + 1 / self.rate, time.perf_counter())
+                attempt += 1
+                response = client.post(reverse('login'), {
+                    'username': 'attaquant%d-%d' % (number, attempt),
+                    'password': 'mauvais-mot-de-passe',
+                }, REMOTE_ADDR='203.0.113.%d' % (number % self.ips + 1))
+                with self.lock:
+                    self.statuses[response.status_code] = \
+                        self.statuses.get(response.status_code, 0) + 1
+        finally:
+            connections.close_all()
+
+    def __enter__(self):
+        for number in range(self.attackers):
+            thread = threading.Thread(target=self.attack, args=(number,))
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop.set()
+        for thread in self.threads:
+            thread.join()
+
+
+class Command(BaseCommand):
+    help = ("Request the feed of a synthetic site while threads flood the "
+            "login page with wrong passwords, without and with the login "
+            "throttling, and print, as JSON, the feed latency percentiles "
+            "and the login responses of each phase. The flood and the feed "
+            "share the CPUs of the process like the requests of a worker")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--requests', type=int, default=100,
+                            help="measured feed requests by phase")
+        parser.add_argument('--attackers', type=int, default=4,
+                            help="flooding threads")
+        parser.add_argument('--rate', type=float, default=5,
+                            help="login attempts by second of a thread")
+        parser.add_argument('--ips', type=int, default=1,
+                            help="ips shared by the flooding threads")
+        parser.add_argument('--warmup', type=float, default=10,
+                            help="seconds of flood before the measure, "
+                                 "the bursts of the buckets are spent")
+
+    def handle(self, *args, **options):
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False)
+        # every hashed login is a slow request, every rejected one a 429
+        loggers = [logging.getLogger(name) for name in (
+            'litreview.performance', 'django.request')]
+        levels = [logger.level for logger in loggers]
+        for logger in loggers:
+            logger.setLevel(logging.ERROR)
+        try:
+            seeding.Generator(users=options['users']).run()
+            # the read-only alias is still the configured database
+            with override_settings(
+                    DATABASE_READ_ALIAS=None,
+                    ALLOWED_HOSTS=settings.ALLOWED_HOSTS + ['testserver']), \
+                    contextlib.redirect_stdout(io.StringIO()):
+                report = self.measure(options)
+        finally:
+            for logger, level in zip(loggers, levels):
+                logger.setLevel(level)
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+        self.stdout.write(json.dumps(report, indent=2))
+
+    def measure(self, options):
+        reader = Client()
+        reader.force_login(get_user_model().objects.order_by('id').first())
+
+        def phase(attackers):
+            cache.clear()
+            reader.get(reverse('feed'))
+            durations = []
+            with Flood(attackers, options['ips'], options['rate']) as flood:
+                if attackers:
+                    time.sleep(options['warmup'])
+                with flood.lock:
+                    flood.statuses.clear()
+                started = time.perf_counter()
+                for _ in range(options['requests']):
+                    start = time.perf_counter()
+                    response = reader.get(reverse('feed'))
+                    durations.append(time.perf_counter() - start)
+                    if response.status_code != 200:
+                        raise CommandError('the feed answered %d'
+                                           % response.status_code)
+                elapsed = time.perf_counter() - started
+            percentiles = statistics.quantiles(
+                durations, n=100, method='inclusive')
+            return {
+                'feed_p50_ms': round(percentiles[49] * 1000, 2),
+                'feed_p95_ms': round(percentiles[94] * 1000, 2),
+                'login_attempts_by_second': round(
+                    sum(flood.statuses.values()) / elapsed, 1),
+                'login_statuses': flood.statuses,
+            }
+
+        report = {'baseline': phase(0)}
+        with override_settings(THROTTLE_RATES={}):
+            report['flood_unthrottled'] = phase(options['attackers'])
+        report['flood_throttled'] = phase(options['attackers'])
+        return report
@@ -0,0 +1,26 @@
+""" invalidate the users kept in memory (authentication.backends)
+    after a save (password change, login), a delete or a logout
+"""
+from django.conf import settings
+from django.contrib.auth.signals import user_logged_out
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import backends
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def user_changed(sender, instance, **kwargs):
+    # at once for the transaction, again after the commit: meanwhile the
+    # other requests may load the old row with the new version
+    user_id = instance.id
+    backends.invalidate(user_id)
+    transaction.on_commit(lambda: backends.invalidate(user_id))
+
+
+@receiver(user_logged_out)
+def user_logged_out(sender, request, user, **kwargs):
+    if user is not None:
+        backends.invalidate(user.id)
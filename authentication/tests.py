@@ -1,3 +1,200 @@
-from django.test import TestCase
+import time
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from . import backends
+from . import throttling
+
+# the logins of the tests would be slow requests with the real hasher
+FAST_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+
+# the single process of the tests shares its cache
+@override_settings(SESSION_ENGINE='django.contrib.sessions.backends.cached_db',
+                   USER_CACHE_SECONDS=300, PASSWORD_HASHERS=FAST_HASHERS)
+class CachedUserTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            username='lecteur', password='ancien-mot-de-passe')
+        self.client.login(username='lecteur', password='ancien-mot-de-passe')
+
+    def auth_queries(self, client):
+        """ response of a page and number of queries loading its
+            session or its user
+        """
+        with CaptureQueriesContext(connection) as context:
+            response = client.get(reverse('posts'))
+        return response, sum(
+            'FROM "django_session"' in query['sql']
+            or 'FROM "authentication_user" WHERE' in query['sql']
+            for query in context.captured_queries)
+
+    def test_warm_request_without_auth_query(self):
+        response, queries = self.auth_queries(self.client)
+        self.assertEqual(response.status_code, 200)
+        # the user, saved by the login, the session is cached
+        self.assertEqual(queries, 1)
+        response, queries = self.auth_queries(self.client)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(queries, 0)
+
+    def test_password_change_invalidates_the_user(self):
+        other = Client()
+        other.login(username='lecteur', password='ancien-mot-de-passe')
+        self.assertEqual(self.auth_queries(other)[0].status_code, 200)
+        self.assertEqual(self.auth_queries(self.client)[0].status_code, 200)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('password_change'), {
+                'old_password': 'ancien-mot-de-passe',
+                'new_password1': 'nouveau-mot-de-passe',
+                'new_password2': 'nouveau-mot-de-passe'})
+        self.assertRedirects(response, reverse('password_change_done'),
+                             fetch_redirect_response=False)
+        # still logged in, with the new password loaded once
+        response, queries = self.auth_queries(self.client)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(queries, 1)
+        self.assertEqual(self.auth_queries(self.client)[1], 0)
+        # the session of the old password is closed
+        response = other.get(reverse('posts'))
+        self.assertRedirects(response, reverse('login') + '?next=/posts/',
+                             fetch_redirect_response=False)
+
+    def test_logout_invalidates_the_user(self):
+        self.client.get(reverse('posts'))
+        version = backends.current_version(self.user.id)
+        self.assertIsNotNone(backends.users.get(self.user.id, version))
+
+        self.client.post(reverse('logout'))
+        self.assertNotEqual(backends.current_version(self.user.id), version)
+        self.assertIsNone(backends.users.get(self.user.id, version))
+        response = self.client.get(reverse('posts'))
+        self.assertEqual(response.status_code, 302)
+
+    def test_signup_logs_in(self):
+        client = Client()
+        response = client.post(reverse('signup'), {
+            'username': 'nouveau', 'password1': 'Un-mot-de-passe-1',
+            'password2': 'Un-mot-de-passe-1'})
+        self.assertRedirects(response, reverse('home'),
+                             fetch_redirect_response=False)
+        response = client.get(reverse('posts'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.wsgi_request.user.username, 'nouveau')
+
+    def test_changes_of_other_processes(self):
+        self.client.get(reverse('posts'))
+        # the save of another process, without the signals of this one
+        get_user_model().objects.filter(id=self.user.id).update(
+            first_name='Ada')
+        cache.set(backends.version_key(self.user.id), 'autre')
+        response, queries = self.auth_queries(self.client)
+        self.assertEqual(queries, 1)
+        self.assertEqual(response.wsgi_request.user.first_name, 'Ada')
+
+        with self.settings(USER_CACHE_SECONDS=-1):
+            response, queries = self.auth_queries(self.client)
+        self.assertEqual(queries, 1)
+
+    def test_per_process_cache(self):
+        with self.settings(
+                SESSION_ENGINE='django.contrib.sessions.backends.db',
+                USER_CACHE_SECONDS=0):
+            client = Client()
+            client.login(username='lecteur', password='ancien-mot-de-passe')
+            for _ in range(2):
+                response, queries = self.auth_queries(client)
+                self.assertEqual(response.status_code, 200)
+                # the session and the user, loaded on every request
+                self.assertEqual(queries, 2)
+
+
+@override_settings(THROTTLE_RATES={
+    'login_ip': (3, 60), 'login_username': (2, 60), 'signup_ip': (1, 60)},
+    PASSWORD_HASHERS=FAST_HASHERS)
+class ThrottlingTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        get_user_model().objects.create_user(
+            username='lecteur', password='mot-de-passe')
+
+    def login(self, username='lecteur', ip='10.0.0.1'):
+        return self.client.post(reverse('login'), {
+            'username': username, 'password': 'faux'}, REMOTE_ADDR=ip)
+
+    def test_rejected_before_hashing(self):
+        with mock.patch('authentication.views.authenticate',
+                        return_value=None) as authenticate:
+            for number in range(3):
+                self.assertEqual(
+                    self.login('lecteur%d' % number).status_code, 200)
+            response = self.login('autre')
+        self.assertEqual(authenticate.call_count, 3)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '60')
+        self.assertContains(
+            response, 'Trop de tentatives, veuillez réessayer dans 60 '
+                      'secondes.', status_code=429)
+        # another client
+        self.assertEqual(self.login('autre', '10.0.0.2').status_code, 200)
+
+    def test_username_from_several_ips(self):
+        self.assertEqual(self.login(ip='10.0.0.1').status_code, 200)
+        self.assertEqual(self.login(ip='10.0.0.2').status_code, 200)
+        self.assertEqual(self.login(' Lecteur', '10.0.0.3').status_code, 429)
+        self.assertEqual(self.login('autre', '10.0.0.3').status_code, 200)
+
+    def test_bucket_refill(self):
+        key = throttling.bucket_key('test', 'client')
+        with mock.patch('authentication.throttling.time.time',
+                        return_value=1000):
+            self.assertEqual(throttling.take_token(key, 2, 10), 0)
+            self.assertEqual(throttling.take_token(key, 2, 10), 0)
+            self.assertEqual(throttling.take_token(key, 2, 10), 10)
+        with mock.patch('authentication.throttling.time.time',
+                        return_value=1004):
+            self.assertEqual(throttling.take_token(key, 2, 10), 6)
+        with mock.patch('authentication.throttling.time.time',
+                        return_value=1010):
+            self.assertEqual(throttling.take_token(key, 2, 10), 0)
+
+    def test_sliding_window_when_locked(self):
+        key = throttling.bucket_key('login_ip', '10.0.0.1')
+        # held by another worker
+        cache.add(key + ':lock', True)
+        self.assertIsNone(throttling.take_token(key, 3, 60))
+        for number in range(3):
+            self.assertEqual(
+                self.login('lecteur%d' % number).status_code, 200)
+        self.assertEqual(self.login('autre').status_code, 429)
+        # in the middle of the next window of 180 seconds, half of the
+        # attempts of the previous one still count
+        middle = (time.time() // 180 + 1) * 180 + 90
+        with mock.patch('authentication.throttling.time.time',
+                        return_value=middle):
+            self.assertEqual(throttling.count_in_window(key, 3, 60), 0)
+            self.assertEqual(throttling.count_in_window(key, 3, 60), 90)
+
+    def test_signup(self):
+        response = self.client.post(reverse('signup'), {
+            'username': 'nouveau', 'password1': 'Un-mot-de-passe-1',
+            'password2': 'Un-mot-de-passe-1'})
+        self.assertRedirects(response, reverse('home'),
+                             fetch_redirect_response=False)
+        response = self.client.post(reverse('signup'), {
+            'username': 'autre', 'password1': 'Un-mot-de-passe-1',
+            'password2': 'Un-mot-de-passe-1'})
+        self.assertEqual(response.status_code, 429)
+        self.assertContains(response, 'Trop de tentatives', status_code=429)
+        self.assertFalse(get_user_model().objects.filter(
+            username='autre').exists())
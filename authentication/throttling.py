@@ -0,0 +1,107 @@
+""" throttling of the login and signup attempts
+    each attempt takes a token from the buckets of its scopes (client ip,
+    username), refilled at a constant rate up to a burst. A request with
+    an empty bucket is rejected before any password hashing, with the
+    time to wait.
+
+    The buckets are in the cache framework, shared by the workers with a
+    shared backend (THROTTLE_RATES in the settings). A bucket is updated
+    under a lock key; when the lock is held (the same client flooding
+    from several workers) the attempt is counted instead in a sliding
+    window of atomic counters, for the same rate
+"""
+import hashlib
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.shortcuts import render
+
+LOCK_TIMEOUT = 5
+
+
+def bucket_key(scope, identifier):
+    # any identifier (username) in a valid key
+    digest = hashlib.md5(str(identifier).encode(),
+                         usedforsecurity=False).hexdigest()
+    return 'authentication:throttling:%s:%s' % (scope, digest)
+
+
+def take_token(key, burst, refill):
+    """ take a token from the bucket, return the seconds to wait for
+        one, 0 when taken. None when the bucket is locked
+    """
+    if not cache.add(key + ':lock', True, LOCK_TIMEOUT):
+        return None
+    try:
+        now = time.time()
+        state = cache.get(key)
+        tokens = burst
+        if state is not None:
+            tokens = min(burst, state[0] + (now - state[1]) / refill)
+        wait = 0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) * refill
+        # full again once expired
+        cache.set(key, (tokens, now), math.ceil((burst - tokens) * refill))
+        return wait
+    finally:
+        cache.delete(key + ':lock')
+
+
+def count_in_window(key, burst, refill):
+    """ count the attempt in a sliding window of burst * refill seconds,
+        return the seconds to wait when over burst attempts, 0 otherwise
+    """
+    window = burst * refill
+    now = time.time()
+    number, elapsed = divmod(now, window)
+    current = '%s:window:%d' % (key, number)
+    cache.add(current, 0, math.ceil(2 * window))
+    try:
+        count = cache.incr(current)
+    except ValueError:
+        # evicted meanwhile
+        cache.add(current, 1, math.ceil(2 * window))
+        count = 1
+    previous = cache.get('%s:window:%d' % (key, number - 1), 0)
+    if previous * (1 - elapsed / window) + count <= burst:
+        return 0
+    return window - elapsed
+
+
+def attempt(request, action, username=None):
+    """ take an attempt of the action (login, signup) for the client ip
+        and the username, return the seconds to wait, 0 when allowed.
+        The scopes without a rate (THROTTLE_RATES) are not limited
+    """
+    identifiers = {'%s_ip' % action: request.META.get('REMOTE_ADDR')}
+    if username:
+        identifiers['%s_username' % action] = username.strip().lower()
+    for scope, identifier in identifiers.items():
+        if scope not in settings.THROTTLE_RATES:
+            continue
+        burst, refill = settings.THROTTLE_RATES[scope]
+        key = bucket_key(scope, identifier)
+        wait = take_token(key, burst, refill)
+        if wait is None:
+            wait = count_in_window(key, burst, refill)
+        if wait:
+            return wait
+    return 0
+
+
+def cooldown_message(wait):
+    return ('Trop de tentatives, veuillez réessayer dans %d secondes.'
+            % math.ceil(wait))
+
+
+def rejected(request, template_name, context, wait):
+    """ the page of the form with the cooldown message, as a 429 """
+    context['message'] = cooldown_message(wait)
+    response = render(request, template_name, context, status=429)
+    response['Retry-After'] = str(math.ceil(wait))
+    return response
@@ -3,16 +3,22 @@ from django.contrib.auth import login, authenticate
 from django.shortcuts import render, redirect
 
 from . import forms
+from . import throttling
 
 
 def signup(request):
     form = forms.SignupForm()
     if request.method == 'POST':
+        # before the password validation and hashing
+        wait = throttling.attempt(request, 'signup')
+        if wait:
+            return throttling.rejected(
+                request, 'authentication/signup.html', {'form': form}, wait)
         form = forms.SignupForm(request.POST)
         if form.is_valid():
             user = form.save()
-            # auto-login user
-            login(request, user)
+            # auto-login user, with the first of the backends
+            login(request, user, settings.AUTHENTICATION_BACKENDS[0])
             return redirect(settings.LOGIN_REDIRECT_URL)
     context = {'form': form}
     return render(request, 'authentication/signup.html', context)
@@ -24,6 +30,12 @@ def login_page(request):
     if request.method == 'POST':
         form = forms.LoginForm(request.POST)
         print("POST")
+        # before the password hashing of authenticate
+        wait = throttling.attempt(
+            request, 'login', request.POST.get('username'))
+        if wait:
+            return throttling.rejected(
+                request, 'authentication/login.html', {'form': form}, wait)
         if form.is_valid():
             print("valid")
             user = authenticate(
@@ -13,4 +13,14 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'litreview.settings')
 
-application = get_asgi_application()
+# the /api/ views are async and every middleware supports async requests:
+# served by an ASGI server (uvicorn litreview.asgi:application) a worker
+# waits for the database and the slow clients without a thread per request
+
+django_application = get_asgi_application()
+
+# the events stream (reviews.events) is served in front of Django,
+# an idle connection does not hold a thread
+from reviews.events import EventsRouter  # noqa: E402
+
+application = EventsRouter(django_application)
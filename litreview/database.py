@@ -0,0 +1,131 @@
+""" SQLite production profile
+    - WAL journal (readers do not block the writer and the writer does
+      not block the readers): a property of the file, set once by the
+      migration reviews 0013, not by every connection (a mere
+      "manage.py check" would rewrite the file)
+    - pragmas applied to every new connection (connection_created):
+      synchronous=NORMAL (safe with WAL, no fsync on each commit), memory
+      mapped reads, a larger page cache and a busy timeout instead of an
+      immediate "database is locked"
+    - persistent connections (CONN_MAX_AGE), not one by request
+    - a read-only alias on the same file: the reads of the GET and HEAD
+      requests go to it (ReadOnlyRequestMiddleware and ReadReplicaRouter)
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+READ_ALIAS = 'readonly'
+
+PRAGMAS = {
+    'synchronous': 'NORMAL',
+    # bytes of the file read through mmap
+    'mmap_size': 256 * 1024 * 1024,
+    # negative: size in KiB
+    'cache_size': -64 * 1024,
+    # milliseconds a connection waits for a lock
+    'busy_timeout': 5000,
+    'temp_store': 'MEMORY',
+}
+
+_reading = ContextVar('read_only_request', default=False)
+
+
+def sqlite_databases(path, conn_max_age=600):
+    """ DATABASES setting: the default alias and its read-only alias """
+    return {
+        DEFAULT_DB_ALIAS: {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': path,
+            'CONN_MAX_AGE': conn_max_age,
+            'CONN_HEALTH_CHECKS': True,
+            'PRAGMAS': PRAGMAS,
+        },
+        READ_ALIAS: {
+            'ENGINE': 'django.db.backends.sqlite3',
+            # the sqlite backend opens the database as an uri
+            'NAME': 'file:%s?mode=ro' % path,
+            'CONN_MAX_AGE': conn_max_age,
+            'CONN_HEALTH_CHECKS': True,
+            'PRAGMAS': PRAGMAS,
+            # the test database has no read-only copy
+            'TEST': {'MIRROR': DEFAULT_DB_ALIAS},
+        },
+    }
+
+
+@receiver(connection_created)
+def apply_pragmas(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in connection.settings_dict.get(
+                'PRAGMAS', {}).items():
+            cursor.execute('PRAGMA %s = %s' % (name, value))
+
+
+@contextmanager
+def reading():
+    """ the reads of the block may go to the read-only alias """
+    token = _reading.set(True)
+    try:
+        yield
+    finally:
+        _reading.reset(token)
+
+
+class ReadOnlyRequestMiddleware:
+    """ GET and HEAD requests read from the read-only alias
+        the context variable follows the async views in sync_to_async
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if request.method not in ('GET', 'HEAD'):
+            return self.get_response(request)
+        with reading():
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        if request.method not in ('GET', 'HEAD'):
+            return await self.get_response(request)
+        with reading():
+            return await self.get_response(request)
+
+
+class ReadReplicaRouter:
+    """ reads of a reading() block go to DATABASE_READ_ALIAS, unless
+        a transaction is open on the default alias (it would not see
+        the uncommitted writes). Everything is written to the default
+        alias, the objects read from the read-only one included
+    """
+
+    def db_for_read(self, model, **hints):
+        alias = getattr(settings, 'DATABASE_READ_ALIAS', None)
+        if alias and _reading.get() \
+                and not connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return alias
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # both aliases are the same database
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
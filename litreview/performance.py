@@ -0,0 +1,281 @@
+""" per-request performance instrumentation
+    PerformanceMiddleware measures, for each request, the SQL queries
+    (count and time, through connection.execute_wrapper), the view and
+    the template rendering (TimedDjangoTemplates backend). It sends them
+    in a Server-Timing header, logs the slow requests as JSON on the
+    "litreview.performance" logger and adds them to per-view histograms
+    served in the Prometheus text format by the staff-only metrics view.
+
+    The histograms are kept in memory, each server process has its own
+"""
+import json
+import logging
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import (
+    iscoroutinefunction, markcoroutinefunction, sync_to_async)
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.db import connections
+from django.http import HttpResponse
+from django.template.backends.django import DjangoTemplates
+
+logger = logging.getLogger('litreview.performance')
+
+# upper bounds of the histogram buckets
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+_current = ContextVar('request_timings', default=None)
+
+
+class Timings:
+    """ measures of the current request, in seconds """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.view_start = None
+        self.view = 0
+        # SQL time before the view (session, user)
+        self.sql_before_view = 0
+        self.sql = 0
+        self.sql_count = 0
+        self.template = 0
+        self.template_depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        """ execute wrapper of the database connections """
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql += time.perf_counter() - start
+            self.sql_count += 1
+
+
+@contextmanager
+def template_timer():
+    """ add the time of the block to the template time of the request
+        a template rendered while rendering another one is counted once
+    """
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    timings.template_depth += 1
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.template_depth -= 1
+        if not timings.template_depth:
+            timings.template += time.perf_counter() - start
+
+
+class TimedTemplate:
+    """ template of the Django backend adding its render time
+        to the current request
+    """
+
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        with template_timer():
+            return self.template.render(context, request)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """ loading (and compiling without the cached loader) and rendering
+        count as template time
+    """
+
+    def from_string(self, template_code):
+        with template_timer():
+            return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        with template_timer():
+            return TimedTemplate(super().get_template(template_name))
+
+
+class Histogram:
+    """ cumulative Prometheus histogram """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+
+class Registry:
+    """ histograms by metric and view """
+
+    METRICS = {
+        'litreview_request_duration_seconds': (
+            "Duration of the requests", DURATION_BUCKETS),
+        'litreview_request_sql_duration_seconds': (
+            "Time spent in SQL queries by request", DURATION_BUCKETS),
+        'litreview_request_template_duration_seconds': (
+            "Time spent rendering templates by request", DURATION_BUCKETS),
+        'litreview_request_sql_queries': (
+            "Number of SQL queries by request", QUERY_BUCKETS),
+    }
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+
+    def observe(self, view, values):
+        """ values: {metric name: value} """
+        with self.lock:
+            for metric, value in values.items():
+                key = (metric, view)
+                if key not in self.histograms:
+                    self.histograms[key] = Histogram(self.METRICS[metric][1])
+                self.histograms[key].observe(value)
+
+    def exposition(self):
+        """ the histograms in the Prometheus text format """
+        lines = []
+        with self.lock:
+            for metric, (description, _) in self.METRICS.items():
+                lines.append('# HELP %s %s' % (metric, description))
+                lines.append('# TYPE %s histogram' % metric)
+                for (name, view), histogram in sorted(
+                        self.histograms.items()):
+                    if name != metric:
+                        continue
+                    label = 'view="%s"' % view.replace('"', '\\"')
+                    for bound, count in zip(histogram.buckets,
+                                            histogram.counts):
+                        lines.append('%s_bucket{%s,le="%s"} %d' % (
+                            metric, label, bound, count))
+                    lines.append('%s_bucket{%s,le="+Inf"} %d' % (
+                        metric, label, histogram.count))
+                    lines.append('%s_sum{%s} %s' % (
+                        metric, label, round(histogram.sum, 6)))
+                    lines.append('%s_count{%s} %d' % (
+                        metric, label, histogram.count))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def wrap_connections(stack, timings):
+    """ count the queries of the connections of the current thread """
+    for connection in connections.all():
+        stack.enter_context(connection.execute_wrapper(timings))
+
+
+class PerformanceMiddleware:
+    """ first middleware of the list, to measure the whole request """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings = Timings()
+        token = _current.set(timings)
+        try:
+            with ExitStack() as stack:
+                wrap_connections(stack, timings)
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.measured(request, response, timings)
+
+    async def __acall__(self, request):
+        """ the async views run their queries in the sync_to_async thread
+            of the request, the wrappers are put on its connections
+        """
+        timings = Timings()
+        token = _current.set(timings)
+        stack = ExitStack()
+        try:
+            await sync_to_async(wrap_connections)(stack, timings)
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+            _current.reset(token)
+        return self.measured(request, response, timings)
+
+    def measured(self, request, response, timings):
+        """ add the measures of the request to the response and metrics """
+        total = time.perf_counter() - timings.start
+        if timings.view_start is not None:
+            timings.view = time.perf_counter() - timings.view_start
+        # what the view spends outside of the database and the templates:
+        # ORM hydration, sorting, forms...
+        python = max(timings.view - timings.template
+                     - (timings.sql - timings.sql_before_view), 0)
+
+        response['Server-Timing'] = ', '.join([
+            'sql;dur=%.1f;desc="%d queries"' % (timings.sql * 1000,
+                                                timings.sql_count),
+            'template;dur=%.1f' % (timings.template * 1000),
+            'python;dur=%.1f' % (python * 1000),
+            'view;dur=%.1f' % (timings.view * 1000),
+            'total;dur=%.1f' % (total * 1000),
+        ])
+
+        match = request.resolver_match
+        view = match.view_name if match else 'unresolved'
+        registry.observe(view, {
+            'litreview_request_duration_seconds': total,
+            'litreview_request_sql_duration_seconds': timings.sql,
+            'litreview_request_template_duration_seconds': timings.template,
+            'litreview_request_sql_queries': timings.sql_count,
+        })
+        if total * 1000 >= settings.SLOW_REQUEST_MS:
+            logger.warning(json.dumps({
+                'event': 'slow_request',
+                'method': request.method,
+                'path': request.path,
+                'view': view,
+                'status': response.status_code,
+                # only if already loaded, no query for the log
+                'user': getattr(getattr(request, '_cached_user', None),
+                                'pk', None),
+                'total_ms': round(total * 1000, 1),
+                'view_ms': round(timings.view * 1000, 1),
+                'sql_ms': round(timings.sql * 1000, 1),
+                'sql_queries': timings.sql_count,
+                'template_ms': round(timings.template * 1000, 1),
+                'python_ms': round(python * 1000, 1),
+            }))
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        timings = _current.get()
+        if timings is not None:
+            timings.view_start = time.perf_counter()
+            timings.sql_before_view = timings.sql
+
+
+@staff_member_required
+def metrics(request):
+    """ per-view histograms, Prometheus text format """
+    return HttpResponse(registry.exposition(),
+                        content_type='text/plain; version=0.0.4')
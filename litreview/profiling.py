@@ -0,0 +1,203 @@
+""" on-demand profiling of a request
+    a staff user adds ?_profile to the url (or sends the header
+    X-Profile: 1) to run the request under cProfile while a sampling
+    thread records its stacks. The pstats file and the collapsed stacks
+    (flamegraph.pl, speedscope) are written in PROFILES_DIR, only the
+    last PROFILES_KEPT profiles are kept, and listed on /admin/profiles/.
+
+    Without the switch the middleware only looks at the query string
+    and the headers
+"""
+import cProfile
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from asgiref.sync import (
+    iscoroutinefunction, markcoroutinefunction, sync_to_async)
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import FileResponse, Http404
+from django.shortcuts import render
+from django.utils import timezone
+
+QUERY_PARAMETER = '_profile'
+HEADER = 'HTTP_X_PROFILE'
+PROFILE_ID = re.compile(r'\d{8}T\d{12}-[0-9a-f]{8}')
+FILES = {'pstats': '.prof', 'collapsed': '.collapsed'}
+
+
+class Sampler(threading.Thread):
+    """ records the stack of a thread every interval
+        stacks are counted in the collapsed format: root;...;leaf
+    """
+
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append('%s (%s:%d)' % (
+                    code.co_qualname, os.path.basename(code.co_filename),
+                    code.co_firstlineno))
+                frame = frame.f_back
+            if frames:
+                self.stacks[';'.join(reversed(frames))] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def requested(request):
+    return QUERY_PARAMETER in request.GET or request.META.get(HEADER) == '1'
+
+
+class ProfilerMiddleware:
+    """ after AuthenticationMiddleware, the switch is for staff only """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not requested(request) or not request.user.is_staff:
+            return self.get_response(request)
+
+        sampler, profiler, start = self.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            duration = self.stop(sampler, profiler, start)
+        return self.saved(request, response, sampler, profiler, duration)
+
+    async def __acall__(self, request):
+        """ an async view is profiled in the thread of the event loop:
+            the other requests served meanwhile are in the profile, the
+            queries run by sync_to_async are not
+        """
+        if not requested(request) or not await sync_to_async(
+                lambda: request.user.is_staff)():
+            return await self.get_response(request)
+
+        sampler, profiler, start = self.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            duration = self.stop(sampler, profiler, start)
+        return await sync_to_async(self.saved)(
+            request, response, sampler, profiler, duration)
+
+    def start(self):
+        sampler = Sampler(threading.get_ident(),
+                          settings.PROFILE_SAMPLE_INTERVAL)
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        sampler.start()
+        profiler.enable()
+        return sampler, profiler, start
+
+    def stop(self, sampler, profiler, start):
+        """ stop profiling, return the duration """
+        profiler.disable()
+        sampler.stop()
+        return time.perf_counter() - start
+
+    def saved(self, request, response, sampler, profiler, duration):
+        profile_id = save(request, response, profiler, sampler.stacks,
+                          duration)
+        response['X-Profile-Id'] = profile_id
+        return response
+
+
+def path(profile_id, extension):
+    return os.path.join(settings.PROFILES_DIR, profile_id + extension)
+
+
+def save(request, response, profiler, stacks, duration):
+    """ write the profile files, drop the oldest profiles
+        the .json file is written last, a profile is listed once complete
+    """
+    os.makedirs(settings.PROFILES_DIR, exist_ok=True)
+    now = timezone.now()
+    profile_id = '%s-%s' % (now.strftime('%Y%m%dT%H%M%S%f'),
+                            uuid.uuid4().hex[:8])
+    profiler.dump_stats(path(profile_id, FILES['pstats']))
+    with open(path(profile_id, FILES['collapsed']), 'w') as collapsed:
+        for stack, count in stacks.most_common():
+            collapsed.write('%s %d\n' % (stack, count))
+    match = request.resolver_match
+    with open(path(profile_id, '.json'), 'w') as meta:
+        json.dump({
+            'id': profile_id,
+            'time': now.isoformat(),
+            'method': request.method,
+            'path': request.get_full_path(),
+            'view': match.view_name if match else None,
+            'user': request.user.get_username(),
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 1),
+            'samples': sum(stacks.values()),
+        }, meta)
+    for old in recent()[settings.PROFILES_KEPT:]:
+        for extension in list(FILES.values()) + ['.json']:
+            try:
+                os.remove(path(old['id'], extension))
+            except FileNotFoundError:
+                pass
+    return profile_id
+
+
+def recent():
+    """ metadata of the saved profiles, most recent first """
+    if not os.path.isdir(settings.PROFILES_DIR):
+        return []
+    profiles = []
+    for name in sorted(os.listdir(settings.PROFILES_DIR), reverse=True):
+        if name.endswith('.json'):
+            try:
+                with open(os.path.join(settings.PROFILES_DIR, name)) as meta:
+                    profiles.append(json.load(meta))
+            except (OSError, ValueError):
+                continue
+    return profiles
+
+
+@staff_member_required
+def profiles(request):
+    """ admin page listing the recent profiles """
+    return render(request, 'admin/profiles.html', {
+        **admin.site.each_context(request),
+        'title': "Profils des requêtes",
+        'profiles': recent(),
+    })
+
+
+@staff_member_required
+def profile_file(request, profile_id, kind):
+    """ download of a pstats or collapsed stacks file """
+    if not PROFILE_ID.fullmatch(profile_id) or kind not in FILES:
+        raise Http404()
+    file_path = path(profile_id, FILES[kind])
+    if not os.path.exists(file_path):
+        raise Http404()
+    return FileResponse(open(file_path, 'rb'), as_attachment=True)
@@ -13,6 +13,8 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 from pathlib import Path
 import os
 
+from litreview import database
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -43,11 +45,17 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # first, measures the whole request
+    "litreview.performance.PerformanceMiddleware",
     "django.middleware.security.SecurityMiddleware",
+    # before the session and user loading, they are reads
+    "litreview.database.ReadOnlyRequestMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    # ?_profile for staff users, needs the user
+    "litreview.profiling.ProfilerMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -56,7 +64,8 @@ ROOT_URLCONF = "litreview.urls"
 
 TEMPLATES = [
     {
-        "BACKEND": "django.template.backends.django.DjangoTemplates",
+        # Django templates, measuring the render time of the requests
+        "BACKEND": "litreview.performance.TimedDjangoTemplates",
         "DIRS": [
             BASE_DIR.joinpath("templates"),
         ],
@@ -78,12 +87,32 @@ WSGI_APPLICATION = "litreview.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
-DATABASES = {
+# SQLite profile (litreview.database): WAL and tuned pragmas, persistent
+# connections, the reads of the GET requests go to a read-only alias
+DATABASES = database.sqlite_databases(BASE_DIR / "db.sqlite3")
+DATABASE_ROUTERS = ["litreview.database.ReadReplicaRouter"]
+DATABASE_READ_ALIAS = database.READ_ALIAS
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# the local memory cache is per process, use a shared backend
+# (memcached, redis) when running several workers
+
+CACHES = {
     "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        # cards and follow graph entries are per post and per user,
+        # the default 300 entries would be culled all the time
+        "OPTIONS": {"MAX_ENTRIES": 50000},
     }
 }
+# the cache is seen by every process: the changes stored in it by a
+# worker (logout, follow...) are seen by the others
+SHARED_CACHE = CACHES['default']['BACKEND'] not in (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
 
 
 # Password validation
@@ -133,6 +162,38 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 # application authentication settings
 AUTH_USER_MODEL = "authentication.User"
 
+# the users of the sessions are kept in memory by the first backend,
+# the sessions opened with ModelBackend before stay valid
+AUTHENTICATION_BACKENDS = [
+    'authentication.backends.CachedModelBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+# in-memory users older than this are loaded again. The versions of the
+# users are in the cache: without a shared cache another worker would not
+# see a password change or a deactivation, the users are loaded on every
+# request
+USER_CACHE_SECONDS = 300 if SHARED_CACHE else 0
+
+# login and signup attempts (authentication.throttling): scope:
+# (burst, seconds to refill one attempt), kept in the cache
+THROTTLE_RATES = {
+    'login_ip': (10, 6),
+    'login_username': (5, 60),
+    'signup_ip': (5, 60),
+}
+
+# conditional GET of the feed pages (reviews.conditional): the changes are
+# stamped in the cache, with a per process cache the other workers and the
+# management commands would leave stale pages served. Enabled with a
+# shared cache backend only
+CONDITIONAL_GET = SHARED_CACHE
+
+# sessions read from the cache, written through to the database. Not with
+# a per process cache: a session closed by a worker would stay open in the
+# others
+if SHARED_CACHE:
+    SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
 LOGIN_URL = 'login'
 LOGIN_REDIRECT_URL = 'home'
 LOGOUT_REDIRECT_URL = LOGIN_URL
@@ -141,3 +202,54 @@ LOGOUT_REDIRECT_URL = LOGIN_URL
 # media storage
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR.joinpath('media/')
+
+# materialized feed: the posts of users having more followers than this
+# limit are not copied in every follower feed but merged at read time
+# (run "manage.py rebuild_feed" after raising it)
+FEED_FANOUT_FOLLOWER_LIMIT = 1000
+# the follow graph cache (reviews.follow_graph) is updated in place by the
+# worker handling a follow, the others see it once their entries expire:
+# a day with a shared cache, a few seconds with a per process cache
+FOLLOW_GRAPH_SECONDS = 24 * 60 * 60 if SHARED_CACHE else 10
+# the feeds read the follower counts from the cache, which may lag behind
+# the database used by the fan-out: the posts of users having more than
+# the limit minus this margin are merged at read time too
+FEED_MERGE_FOLLOWER_MARGIN = 100
+
+# ticket images: number of background threads building the thumbnails,
+# 0 builds them in the request once the ticket is saved
+IMAGE_WORKERS = 2
+
+# performance instrumentation: requests slower than this are logged
+# on the "litreview.performance" logger
+SLOW_REQUEST_MS = 500
+
+# on-demand profiling (?_profile): directory of the profiles, number of
+# profiles kept and interval of the stack samples in seconds
+PROFILES_DIR = BASE_DIR.joinpath('profiles')
+PROFILES_KEPT = 50
+PROFILE_SAMPLE_INTERVAL = 0.001
+
+# real-time events (reviews.events): the in-process bus serves the streams
+# of a single worker process, with several workers use
+# "reviews.events.SocketBus" and run "manage.py run_event_broker"
+EVENT_BUS = 'reviews.events.LocalBus'
+EVENT_BROKER_SOCKET = BASE_DIR.joinpath('events.sock')
+# comment sent to the idle streams, and lifetime of a stream in seconds
+EVENTS_HEARTBEAT_SECONDS = 25
+EVENTS_STREAM_SECONDS = 600
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        "litreview.performance": {
+            "handlers": ["console"],
+            "level": "WARNING",
+            "propagate": False,
+        },
+    },
+}
@@ -22,9 +22,16 @@ from django.contrib.auth.views import (
     LogoutView, PasswordChangeView, PasswordChangeDoneView)
 
 import authentication.views
+import litreview.performance
+import litreview.profiling
 import reviews.views
 
 urlpatterns = [
+    # before the admin urls, under the admin prefix
+    path('admin/profiles/', litreview.profiling.profiles, name='profiles'),
+    path('admin/profiles/<str:profile_id>/<str:kind>/',
+         litreview.profiling.profile_file,
+         name='profile_file'),
     path("admin/", admin.site.urls),
     path("", authentication.views.login_page, name="login"),
     path('logout/', LogoutView.as_view(), name='logout'),
@@ -64,9 +71,21 @@ urlpatterns = [
     path('follow/followership/',
          reviews.views.follow_user,
          name='follow_user'),
+    path('follow/autocomplete/',
+         reviews.views.follow_user_autocomplete,
+         name='follow_user_autocomplete'),
     path('follow/delete/',
          reviews.views.unfollow_user,
          name='unfollow_user'),
+    path('export/', reviews.views.export, name='export'),
+    path('search/', reviews.views.search, name='search'),
+    # async JSON pages, served by litreview.asgi
+    path('api/home/', reviews.views.api_home, name='api_home'),
+    path('api/feed/', reviews.views.api_feed, name='api_feed'),
+    path('api/posts/', reviews.views.api_posts, name='api_posts'),
+    # Server-Sent Events, streamed by reviews.events.EventsRouter
+    path('events/', reviews.views.events, name='events'),
+    path('metrics/', litreview.performance.metrics, name='metrics'),
 ]
 
 if settings.DEBUG:
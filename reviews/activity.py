@@ -0,0 +1,142 @@
+""" latest site-wide activity shown on the homepage
+    the most recent tickets and reviews are kept in the cache framework
+    and updated from the Ticket and Review signals, a cache hit costs
+    no database query.
+
+    A stored list is tagged with a version number, writers that cannot
+    update the list in place bump the version, which invalidates any list
+    built concurrently. Only one process rebuilds a missing list, the
+    others wait for it (stampede guard).
+"""
+import time
+
+from django.core.cache import cache
+
+from . import feed as feed_engine
+
+LATEST_ACTIVITY_SIZE = 3
+
+ITEMS_KEY = 'reviews:latest_activity'
+VERSION_KEY = 'reviews:latest_activity:version'
+LOCK_KEY = 'reviews:latest_activity:lock'
+ITEMS_TIMEOUT = 60 * 60
+LOCK_TIMEOUT = 10
+# how long a process waits for another one to rebuild the list
+WAIT_STEP = 0.05
+WAIT_STEPS = 20
+
+
+def latest_activity():
+    """ most recent tickets and reviews of the whole site """
+    for _ in range(WAIT_STEPS):
+        items, version = _cached()
+        if items is not None:
+            return items
+        if cache.add(LOCK_KEY, True, LOCK_TIMEOUT):
+            try:
+                items = _query()
+                cache.set(ITEMS_KEY, {'version': version, 'items': items},
+                          ITEMS_TIMEOUT)
+                return items
+            finally:
+                cache.delete(LOCK_KEY)
+        time.sleep(WAIT_STEP)
+    # the rebuild takes too long, do not wait any longer
+    return _query()
+
+
+def post_saved(post, content_type):
+    """ insert or refresh a created or edited post """
+    def change(items):
+        post_id = (content_type, post.id)
+        fresh = feed_engine.hydrate([{'id': post.id,
+                                      'time_created': post.time_created,
+                                      'content_type': content_type}])
+        items = [item for item in items
+                 if (item.content_type, item.id) != post_id]
+        if content_type == feed_engine.TICKET:
+            # the reviews display the title of their ticket
+            for item in items:
+                if item.content_type == feed_engine.REVIEW \
+                        and item.ticket_id == post.id and fresh:
+                    item.ticket = fresh[0]
+        items = sorted(items + fresh, key=_sort_key, reverse=True)
+        return items[:LATEST_ACTIVITY_SIZE]
+    _update(change)
+
+
+def post_deleted(content_type, item_id):
+    """ remove a deleted post, the list is rebuilt if it was displayed """
+    def change(items):
+        if any((item.content_type, item.id) == (content_type, item_id)
+               for item in items):
+            return _query()
+        return items
+    _update(change)
+
+
+def tickets_reviewed(ticket_ids):
+    """ refresh the displayed tickets whose reviews changed, they show
+        the review aggregates
+    """
+    def change(items):
+        rows = [{'id': item.id, 'time_created': item.time_created,
+                 'content_type': item.content_type} for item in items
+                if item.content_type == feed_engine.TICKET
+                and item.id in ticket_ids]
+        if not rows:
+            return items
+        fresh = {item.id: item for item in feed_engine.hydrate(rows)}
+        # a deleted ticket is removed by post_deleted
+        return [fresh.get(item.id, item)
+                if item.content_type == feed_engine.TICKET else item
+                for item in items]
+    _update(change)
+
+
+def invalidate():
+    """ drop the cached list, after changes made without signals """
+    _bump_version()
+
+
+def _sort_key(item):
+    return item.time_created, item.content_type, item.id
+
+
+def _query():
+    return feed_engine.general_feed()[:LATEST_ACTIVITY_SIZE]
+
+
+def _cached():
+    """ (items, version) items is None if missing or outdated """
+    values = cache.get_many([ITEMS_KEY, VERSION_KEY])
+    version = values.get(VERSION_KEY, 0)
+    stored = values.get(ITEMS_KEY)
+    if stored is None or stored['version'] != version:
+        return None, version
+    return stored['items'], version
+
+
+def _update(change):
+    """ apply change(items) to the cached list under the lock
+        invalidate the list if the lock is not available
+    """
+    if not cache.add(LOCK_KEY, True, LOCK_TIMEOUT):
+        _bump_version()
+        return
+    try:
+        items, version = _cached()
+        if items is not None:
+            cache.set(ITEMS_KEY, {'version': version, 'items': change(items)},
+                      ITEMS_TIMEOUT)
+    finally:
+        cache.delete(LOCK_KEY)
+
+
+def _bump_version():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        # no version yet
+        if not cache.add(VERSION_KEY, 1, None):
+            cache.incr(VERSION_KEY)
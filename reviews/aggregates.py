@@ -0,0 +1,112 @@
+""" aggregates of the reviews of each ticket (review_count, rating_sum,
+    last_review_at) stored on the ticket
+    updated with F() expressions from the review signals, in the
+    transaction of the review, without reading the ticket. Reviews written
+    without signals (bulk import, seeding) refresh their tickets, and
+    reconcile repairs any drift in batches of tickets
+"""
+from django.db.models import Count, F, Max, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from . import models
+
+RECONCILE_BATCH_SIZE = 1000
+
+
+def review_created(review):
+    models.Ticket.objects.filter(id=review.ticket_id).update(
+        review_count=F('review_count') + 1,
+        rating_sum=F('rating_sum') + review.rating,
+        last_review_at=Greatest(
+            Coalesce('last_review_at', Value(review.time_created)),
+            Value(review.time_created)))
+
+
+def _latest_review():
+    return Subquery(models.Review.objects.filter(
+        ticket=OuterRef('pk')).order_by('-time_created').values(
+        'time_created')[:1])
+
+
+def review_removed(ticket_id, rating):
+    """ after the delete of a review, its rating and its ticket id """
+    models.Ticket.objects.filter(id=ticket_id).update(
+        review_count=F('review_count') - 1,
+        rating_sum=F('rating_sum') - rating,
+        last_review_at=_latest_review())
+
+
+def review_changed(review):
+    """ after the save of an edited review, by difference with the
+        rating and the ticket it was loaded with
+    """
+    ticket_id = getattr(review, 'loaded_ticket_id', None)
+    rating = getattr(review, 'loaded_rating', None)
+    if ticket_id is None:
+        # not loaded from the database, counted again
+        refresh([review.ticket_id])
+    elif ticket_id != review.ticket_id:
+        review_removed(ticket_id, rating)
+        review_created(review)
+    elif rating != review.rating:
+        models.Ticket.objects.filter(id=review.ticket_id).update(
+            rating_sum=F('rating_sum') + (review.rating - rating))
+    review.loaded_ticket_id = review.ticket_id
+    review.loaded_rating = review.rating
+
+
+def actual(ticket_ids):
+    """ {ticket id: (count, sum, last)} computed from the reviews """
+    aggregates = dict.fromkeys(ticket_ids, (0, 0, None))
+    rows = models.Review.objects.filter(ticket_id__in=ticket_ids).values(
+        'ticket_id').annotate(count=Count('id'), sum=Sum('rating'),
+                              last=Max('time_created'))
+    for row in rows:
+        aggregates[row['ticket_id']] = (row['count'], row['sum'],
+                                        row['last'])
+    return aggregates
+
+
+def repair(tickets, aggregates):
+    """ write the aggregates that differ, return the number of tickets """
+    drifted = []
+    for ticket in tickets:
+        count, rating_sum, last = aggregates[ticket.id]
+        if (ticket.review_count, ticket.rating_sum,
+                ticket.last_review_at) != (count, rating_sum, last):
+            ticket.review_count = count
+            ticket.rating_sum = rating_sum
+            ticket.last_review_at = last
+            drifted.append(ticket)
+    models.Ticket.objects.bulk_update(drifted, models.Ticket.AGGREGATE_FIELDS)
+    return len(drifted)
+
+
+def refresh(ticket_ids):
+    """ count again the reviews of some tickets """
+    ticket_ids = list(ticket_ids)
+    if ticket_ids:
+        tickets = models.Ticket.objects.filter(id__in=ticket_ids).only(
+            'id', *models.Ticket.AGGREGATE_FIELDS)
+        repair(tickets, actual(ticket_ids))
+
+
+def reconcile(batch_size=RECONCILE_BATCH_SIZE, progress=None):
+    """ compare the stored aggregates of all the tickets with their
+        reviews, in batches of tickets, and repair the drifted ones.
+        progress(checked, repaired) is called after each batch.
+        Return the number of repaired tickets
+    """
+    checked = repaired = 0
+    last_id = 0
+    while True:
+        tickets = list(models.Ticket.objects.filter(id__gt=last_id).order_by(
+            'id').only('id', *models.Ticket.AGGREGATE_FIELDS)[:batch_size])
+        if not tickets:
+            break
+        last_id = tickets[-1].id
+        repaired += repair(tickets, actual([ticket.id for ticket in tickets]))
+        checked += len(tickets)
+        if progress:
+            progress(checked, repaired)
+    return repaired
@@ -0,0 +1,65 @@
+""" compact JSON pages of the feeds, for the async API views
+    a post is a flat object, the cursors of the page are next to its
+    items. With ?cards=1 each item also holds its rendered card (from the
+    card cache), the infinite scroll script appends them to the page
+"""
+from django.http import JsonResponse
+
+from . import feed as feed_engine
+
+# no spaces, accents not escaped
+JSON_PARAMS = {'separators': (',', ':'), 'ensure_ascii': False}
+
+
+def ticket_data(ticket):
+    return {
+        'type': feed_engine.TICKET,
+        'id': ticket.id,
+        'user': ticket.user.username,
+        'time': ticket.time_created,
+        'title': ticket.title,
+        'description': ticket.description,
+        'image': ticket.image_url if ticket.image else None,
+        'review_count': ticket.review_count,
+        'average_rating': ticket.average_rating,
+    }
+
+
+def review_data(review):
+    return {
+        'type': feed_engine.REVIEW,
+        'id': review.id,
+        'user': review.user.username,
+        'time': review.time_created,
+        'headline': review.headline,
+        'body': review.body,
+        'rating': review.rating,
+        'ticket': ticket_data(review.ticket),
+    }
+
+
+def post_data(post, with_card=False):
+    if post.content_type == feed_engine.TICKET:
+        data = ticket_data(post)
+        data['reviewed'] = post.already_reviewed
+    else:
+        data = review_data(post)
+    if with_card:
+        data['card'] = post.card
+    return data
+
+
+def posts_data(posts, with_card=False):
+    return [post_data(post, with_card) for post in posts]
+
+
+def page_data(page, with_card=False):
+    return {
+        'items': posts_data(page, with_card),
+        'next': page.next_cursor,
+        'previous': page.previous_cursor,
+    }
+
+
+def response(data):
+    return JsonResponse(data, json_dumps_params=JSON_PARAMS)
@@ -0,0 +1,285 @@
+""" bulk import of tickets, reviews and follows
+    the records (NDJSON lines or CSV rows, the format of reviews.export
+    with a user column) are read one at a time and imported by batches:
+    one transaction, one query for the usernames and one bulk insert by
+    model per batch. The signals are not sent by bulk_create, the feeds
+    are filled with one fan-out per batch and the images are queued for
+    the image workers.
+
+    Each batch is recorded in a checkpoint in its transaction, an import
+    run again with the same checkpoint restarts after the last batch
+"""
+import csv
+import json
+import os
+from collections import Counter
+from itertools import islice
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import SuspiciousOperation, ValidationError
+from django.core.files import File
+from django.db import transaction
+
+from . import activity
+from . import aggregates
+from . import conditional
+from . import fanout
+from . import follow_graph
+from . import images
+from . import models
+
+BATCH_SIZE = 1000
+
+
+def read_records(path, input_format):
+    """ records of the file as dicts, None for an unreadable line """
+    with open(path, encoding='utf-8', newline='') as source:
+        if input_format == 'csv':
+            for row in csv.DictReader(source):
+                # empty cells are missing values
+                yield {key: value for key, value in row.items()
+                       if value not in ('', None)}
+        else:
+            for line in source:
+                if not line.strip():
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    yield None
+
+
+class Checkpoint:
+    """ batches of an import, one models.ImportCheckpoint row by batch
+        saved in the transaction of the batch: a batch is either imported
+        and recorded or neither
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def load(self):
+        """ position to restart from and the ids of the imported tickets """
+        position, tickets = 0, {}
+        for batch_position, batch_tickets in \
+                models.ImportCheckpoint.objects.filter(
+                    name=self.name).order_by('position').values_list(
+                    'position', 'tickets'):
+            position = batch_position
+            tickets.update(batch_tickets)
+        return position, tickets
+
+    def save(self, position, tickets):
+        models.ImportCheckpoint.objects.create(
+            name=self.name, position=position, tickets=tickets)
+
+
+class Importer:
+    """ imports batches of (number, record) tuples
+        tickets maps the ticket ids of the file to the imported ones,
+        a review refers to a ticket of the file or else to an existing
+        ticket
+    """
+
+    def __init__(self, default_username=None, image_directory='.',
+                 tickets=None, report=None):
+        self.default_username = default_username
+        self.image_directory = image_directory
+        self.tickets = tickets if tickets is not None else {}
+        # report(record number, error) of the rejected records
+        self.report = report
+        self.counts = Counter()
+        self.storage = models.Ticket._meta.get_field('image').storage
+
+    def run(self, records, checkpoint=None, position=0,
+            batch_size=BATCH_SIZE, progress=None):
+        """ import the records after position
+            progress(imported records) is called after each batch
+        """
+        numbered = islice(enumerate(records, 1), position, None)
+        while True:
+            batch = list(islice(numbered, batch_size))
+            if not batch:
+                break
+            self.import_batch(batch, checkpoint)
+            if progress is not None:
+                progress(len(batch))
+
+    def reject(self, number, error):
+        self.counts['rejected'] += 1
+        if self.report is not None:
+            self.report(number, error)
+
+    @transaction.atomic
+    def import_batch(self, batch, checkpoint=None):
+        """ import one batch and record it in the checkpoint,
+            return the tickets added to the mapping
+        """
+        users = self.users(batch)
+        tickets, reviews, follows = [], [], []
+        for number, record in batch:
+            if not isinstance(record, dict):
+                self.reject(number, "unreadable record")
+                continue
+            kind = record.get('type')
+            if kind == 'ticket':
+                tickets.append((number, record))
+            elif kind == 'review':
+                reviews.append((number, record))
+            elif kind == 'follow':
+                follows.append((number, record))
+            else:
+                self.reject(number, "unknown type %r" % kind)
+
+        # tickets first, the reviews of the batch may refer to them
+        added = self.import_tickets(tickets, users)
+        self.import_reviews(reviews, users)
+        self.import_follows(follows, users)
+        if checkpoint is not None:
+            checkpoint.save(batch[-1][0], added)
+        # the home page shows the latest posts
+        transaction.on_commit(activity.invalidate)
+        transaction.on_commit(conditional.invalidate)
+        return added
+
+    def users(self, batch):
+        """ {username: id} of the users of the batch, one query """
+        usernames = {self.default_username}
+        for _, record in batch:
+            if isinstance(record, dict):
+                usernames.update([record.get('user'),
+                                  record.get('followed_user')])
+        usernames.discard(None)
+        return dict(get_user_model().objects.filter(
+            username__in=usernames).values_list('username', 'id'))
+
+    def user_id(self, record, users, field='user'):
+        username = record.get(field)
+        if username is None and field == 'user':
+            username = self.default_username
+        if username not in users:
+            raise ValueError("unknown user %r" % username)
+        return users[username]
+
+    def image(self, name):
+        """ stored name of the image of a record
+            an already stored file or a file next to the imported one
+        """
+        if self.storage.exists(name):
+            # referenced like an upload, then looked up again: it may
+            # have been released meanwhile
+            images.reference(name)
+            if self.storage.exists(name):
+                return name
+            images.dereference(name)
+        with open(os.path.join(self.image_directory, name), 'rb') as image:
+            return self.storage.save(os.path.basename(name), File(image))
+
+    def import_tickets(self, records, users):
+        objects, sources = [], []
+        for number, record in records:
+            try:
+                ticket = models.Ticket(
+                    user_id=self.user_id(record, users),
+                    title=record.get('title', ''),
+                    description=record.get('description', ''))
+                ticket.clean_fields(exclude=['user', 'image'])
+                # stored and referenced once the record is valid, a
+                # rejected record would keep its image forever
+                if record.get('image'):
+                    ticket.image = self.image(record['image'])
+            except (OSError, SuspiciousOperation, ValueError,
+                    ValidationError) as error:
+                self.reject(number, error)
+                continue
+            objects.append(ticket)
+            sources.append(record.get('id'))
+
+        models.Ticket.objects.bulk_create(objects)
+        added = {}
+        for source, ticket in zip(sources, objects):
+            if source is not None:
+                added[str(source)] = ticket.id
+            if ticket.image:
+                images.schedule(ticket.id)
+                self.counts['image'] += 1
+        self.tickets.update(added)
+        fanout.fan_out_posts(fanout.TICKET, [
+            (ticket.id, ticket.user_id, ticket.time_created, None)
+            for ticket in objects])
+        self.counts['ticket'] += len(objects)
+        return added
+
+    def import_reviews(self, records, users):
+        ticket_ids = {}
+        for number, record in records:
+            source = str(record.get('ticket'))
+            ticket_ids[number] = self.tickets.get(source, source)
+        owners = dict(models.Ticket.objects.filter(
+            id__in=[ticket_id for ticket_id in ticket_ids.values()
+                    if str(ticket_id).isdigit()]
+        ).values_list('id', 'user_id'))
+
+        objects = []
+        for number, record in records:
+            try:
+                ticket_id = int(ticket_ids[number])
+                if ticket_id not in owners:
+                    raise ValueError(
+                        "unknown ticket %r" % record.get('ticket'))
+                review = models.Review(
+                    ticket_id=ticket_id,
+                    user_id=self.user_id(record, users),
+                    rating=record.get('rating'),
+                    headline=record.get('headline', ''),
+                    body=record.get('body', ''))
+                review.clean_fields(exclude=['ticket', 'user'])
+            except (ValueError, ValidationError) as error:
+                self.reject(number, error)
+                continue
+            objects.append(review)
+
+        models.Review.objects.bulk_create(objects)
+        aggregates.refresh({review.ticket_id for review in objects})
+        fanout.fan_out_posts(fanout.REVIEW, [
+            (review.id, review.user_id, review.time_created,
+             owners[review.ticket_id])
+            for review in objects])
+        self.counts['review'] += len(objects)
+
+    def import_follows(self, records, users):
+        objects = []
+        for number, record in records:
+            try:
+                follow = models.UserFollows(
+                    user_id=self.user_id(record, users),
+                    followed_user_id=self.user_id(
+                        record, users, 'followed_user'))
+                if follow.user_id == follow.followed_user_id:
+                    raise ValueError("a user cannot follow itself")
+            except ValueError as error:
+                self.reject(number, error)
+                continue
+            objects.append(follow)
+
+        # the follows already present (or twice in the batch) are ignored
+        present = set(models.UserFollows.objects.filter(
+            user_id__in={follow.user_id for follow in objects},
+            followed_user_id__in={follow.followed_user_id
+                                  for follow in objects},
+        ).values_list('user_id', 'followed_user_id')) if objects else set()
+        new_objects = []
+        for follow in objects:
+            pair = (follow.user_id, follow.followed_user_id)
+            if pair not in present:
+                present.add(pair)
+                new_objects.append(follow)
+        objects = new_objects
+        # and those created meanwhile by the site
+        models.UserFollows.objects.bulk_create(objects, ignore_conflicts=True)
+        fanout.follows_created(objects)
+        if objects:
+            user_ids = {follow.user_id for follow in objects} | {
+                follow.followed_user_id for follow in objects}
+            transaction.on_commit(lambda: follow_graph.invalidate(user_ids))
+        self.counts['follow'] += len(objects)
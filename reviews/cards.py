@@ -0,0 +1,78 @@
+""" cache of the rendered feed cards
+    each post has one cache entry holding its rendered variants:
+    card template, page, versions of the post (and of its ticket for a
+    review) and the viewer-relative bits ("Vous" or the username).
+    A page fetches the cards of all its posts in one cache call,
+    edits and deletes drop the entry of the post
+"""
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from . import models
+
+CARD_TIMEOUT = 24 * 60 * 60
+
+TICKET = models.FeedEntry.TICKET
+REVIEW = models.FeedEntry.REVIEW
+
+
+def card_key(content_type, item_id):
+    return 'reviews:card:%s:%s' % (content_type, item_id)
+
+
+def variant(request, post, template_name, path):
+    """ everything the rendered card depends on, besides the post id """
+    versions = [post.time_updated.isoformat()]
+    ticket = post
+    if post.content_type == REVIEW:
+        ticket = post.ticket
+        versions.append(ticket.time_updated.isoformat())
+    # the thumbnail is built after the ticket is saved
+    versions.append('ready' if ticket.thumbnail_ready else 'processing')
+    return '|'.join([
+        template_name,
+        path,
+        ','.join(versions),
+        'own' if post.user_id == request.user.id else 'other',
+        # written with update(), time_updated does not change
+        '%d,%d' % (ticket.review_count, ticket.rating_sum),
+    ])
+
+
+def render_cards(request, posts, template_name, cached=True, path=None):
+    """ set post.card to the rendered card of each post
+        only the cards missing from the cache are rendered.
+        path is the page the card links come back to, the requested one
+        by default
+    """
+    path = path or request.path
+    posts = list(posts)
+    keys = [card_key(post.content_type, post.id) for post in posts]
+    stored = cache.get_many(keys) if cached else {}
+
+    rendered = {}
+    for key, post in zip(keys, posts):
+        cards = stored.get(key, {})
+        name = variant(request, post, template_name, path)
+        if name not in cards:
+            cards = rendered.setdefault(key, dict(cards))
+            cards[name] = render_to_string(
+                template_name, {'post': post, 'page_path': path}, request)
+        post.card = mark_safe(cards[name])
+
+    if cached and rendered:
+        cache.set_many(rendered, CARD_TIMEOUT)
+    return posts
+
+
+def invalidate(content_type, item_id):
+    """ drop the cards of an edited or deleted post
+        the cards of the reviews of an edited ticket display the ticket
+    """
+    keys = [card_key(content_type, item_id)]
+    if content_type == TICKET:
+        keys += [card_key(REVIEW, review_id) for review_id in
+                 models.Review.objects.filter(
+                     ticket_id=item_id).values_list('id', flat=True)]
+    cache.delete_many(keys)
@@ -0,0 +1,184 @@
+""" conditional GET of the feed pages (ETag / Last-Modified)
+    each change a page depends on stamps its time in a cache key (scope):
+    the posts of a user (created, edited, deleted, processed image,
+    renamed author, reviewed tickets), the follows of a user, and the
+    whole site for the latest activity.
+    The stamps are set after the commit, from reviews.signals.
+
+    The validators of a page are computed from the stamps of its scopes,
+    the viewer, its CSRF secret (in the forms of the page) and the full
+    path (cursor), in one cache read: a client having the page up to
+    date gets a 304 before the feed is queried or rendered.
+
+    A missing stamp (evicted) is created with the current time, the page
+    is rendered again, never served stale.
+
+    The stamps must be seen by every process: without a shared cache
+    backend (settings.CONDITIONAL_GET) the pages are always rendered
+"""
+import functools
+import hashlib
+import time
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+from . import follow_graph
+from . import models
+
+STAMP_TIMEOUT = 7 * 24 * 60 * 60
+
+SITE = 'site'
+# changed by the imports made without signals
+ALL = 'all'
+
+
+def stamp_key(scope):
+    return 'reviews:conditional:%s' % scope
+
+
+def posts_scope(user_id):
+    return 'posts:%s' % user_id
+
+
+def follows_scope(user_id):
+    return 'follows:%s' % user_id
+
+
+def touch(scopes):
+    now = time.time()
+    cache.set_many({stamp_key(scope): now for scope in scopes},
+                   STAMP_TIMEOUT)
+
+
+def stamps(scopes):
+    """ stamps of the scopes, the missing ones are created """
+    keys = [stamp_key(scope) for scope in scopes]
+    values = cache.get_many(keys)
+    missing = {key: time.time() for key in keys if key not in values}
+    if missing:
+        cache.set_many(missing, STAMP_TIMEOUT)
+        values.update(missing)
+    return [values[key] for key in keys]
+
+
+def posts_scopes(user):
+    return [ALL, posts_scope(user.id)]
+
+
+def feed_scopes(user):
+    """ the posts of the user (and the reviews answering its tickets)
+        and of its follows, no query when the follow graph is cached
+    """
+    # loaded as the feed needs it
+    followed = follow_graph.following(user.id, with_counts=True)
+    return [ALL, posts_scope(user.id), follows_scope(user.id)] + [
+        posts_scope(followed_id) for followed_id in followed]
+
+
+def home_scopes(user):
+    return feed_scopes(user) + [SITE]
+
+
+def validators(request, scopes):
+    """ (etag, last modified timestamp) of the page of the request """
+    values = stamps(scopes)
+    digest = hashlib.md5(repr((
+        request.get_full_path(), request.user.id,
+        request.META.get('CSRF_COOKIE'), values,
+    )).encode(), usedforsecurity=False).hexdigest()
+    return '"%s"' % digest, max(values)
+
+
+def page(scopes):
+    """ decorator answering 304 to the clients having the page up to
+        date, scopes(user) gives the scopes of the page.
+        For sync and async views, after the login check
+    """
+    def check(request):
+        """ (etag, last modified, 304 response or None) """
+        etag, last_modified = validators(request, scopes(request.user))
+        response = get_conditional_response(
+            request, etag=etag, last_modified=int(last_modified))
+        return etag, last_modified, response
+
+    def add_validators(response, etag, last_modified):
+        if response.status_code in (200, 304):
+            response.headers.setdefault('ETag', etag)
+            response.headers.setdefault('Last-Modified',
+                                        http_date(last_modified))
+            # stored by the browser, checked on every visit
+            patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @functools.wraps(view)
+            async def wrapper(request, *args, **kwargs):
+                if request.method not in ('GET', 'HEAD') \
+                        or not settings.CONDITIONAL_GET:
+                    return await view(request, *args, **kwargs)
+                etag, last_modified, response = await sync_to_async(
+                    check)(request)
+                if response is None:
+                    response = await view(request, *args, **kwargs)
+                return add_validators(response, etag, last_modified)
+        else:
+            @functools.wraps(view)
+            def wrapper(request, *args, **kwargs):
+                if request.method not in ('GET', 'HEAD') \
+                        or not settings.CONDITIONAL_GET:
+                    return view(request, *args, **kwargs)
+                etag, last_modified, response = check(request)
+                if response is None:
+                    response = view(request, *args, **kwargs)
+                return add_validators(response, etag, last_modified)
+        return wrapper
+    return decorator
+
+
+def post_changed(author_id, ticket_owner_id=None):
+    """ after the commit of a created, edited or deleted post, for a
+        review the ticket owner: its ticket shows the review aggregates
+    """
+    scopes = [SITE, posts_scope(author_id)]
+    if ticket_owner_id is not None:
+        scopes.append(posts_scope(ticket_owner_id))
+    touch(scopes)
+
+
+def review_changed(author_id, ticket_id):
+    """ after the commit of an edited or deleted review, the owner of
+        its ticket is read (the ticket may be deleted too)
+    """
+    owner_ids = models.Ticket.objects.filter(
+        id=ticket_id).values_list('user_id', flat=True)
+    touch([SITE, posts_scope(author_id)]
+          + [posts_scope(owner_id) for owner_id in owner_ids])
+
+
+def ticket_changed(ticket_id, author_id):
+    """ after the commit of an edited ticket or of its processed image,
+        the reviews answering it show it
+    """
+    reviewers = set(models.Review.objects.filter(
+        ticket_id=ticket_id).values_list('user_id', flat=True))
+    touch([SITE, posts_scope(author_id)]
+          + [posts_scope(user_id) for user_id in reviewers])
+
+
+def follows_changed(user_id):
+    touch([follows_scope(user_id)])
+
+
+def user_changed(user_id):
+    """ after the commit of a renamed user, its posts show its name """
+    touch([SITE, posts_scope(user_id)])
+
+
+def invalidate():
+    """ all the pages, after changes made without signals """
+    touch([ALL])
@@ -0,0 +1,352 @@
+""" real-time feed events (Server-Sent Events)
+    after its commit a new post is published on a bus (reviews.signals):
+    on the channel of its author, and for a review on the inbox of the
+    ticket owner. The events stream of a user subscribes to its own
+    channels and to the channels of the users it follows (follow graph
+    cache), it only sends the type and id of the new posts.
+
+    The stream is a plain ASGI application in front of Django
+    (litreview.asgi): an idle connection is a coroutine waiting on its
+    queue, without thread nor middleware. A new follow is seen on the next
+    connection, the streams end after EVENTS_STREAM_SECONDS and the
+    browsers reconnect.
+
+    settings.EVENT_BUS chooses the bus: LocalBus delivers to the streams
+    of the process, SocketBus goes through the broker of the
+    run_event_broker command (a unix socket) to reach the streams of
+    every worker process
+"""
+import asyncio
+import functools
+import json
+import logging
+import socket
+import threading
+from collections import defaultdict
+from importlib import import_module
+from types import SimpleNamespace
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import auth
+from django.db import close_old_connections
+from django.http import parse_cookie
+from django.urls import reverse
+from django.utils.module_loading import import_string
+
+from . import follow_graph
+
+logger = logging.getLogger(__name__)
+
+# new posts kept for a slow stream, beyond it the client reloads the page
+QUEUE_SIZE = 100
+# bytes waiting for a slow worker before the broker drops it
+BROKER_BUFFER_LIMIT = 1024 * 1024
+BROKER_RETRY_SECONDS = 1
+SUBSCRIBE = b'SUBSCRIBE\n'
+
+# reconnection delay of the browsers, in milliseconds
+RETRY_MS = 5000
+HEARTBEAT = b': ping\n\n'
+
+
+def posts_channel(user_id):
+    return 'posts:%s' % user_id
+
+
+def inbox_channel(user_id):
+    return 'inbox:%s' % user_id
+
+
+def encode(channel, message):
+    return json.dumps({'channel': channel, 'message': message},
+                      separators=(',', ':')).encode() + b'\n'
+
+
+class Subscription:
+    """ queue of the messages of some channels, read in its event loop """
+
+    def __init__(self, channels, loop):
+        self.channels = channels
+        self.loop = loop
+        self.queue = asyncio.Queue(QUEUE_SIZE)
+        self.overflowed = False
+
+    def put(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+    async def get(self):
+        return await self.queue.get()
+
+
+def _put_all(subscriptions, message):
+    for subscription in subscriptions:
+        subscription.put(message)
+
+
+class LocalBus:
+    """ in-process bus, published from any thread
+        one callback by event loop and message
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscriptions = defaultdict(set)
+
+    def subscribe(self, channels):
+        """ from a coroutine, the subscription is read in its loop """
+        subscription = Subscription(channels, asyncio.get_running_loop())
+        with self.lock:
+            for channel in channels:
+                self.subscriptions[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            for channel in subscription.channels:
+                subscriptions = self.subscriptions.get(channel)
+                if subscriptions is None:
+                    continue
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self.subscriptions[channel]
+
+    def subscribers(self):
+        with self.lock:
+            return len({subscription
+                        for subscriptions in self.subscriptions.values()
+                        for subscription in subscriptions})
+
+    def publish(self, channel, message):
+        self.deliver(channel, message)
+
+    def deliver(self, channel, message):
+        with self.lock:
+            subscriptions = list(self.subscriptions.get(channel, ()))
+        by_loop = defaultdict(list)
+        for subscription in subscriptions:
+            by_loop[subscription.loop].append(subscription)
+        for loop, subscriptions in by_loop.items():
+            try:
+                loop.call_soon_threadsafe(_put_all, subscriptions, message)
+            except RuntimeError:
+                # loop closed, its streams are gone
+                pass
+
+
+class SocketBus(LocalBus):
+    """ bus shared by the worker processes through the broker
+        (run_event_broker): the messages are sent to the broker, which
+        sends them back to the reader of every process
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.path = str(settings.EVENT_BROKER_SOCKET)
+        self.publisher = None
+        self.publisher_lock = threading.Lock()
+        self.readers = {}
+
+    def subscribe(self, channels):
+        loop = asyncio.get_running_loop()
+        if loop not in self.readers:
+            self.readers[loop] = loop.create_task(self.read())
+        return super().subscribe(channels)
+
+    async def read(self):
+        """ deliver the messages of the broker to the streams of the
+            process, reconnect when the broker is lost
+        """
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(
+                    self.path, limit=BROKER_BUFFER_LIMIT)
+            except OSError:
+                logger.warning("event broker %s unavailable", self.path)
+                await asyncio.sleep(BROKER_RETRY_SECONDS)
+                continue
+            try:
+                writer.write(SUBSCRIBE)
+                async for line in reader:
+                    data = json.loads(line)
+                    self.deliver(data['channel'], data['message'])
+            except (OSError, ValueError):
+                pass
+            finally:
+                writer.close()
+            await asyncio.sleep(BROKER_RETRY_SECONDS)
+
+    def publish(self, channel, message):
+        line = encode(channel, message)
+        with self.publisher_lock:
+            for _ in range(2):
+                try:
+                    if self.publisher is None:
+                        self.publisher = socket.socket(socket.AF_UNIX)
+                        self.publisher.connect(self.path)
+                    self.publisher.sendall(line)
+                    return
+                except OSError:
+                    if self.publisher is not None:
+                        self.publisher.close()
+                    self.publisher = None
+        logger.warning("event broker %s unavailable, message delivered "
+                       "in the process only", self.path)
+        self.deliver(channel, message)
+
+
+async def run_broker(path):
+    """ relay every line received to the subscribed workers """
+    subscribers = set()
+
+    async def serve(reader, writer):
+        try:
+            async for line in reader:
+                if line == SUBSCRIBE:
+                    subscribers.add(writer)
+                    continue
+                for subscriber in list(subscribers):
+                    transport = subscriber.transport
+                    if transport.get_write_buffer_size() \
+                            > BROKER_BUFFER_LIMIT:
+                        logger.warning("slow worker dropped")
+                        subscribers.discard(subscriber)
+                        subscriber.close()
+                    else:
+                        subscriber.write(line)
+        except OSError:
+            pass
+        finally:
+            subscribers.discard(writer)
+            writer.close()
+
+    server = await asyncio.start_unix_server(
+        serve, path, limit=BROKER_BUFFER_LIMIT)
+    async with server:
+        await server.serve_forever()
+
+
+@functools.cache
+def _bus(path):
+    return import_string(path)()
+
+
+def bus():
+    return _bus(settings.EVENT_BUS)
+
+
+def post_created(content_type, item_id, author_id, ticket_owner_id=None):
+    """ after the commit of a new ticket or review """
+    message = {'type': content_type, 'id': item_id}
+    bus().publish(posts_channel(author_id), message)
+    if ticket_owner_id is not None and ticket_owner_id != author_id:
+        bus().publish(inbox_channel(ticket_owner_id), message)
+
+
+def viewer(headers):
+    """ id of the user of the session cookie and the ids it follows
+        the user is checked like django.contrib.auth does
+    """
+    cookies = parse_cookie(headers.get(b'cookie', b'').decode('latin-1'))
+    session_key = cookies.get(settings.SESSION_COOKIE_NAME)
+    if session_key is None:
+        return None, []
+    close_old_connections()
+    try:
+        engine = import_module(settings.SESSION_ENGINE)
+        request = SimpleNamespace(session=engine.SessionStore(session_key))
+        user = auth.get_user(request)
+        if not user.is_authenticated:
+            return None, []
+        return user.id, list(follow_graph.following(user.id))
+    finally:
+        close_old_connections()
+
+
+def event_chunk(subscription, message):
+    if subscription.overflowed:
+        subscription.overflowed = False
+        return b'event: reset\ndata: {}\n\n'
+    return b'event: post\ndata: %s\n\n' % json.dumps(
+        message, separators=(',', ':')).encode()
+
+
+async def wait_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def stream(scope, receive, send):
+    """ text/event-stream of the new posts of the user and its follows
+        a comment every EVENTS_HEARTBEAT_SECONDS keeps the proxies open
+    """
+    # no ThreadSensitiveContext: the lookups share one thread
+    user_id, followed = await sync_to_async(viewer)(dict(scope['headers']))
+    if user_id is None:
+        await send({'type': 'http.response.start', 'status': 401,
+                    'headers': [(b'content-type',
+                                 b'text/plain; charset=utf-8')]})
+        await send({'type': 'http.response.body',
+                    'body': "Authentification requise".encode()})
+        return
+    channels = [posts_channel(user_id), inbox_channel(user_id)]
+    channels += [posts_channel(followed_id) for followed_id in followed]
+    subscription = bus().subscribe(channels)
+    disconnected = asyncio.ensure_future(wait_disconnect(receive))
+    message = None
+    try:
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': [(b'content-type', b'text/event-stream'),
+                                (b'cache-control', b'no-cache'),
+                                (b'x-accel-buffering', b'no')]})
+        await send({'type': 'http.response.body',
+                    'body': b'retry: %d\n\n' % RETRY_MS, 'more_body': True})
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.EVENTS_STREAM_SECONDS
+        while True:
+            timeout = min(settings.EVENTS_HEARTBEAT_SECONDS,
+                          deadline - loop.time())
+            if timeout <= 0:
+                break
+            if message is None:
+                message = asyncio.ensure_future(subscription.get())
+            done, _ = await asyncio.wait(
+                {message, disconnected}, timeout=timeout,
+                return_when=asyncio.FIRST_COMPLETED)
+            if disconnected in done:
+                return
+            if message in done:
+                chunk = event_chunk(subscription, message.result())
+                message = None
+            else:
+                chunk = HEARTBEAT
+            await send({'type': 'http.response.body', 'body': chunk,
+                        'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        bus().unsubscribe(subscription)
+        if message is not None:
+            message.cancel()
+        disconnected.cancel()
+
+
+class EventsRouter:
+    """ ASGI application serving the events stream,
+        the other requests go to the Django application
+    """
+
+    def __init__(self, application):
+        self.application = application
+        self.path = None
+
+    async def __call__(self, scope, receive, send):
+        if self.path is None:
+            self.path = reverse('events')
+        if scope['type'] == 'http' and scope['method'] == 'GET' \
+                and scope['path'] == self.path:
+            await stream(scope, receive, send)
+        else:
+            await self.application(scope, receive, send)
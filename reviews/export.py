@@ -0,0 +1,65 @@
+""" export of the posts and follows of a user
+    the rows are read by chunks (QuerySet.iterator) and written one line
+    at a time, the export of a large account never sits in memory
+"""
+import csv
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F
+
+from . import models
+
+CHUNK_SIZE = 2000
+FORMATS = {
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv', 'csv'),
+}
+# columns of the CSV export, a record only fills the columns of its type
+COLUMNS = ['type', 'id', 'time_created', 'title', 'description', 'image',
+           'ticket', 'rating', 'headline', 'body', 'followed_user']
+
+
+def records(user):
+    """ tickets, reviews and follows of the user, as dicts """
+    tickets = models.Ticket.objects.filter(user=user).order_by('id').values(
+        'id', 'time_created', 'title', 'description', 'image')
+    for ticket in tickets.iterator(chunk_size=CHUNK_SIZE):
+        yield {'type': 'ticket', **ticket}
+
+    reviews = models.Review.objects.filter(user=user).order_by('id').values(
+        'id', 'time_created', 'ticket', 'rating', 'headline', 'body')
+    for review in reviews.iterator(chunk_size=CHUNK_SIZE):
+        yield {'type': 'review', **review}
+
+    follows = models.UserFollows.objects.filter(user=user).order_by(
+        'id').values('id', followed=F('followed_user__username'))
+    for follow in follows.iterator(chunk_size=CHUNK_SIZE):
+        yield {'type': 'follow', 'id': follow['id'],
+               'followed_user': follow['followed']}
+
+
+class Echo:
+    """ file-like object giving back what is written to it """
+
+    def write(self, value):
+        return value
+
+
+def ndjson_lines(user):
+    encoder = DjangoJSONEncoder(ensure_ascii=False)
+    for record in records(user):
+        yield encoder.encode(record) + '\n'
+
+
+def csv_lines(user):
+    writer = csv.DictWriter(Echo(), COLUMNS)
+    yield writer.writeheader()
+    for record in records(user):
+        yield writer.writerow(record)
+
+
+def lines(user, export_format):
+    """ lines of the export in the given format (see FORMATS) """
+    if export_format == 'csv':
+        return csv_lines(user)
+    return ndjson_lines(user)
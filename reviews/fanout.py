@@ -0,0 +1,191 @@
+""" fan-out on write of the materialized feed (FeedEntry)
+    a post is copied in the feed of its author, of the followers
+    of its author and, for a review, of the owner of the ticket.
+    Posts of users having more than FEED_FANOUT_FOLLOWER_LIMIT followers
+    are not copied to their followers, they are merged at read time
+"""
+from collections import defaultdict
+from itertools import islice
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q
+
+from . import models
+
+TICKET = models.FeedEntry.TICKET
+REVIEW = models.FeedEntry.REVIEW
+
+BATCH_SIZE = 1000
+
+
+def followers_count(user_id):
+    return models.UserFollows.objects.filter(followed_user_id=user_id).count()
+
+
+def is_celebrity(user_id):
+    """ too many followers to copy the posts in every follower feed """
+    return followers_count(user_id) > settings.FEED_FANOUT_FOLLOWER_LIMIT
+
+
+def celebrities(user_ids):
+    """ ids, among user_ids (list or subquery), of the users
+        whose posts are merged at read time
+    """
+    return models.UserFollows.objects.filter(
+        followed_user_id__in=user_ids
+    ).values('followed_user_id').annotate(
+        followers=Count('id')
+    ).filter(
+        followers__gt=settings.FEED_FANOUT_FOLLOWER_LIMIT
+    ).values_list('followed_user_id', flat=True)
+
+
+def audience(user_id):
+    """ owners of the feeds a post of the user is written to """
+    owners = {user_id}
+    if not is_celebrity(user_id):
+        owners.update(models.UserFollows.objects.filter(
+            followed_user_id=user_id).values_list('user_id', flat=True))
+    return owners
+
+
+def write(owner_ids, content_type, items):
+    """ insert the feed entries by batches
+        items are (id, author id, time_created) tuples,
+        entries already present are ignored
+    """
+    insert(
+        models.FeedEntry(owner_id=owner_id,
+                         author_id=author_id,
+                         content_type=content_type,
+                         item_id=item_id,
+                         time_created=time_created)
+        for item_id, author_id, time_created in items
+        for owner_id in owner_ids
+    )
+
+
+def insert(entries):
+    """ insert FeedEntry objects by batches, duplicates are ignored """
+    entries = iter(entries)
+    while True:
+        batch = list(islice(entries, BATCH_SIZE))
+        if not batch:
+            break
+        models.FeedEntry.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+def fan_out_ticket(ticket):
+    write(audience(ticket.user_id), TICKET,
+          [(ticket.id, ticket.user_id, ticket.time_created)])
+
+
+def fan_out_review(review):
+    owners = audience(review.user_id)
+    owners.add(review.ticket.user_id)
+    write(owners, REVIEW,
+          [(review.id, review.user_id, review.time_created)])
+
+
+def fan_out_posts(content_type, posts):
+    """ fan-out of posts created in bulk (no post_save signal)
+        posts are (id, author id, time_created, ticket owner id) tuples,
+        the ticket owner is None for tickets.
+        The followers of all the authors are read in one query
+    """
+    authors = {author_id for _, author_id, _, _ in posts}
+    skipped = set(celebrities(list(authors)))
+    followers = defaultdict(set)
+    for followed_id, user_id in models.UserFollows.objects.filter(
+            followed_user_id__in=authors - skipped
+    ).values_list('followed_user_id', 'user_id'):
+        followers[followed_id].add(user_id)
+
+    insert(
+        models.FeedEntry(owner_id=owner_id,
+                         author_id=author_id,
+                         content_type=content_type,
+                         item_id=item_id,
+                         time_created=time_created)
+        for item_id, author_id, time_created, ticket_owner_id in posts
+        for owner_id in (followers[author_id] | {author_id, ticket_owner_id})
+        if owner_id is not None
+    )
+
+
+def remove(content_type, item_id):
+    """ remove a deleted post from all the feeds """
+    models.FeedEntry.objects.filter(
+        content_type=content_type, item_id=item_id).delete()
+
+
+def backfill(owner_id, author_ids):
+    """ copy all the posts of the authors in the owner feed """
+    fields = ('id', 'user_id', 'time_created')
+    write([owner_id], TICKET, models.Ticket.objects.filter(
+        user_id__in=author_ids).values_list(*fields).iterator(BATCH_SIZE))
+    write([owner_id], REVIEW, models.Review.objects.filter(
+        user_id__in=author_ids).values_list(*fields).iterator(BATCH_SIZE))
+
+
+def trim(owner_id, author_id):
+    """ remove the posts of author from the owner feed
+        except the reviews answering the owner tickets
+    """
+    kept_reviews = models.Review.objects.filter(
+        user_id=author_id, ticket__user_id=owner_id).values('id')
+    models.FeedEntry.objects.filter(
+        owner_id=owner_id, author_id=author_id
+    ).exclude(
+        content_type=REVIEW, item_id__in=kept_reviews
+    ).delete()
+
+
+def follow_created(follow):
+    if not is_celebrity(follow.followed_user_id):
+        backfill(follow.user_id, [follow.followed_user_id])
+
+
+def follows_created(follows):
+    """ follow_created of follows created in bulk (no post_save signal)
+        one query for the celebrities, one backfill by follower
+    """
+    followed = defaultdict(set)
+    for follow in follows:
+        followed[follow.user_id].add(follow.followed_user_id)
+    skipped = set(celebrities(list(set().union(*followed.values()))))
+    for owner_id, author_ids in followed.items():
+        if author_ids - skipped:
+            backfill(owner_id, list(author_ids - skipped))
+
+
+def follow_deleted(follow):
+    trim(follow.user_id, follow.followed_user_id)
+    if followers_count(follow.followed_user_id) == \
+            settings.FEED_FANOUT_FOLLOWER_LIMIT:
+        # the followed user posts are not merged at read time anymore,
+        # copy them in the remaining followers feeds
+        followers = models.UserFollows.objects.filter(
+            followed_user_id=follow.followed_user_id
+        ).values_list('user_id', flat=True)
+        for follower_id in followers:
+            backfill(follower_id, [follow.followed_user_id])
+
+
+@transaction.atomic
+def rebuild(owner_id):
+    """ recompute the whole feed of a user """
+    models.FeedEntry.objects.filter(owner_id=owner_id).delete()
+    followed = models.UserFollows.objects.filter(
+        user_id=owner_id).values_list('followed_user_id', flat=True)
+    skipped = set(celebrities(followed))
+    authors = [owner_id] + [
+        user_id for user_id in followed if user_id not in skipped]
+
+    fields = ('id', 'user_id', 'time_created')
+    write([owner_id], TICKET, models.Ticket.objects.filter(
+        user_id__in=authors).values_list(*fields).iterator(BATCH_SIZE))
+    write([owner_id], REVIEW, models.Review.objects.filter(
+        Q(user_id__in=authors) | Q(ticket__user_id=owner_id)
+    ).values_list(*fields).iterator(BATCH_SIZE))
@@ -0,0 +1,304 @@
+""" feed query engine
+    merge tickets and reviews in the database with a single UNION ALL
+    ordered and sliced by the database, so the cost of a page depends
+    on the page size and not on the size of the account history
+"""
+import base64
+import binascii
+from datetime import datetime
+
+from django.db.models import CharField, Q, Value
+
+from . import follow_graph
+from . import models
+
+TICKET = models.FeedEntry.TICKET
+REVIEW = models.FeedEntry.REVIEW
+
+# columns shared by all the parts of the union, in select order
+FEED_COLUMNS = ('id', 'time_created', 'content_type')
+ENTRY_COLUMNS = ('item_id', 'time_created', 'content_type')
+# most recent first, content_type and id break the ties
+FEED_ORDERING = ('-time_created', '-content_type', '-id')
+REVERSED_FEED_ORDERING = ('time_created', 'content_type', 'id')
+
+
+class Feed:
+    """ lazy merged list of tickets and reviews
+        supports count() and slicing so it can be given to a Paginator,
+        only the rows of the requested slice are turned into objects.
+        entries, when given, are FeedEntry rows merged with the posts
+    """
+
+    def __init__(self, tickets, reviews, entries=None):
+        self.tickets = tickets
+        self.reviews = reviews
+        self.entries = entries
+
+    def rows(self, cursor=None, older=True):
+        """ UNION ALL of (id, time_created, content_type) rows
+            when a cursor is given only the rows older (or newer)
+            than the cursor are kept, the filter is applied on each side
+            of the union so the database can use the time_created order
+        """
+        tickets = self.tickets
+        reviews = self.reviews
+        entries = self.entries
+        if cursor is not None:
+            tickets = tickets.filter(keyset_filter(TICKET, cursor, older))
+            reviews = reviews.filter(keyset_filter(REVIEW, cursor, older))
+            if entries is not None:
+                entries = entries.filter(
+                    keyset_filter(None, cursor, older, id_field='item_id'))
+        tickets = tickets.annotate(
+            content_type=Value(TICKET, CharField())).values(*FEED_COLUMNS)
+        reviews = reviews.annotate(
+            content_type=Value(REVIEW, CharField())).values(*FEED_COLUMNS)
+        if entries is None:
+            return tickets.union(reviews, all=True)
+        return tickets.union(reviews, entries.values(*ENTRY_COLUMNS),
+                             all=True)
+
+    def count(self):
+        return self.rows().count()
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return hydrate(self.rows().order_by(*FEED_ORDERING)[key])
+        items = self[key:key + 1]
+        if not items:
+            raise IndexError('feed index out of range')
+        return items[0]
+
+    def page_query(self, size, after=None, before=None):
+        """ (rows, after, before) of a cursor page, rows being the
+            queryset of the page rows plus one
+        """
+        after, before = page_cursors(after, before)
+        if before:
+            rows = self.rows(before, older=False).order_by(
+                *REVERSED_FEED_ORDERING)
+        else:
+            rows = self.rows(after).order_by(*FEED_ORDERING)
+        # one extra row tells if there is more in that direction
+        return rows[:size + 1], after, before
+
+    def cursor_page(self, size, after=None, before=None):
+        """ keyset pagination
+            return the `size` items following the `after` cursor
+            or preceding the `before` cursor, the first page if none.
+            No count and no offset: the cost does not depend on the depth
+            and new posts do not shift the pages being browsed
+        """
+        rows, after, before = self.page_query(size, after, before)
+        rows, cursors = page_rows(list(rows), size, after, before)
+        return CursorPage(hydrate(rows), **cursors)
+
+    async def acursor_page(self, size, after=None, before=None):
+        """ cursor_page with the async ORM, for the async views """
+        rows, after, before = self.page_query(size, after, before)
+        rows, cursors = page_rows([row async for row in rows], size, after,
+                                  before)
+        return CursorPage(await ahydrate(rows), **cursors)
+
+
+def page_cursors(after, before, decode=None):
+    """ decoded (after, before) cursors of a page, before wins
+        decode is the cursor format, the feed one by default
+    """
+    decode = decode or decode_cursor
+    before = decode(before)
+    after = None if before else decode(after)
+    return after, before
+
+
+def page_rows(rows, size, after, before, encode=None):
+    """ rows of the page in feed order and the cursors around it
+        from the page rows plus one, read in the direction of the
+        cursors given by page_cursors.
+        encode is the cursor format, the feed one by default
+    """
+    encode = encode or encode_cursor
+    has_more = len(rows) > size
+    rows = rows[:size]
+    if before:
+        rows.reverse()
+        has_previous, has_next = has_more, True
+    else:
+        has_previous, has_next = after is not None, has_more
+    return rows, {
+        'next_cursor': encode(rows[-1]) if rows and has_next else None,
+        'previous_cursor': encode(rows[0])
+        if rows and has_previous else None,
+    }
+
+
+class CursorPage:
+    """ page of a feed browsed with cursors
+        iterable like a Paginator page
+    """
+
+    def __init__(self, items, next_cursor=None, previous_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def pack_cursor(values):
+    """ opaque cursor from the strings of a sort key """
+    value = '|'.join(values)
+    return base64.urlsafe_b64encode(value.encode()).decode().rstrip('=')
+
+
+def unpack_cursor(cursor):
+    """ strings of the sort key of a cursor, None if not valid """
+    if not cursor:
+        return None
+    try:
+        return base64.urlsafe_b64decode(
+            cursor + '=' * (-len(cursor) % 4)).decode().split('|')
+    except (binascii.Error, UnicodeDecodeError):
+        return None
+
+
+def encode_cursor(row):
+    """ opaque cursor from a feed row """
+    return pack_cursor([row['time_created'].isoformat(),
+                        row['content_type'],
+                        str(row['id'])])
+
+
+def decode_cursor(cursor):
+    """ (time_created, content_type, id) from a cursor
+        None if there is no cursor or if it is not valid
+    """
+    values = unpack_cursor(cursor)
+    try:
+        time_created, content_type, item_id = values
+        time_created = datetime.fromisoformat(time_created)
+        item_id = int(item_id)
+    except (TypeError, ValueError):
+        return None
+    if content_type not in (TICKET, REVIEW):
+        return None
+    return time_created, content_type, item_id
+
+
+def keyset_filter(content_type, cursor, older=True, id_field='id'):
+    """ filter keeping the rows of one part of the union
+        strictly older (or newer) than the cursor in the feed ordering.
+        content_type is the constant type of the part,
+        None when it is read from a content_type column
+    """
+    time_created, cursor_type, cursor_id = cursor
+    lookup = 'lt' if older else 'gt'
+    condition = Q(**{'time_created__' + lookup: time_created})
+    same_type = Q(time_created=time_created,
+                  **{id_field + '__' + lookup: cursor_id})
+    if content_type is None:
+        condition |= Q(time_created=time_created,
+                       **{'content_type__' + lookup: cursor_type})
+        condition |= Q(same_type, content_type=cursor_type)
+    elif content_type == cursor_type:
+        condition |= same_type
+    elif (content_type < cursor_type) == older:
+        condition |= Q(time_created=time_created)
+    return condition
+
+
+def tickets_for_display():
+    """ tickets with everything the feed cards display
+        no extra query per card, the reviews are counted on the ticket
+    """
+    return models.Ticket.objects.select_related('user')
+
+
+def reviews_for_display():
+    """ reviews with their ticket and authors for the feed cards """
+    return models.Review.objects.select_related('user', 'ticket__user')
+
+
+def hydrate(rows):
+    """ turn feed rows into Ticket and Review instances
+        one query per model, the order of the rows is kept
+    """
+    rows = list(rows)
+    ticket_ids, review_ids = row_ids(rows)
+    return attach(rows, {
+        TICKET: tickets_for_display().in_bulk(ticket_ids)
+        if ticket_ids else {},
+        REVIEW: reviews_for_display().in_bulk(review_ids)
+        if review_ids else {},
+    })
+
+
+async def ahydrate(rows):
+    """ hydrate with the async ORM """
+    ticket_ids, review_ids = row_ids(rows)
+    return attach(rows, {
+        TICKET: await tickets_for_display().ain_bulk(ticket_ids)
+        if ticket_ids else {},
+        REVIEW: await reviews_for_display().ain_bulk(review_ids)
+        if review_ids else {},
+    })
+
+
+def row_ids(rows):
+    """ (ticket ids, review ids) of feed rows """
+    return ([row['id'] for row in rows if row['content_type'] == TICKET],
+            [row['id'] for row in rows if row['content_type'] == REVIEW])
+
+
+def attach(rows, objects):
+    """ instances of the rows, in order, from {content_type: {id: item}} """
+    items = []
+    for row in rows:
+        item = objects[row['content_type']].get(row['id'])
+        if item is None:
+            # deleted between the two queries
+            continue
+        item.content_type = row['content_type']
+        items.append(item)
+    return items
+
+
+def user_feed(user):
+    """ tickets and reviews of the user and of the users it follows
+        plus the reviews answering the user tickets.
+        Read from the materialized feed, the posts of the followed users
+        that are not fanned out (too many followers) are merged here
+    """
+    # precomputed id lists from the follow graph cache, no subquery
+    celebrities = follow_graph.followed_celebrities(user.id)
+    tickets = models.Ticket.objects.filter(user__in=celebrities)
+    reviews = models.Review.objects.filter(user__in=celebrities)
+    entries = models.FeedEntry.objects.filter(owner=user)
+    if celebrities:
+        entries = entries.exclude(author__in=celebrities)
+    return Feed(tickets, reviews, entries)
+
+
+def user_posts(user):
+    """ tickets and reviews written by the user """
+    return Feed(models.Ticket.objects.filter(user=user),
+                models.Review.objects.filter(user=user))
+
+
+def general_feed():
+    """ tickets and reviews from all the users """
+    return Feed(models.Ticket.objects.all(), models.Review.objects.all())
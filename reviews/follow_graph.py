@@ -0,0 +1,203 @@
+""" follow graph cache
+    the ids a user follows are stored sorted as a compact array of 64 bit
+    integers, the follower count of each user as an integer. Both are
+    read without query by the feeds, loaded in one query when missing,
+    and updated in place after the commit of a follow or unfollow
+    (reviews.signals). Changes made without signals (bulk import,
+    seeding) invalidate the users involved. With a per process cache the
+    other processes see a change when their entries expire
+    (settings.FOLLOW_GRAPH_SECONDS)
+
+    A stored array is tagged with the version of its user, writers that
+    cannot update it in place bump the version, which invalidates any
+    array read or loaded concurrently (as reviews.activity does)
+"""
+import bisect
+import time
+from array import array
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+
+from . import models
+
+LOCK_TIMEOUT = 10
+TYPECODE = 'q'
+
+
+def following_key(user_id):
+    return 'reviews:follow_graph:following:%s' % user_id
+
+
+def followers_key(user_id):
+    return 'reviews:follow_graph:followers:%s' % user_id
+
+
+def lock_key(user_id):
+    return 'reviews:follow_graph:lock:%s' % user_id
+
+
+def version_key(user_id):
+    return 'reviews:follow_graph:version:%s' % user_id
+
+
+def pack(user_ids):
+    return array(TYPECODE, sorted(user_ids)).tobytes()
+
+
+def unpack(data):
+    user_ids = array(TYPECODE)
+    user_ids.frombytes(data)
+    return user_ids
+
+
+def _cached(user_id):
+    """ (array, version) the array is None if missing or outdated """
+    values = cache.get_many([following_key(user_id), version_key(user_id)])
+    version = values.get(version_key(user_id))
+    if version is None:
+        # never a version of an array stored before the eviction
+        cache.add(version_key(user_id), time.time_ns(), None)
+        version = cache.get(version_key(user_id))
+    stored = values.get(following_key(user_id))
+    if stored is None or stored[0] != version:
+        return None, version
+    return unpack(stored[1]), version
+
+
+def _bump_version(user_id):
+    """ the new version of the user """
+    try:
+        return cache.incr(version_key(user_id))
+    except ValueError:
+        # evicted
+        cache.add(version_key(user_id), time.time_ns(), None)
+        return cache.incr(version_key(user_id))
+
+
+def _load(user_id, version):
+    """ ids followed by the user and their follower counts, one query
+        the array is stored with the version read before the query
+    """
+    counts = dict(models.UserFollows.objects.filter(
+        followed_user__followed_by__user_id=user_id
+    ).values_list('followed_user_id').annotate(followers=Count('id')))
+    values = {followers_key(followed_id): count
+              for followed_id, count in counts.items()}
+    values[following_key(user_id)] = (version, pack(counts))
+    cache.set_many(values, settings.FOLLOW_GRAPH_SECONDS)
+    return unpack(values[following_key(user_id)][1]), counts
+
+
+def following(user_id, with_counts=False):
+    """ sorted array of the ids followed by the user
+        with_counts loads their follower counts too when missing, for
+        the feed. Not by default, costly for the followers of a celebrity
+        reconnecting together (reviews.events)
+    """
+    followed, version = _cached(user_id)
+    if followed is None and with_counts:
+        return _load(user_id, version)[0]
+    if followed is None:
+        data = pack(models.UserFollows.objects.filter(
+            user_id=user_id).values_list('followed_user_id', flat=True))
+        cache.set(following_key(user_id), (version, data),
+                  settings.FOLLOW_GRAPH_SECONDS)
+        followed = unpack(data)
+    return followed
+
+
+def followers_counts(user_ids):
+    """ {user id: number of followers}, one query for the missing ones """
+    keys = {followers_key(user_id): user_id for user_id in user_ids}
+    counts = {keys[key]: count
+              for key, count in cache.get_many(list(keys)).items()}
+    missing = [user_id for user_id in user_ids if user_id not in counts]
+    if missing:
+        loaded = dict.fromkeys(missing, 0)
+        loaded.update(models.UserFollows.objects.filter(
+            followed_user_id__in=missing
+        ).values_list('followed_user_id').annotate(followers=Count('id')))
+        cache.set_many({followers_key(user_id): count
+                        for user_id, count in loaded.items()},
+                       settings.FOLLOW_GRAPH_SECONDS)
+        counts.update(loaded)
+    return counts
+
+
+def followed_celebrities(user_id):
+    """ ids followed by the user whose posts are merged at read time,
+        no query when the graph is cached.
+        The posts of the users over the limit are not fanned out
+        (reviews.fanout, exact counts), the users near it are merged too:
+        a merged author is read from its posts, fanned out or not
+    """
+    followed, version = _cached(user_id)
+    if followed is None:
+        followed, counts = _load(user_id, version)
+    else:
+        counts = followers_counts(followed)
+    threshold = settings.FEED_FANOUT_FOLLOWER_LIMIT \
+        - settings.FEED_MERGE_FOLLOWER_MARGIN
+    return [followed_id for followed_id in followed
+            if counts[followed_id] > threshold]
+
+
+def _update_following(user_id, followed_id, added):
+    """ add or remove an id of the cached array under the user lock
+        bump the version if the lock is not available. The holder bumps
+        it too: an array loaded before the commit and stored meanwhile
+        is outdated, and the array is written only when no other writer
+        bumped the version since it was read
+    """
+    if not cache.add(lock_key(user_id), True, LOCK_TIMEOUT):
+        _bump_version(user_id)
+        return
+    try:
+        followed, version = _cached(user_id)
+        new_version = _bump_version(user_id)
+        if followed is None or new_version != version + 1:
+            return
+        position = bisect.bisect_left(followed, followed_id)
+        present = position < len(followed) \
+            and followed[position] == followed_id
+        if added and not present:
+            followed.insert(position, followed_id)
+        elif not added and present:
+            del followed[position]
+        cache.set(following_key(user_id), (new_version, followed.tobytes()),
+                  settings.FOLLOW_GRAPH_SECONDS)
+    finally:
+        cache.delete(lock_key(user_id))
+
+
+def _add_followers(user_id, delta):
+    try:
+        cache.incr(followers_key(user_id), delta)
+    except ValueError:
+        # not cached, read when needed
+        pass
+
+
+def follow_created(user_id, followed_id):
+    """ after the commit of a follow """
+    _update_following(user_id, followed_id, True)
+    _add_followers(followed_id, 1)
+
+
+def follow_deleted(user_id, followed_id):
+    """ after the commit of an unfollow """
+    _update_following(user_id, followed_id, False)
+    _add_followers(followed_id, -1)
+
+
+def invalidate(user_ids):
+    """ drop the cached graph of users whose follows changed
+        without signals
+    """
+    for user_id in user_ids:
+        _bump_version(user_id)
+    cache.delete_many([key for user_id in user_ids
+                       for key in (following_key(user_id),
+                                   followers_key(user_id))])
@@ -49,14 +49,24 @@ class FollowUserForm(forms.ModelForm):
         super().__init__(*args, **kwargs)
         self.fields['followed_user'] = forms.CharField(
             widget=widgets.TextInput(
-                attrs={'class': 'form-control'})
+                attrs={'class': 'form-control',
+                       # suggestions of the autocomplete view
+                       'list': 'username-suggestions',
+                       'autocomplete': 'off'})
                 )
 
     def clean_followed_user(self):
         User = get_user_model()
         username = self.cleaned_data['followed_user']
-        user = User.objects.filter(username=username)
-        if len(user) == 0:
+        # one lookup on the unique username index
+        try:
+            return User.objects.get(username=username)
+        except User.DoesNotExist:
             raise forms.ValidationError("Utilisateur inconnu")
-        else:
-            return user[0]
+
+    def _get_validation_exclusions(self):
+        exclude = super()._get_validation_exclusions()
+        # found by clean_followed_user, the model validation would look
+        # for it again
+        exclude.add('followed_user')
+        return exclude
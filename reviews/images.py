@@ -0,0 +1,163 @@
+""" ticket image processing
+    the thumbnails of the uploaded image (reviews.thumbnails) are built
+    by a pool of worker threads once the transaction saving the ticket is
+    committed, the request does not wait for it. Until they are ready the
+    templates show a placeholder (Ticket.image_url)
+"""
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from PIL import Image
+
+from . import activity
+from . import conditional
+from . import models
+from . import thumbnails
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+
+def executor():
+    """ worker pool, created on first use """
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.IMAGE_WORKERS,
+            thread_name_prefix='ticket-images')
+    return _executor
+
+
+def schedule(ticket_id):
+    """ process the ticket image after the current transaction commits
+        inline when IMAGE_WORKERS is 0
+    """
+    if settings.IMAGE_WORKERS:
+        transaction.on_commit(
+            lambda: executor().submit(process_in_worker, ticket_id))
+    else:
+        transaction.on_commit(lambda: process(ticket_id))
+
+
+def make_thumbnails(image):
+    """ write the thumbnails of the image file, return its size """
+    storage = image.storage
+    with Image.open(image.path) as picture:
+        size = picture.size
+        variants = thumbnails.variant_sizes(size)
+        # a JPEG is decoded directly at a fraction of its size, large
+        # uploads are not fully decoded to be shrunk afterwards
+        picture.draft('RGB', variants[-1])
+        if picture.mode not in ('RGB', 'RGBA'):
+            picture = picture.convert('RGBA' if 'transparency' in picture.info
+                                      else 'RGB')
+        # the largest first, each one is resized from the previous one
+        source = picture
+        for variant in reversed(variants):
+            source = source.resize(variant, Image.LANCZOS)
+            source.save(storage.path(thumbnails.variant_name(
+                image.name, variant[0], thumbnails.WEBP)), 'WEBP', quality=80)
+            if variant == thumbnails.display_size(size):
+                source.convert('RGB').save(storage.path(
+                    thumbnails.variant_name(
+                        image.name, variant[0], thumbnails.JPEG)),
+                    'JPEG', quality=85, optimize=True)
+    return size
+
+
+def process(ticket_id):
+    """ build the thumbnails of the ticket image and mark them ready """
+    ticket = models.Ticket.objects.filter(id=ticket_id).first()
+    if ticket is None or not ticket.image:
+        return
+    # the stored files are shared, the same image is processed once
+    processed = models.Ticket.objects.filter(
+        image=ticket.image.name, thumbnail_ready=True).values_list(
+        'image_width', 'image_height').first()
+    if processed:
+        size = processed
+    else:
+        try:
+            size = make_thumbnails(ticket.image)
+        except OSError:
+            logger.exception(
+                "Cannot process the image of ticket %s", ticket_id)
+            return
+    # the image may have been replaced in the meantime
+    models.Ticket.objects.filter(
+        id=ticket_id, image=ticket.image.name).update(
+        thumbnail_ready=True, image_width=size[0], image_height=size[1])
+
+    # the home page keeps the latest tickets in the cache
+    ticket.thumbnail_ready = True
+    ticket.image_width, ticket.image_height = size
+    activity.post_saved(ticket, models.FeedEntry.TICKET)
+    conditional.ticket_changed(ticket_id, ticket.user_id)
+
+
+def delete_thumbnails(name):
+    """ delete the thumbnails built from a stored image """
+    storage = models.Ticket._meta.get_field('image').storage
+    directory = os.path.dirname(name)
+    if not storage.exists(directory):
+        return
+    for file_name in storage.listdir(directory)[1]:
+        if thumbnails.is_variant(file_name, name):
+            storage.delete(os.path.join(directory, file_name))
+
+
+def reference(name, count=1):
+    """ add references to a stored image, in the transaction of the
+        tickets using it
+    """
+    images = models.StoredImage.objects.filter(name=name)
+    if images.update(reference_count=F('reference_count') + count):
+        return
+    try:
+        with transaction.atomic():
+            models.StoredImage.objects.create(name=name,
+                                              reference_count=count)
+    except IntegrityError:
+        # created meanwhile
+        images.update(reference_count=F('reference_count') + count)
+
+
+def dereference(name):
+    """ remove a reference of a ticket replacing or deleting its image,
+        release the image after the commit
+    """
+    models.StoredImage.objects.filter(
+        name=name, reference_count__gt=0).update(
+        reference_count=F('reference_count') - 1)
+    transaction.on_commit(lambda: release(name))
+
+
+def release(name):
+    """ delete a stored image once nothing references it anymore
+        the file is deleted in the transaction deleting its last
+        reference: an upload of the same image referencing it meanwhile
+        keeps it, or waits for the commit and stores it again
+    """
+    if not name:
+        return
+    with transaction.atomic():
+        deleted, _ = models.StoredImage.objects.filter(
+            name=name, reference_count=0).delete()
+        if deleted:
+            models.Ticket._meta.get_field('image').storage.delete(name)
+            delete_thumbnails(name)
+
+
+def process_in_worker(ticket_id):
+    try:
+        process(ticket_id)
+    except Exception:
+        logger.exception("Image processing of ticket %s failed", ticket_id)
+    finally:
+        # the worker thread has its own database connection
+        connection.close()
@@ -0,0 +1,88 @@
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.template.loader import render_to_string
+from django.test import RequestFactory
+
+from reviews import cards
+from reviews import feed as feed_engine
+from reviews import models
+
+PAGES = {
+    'feed': (feed_engine.user_feed, 'reviews/feed.html',
+             'reviews/cards/feed_card.html'),
+    'posts': (feed_engine.user_posts, 'reviews/posts.html',
+              'reviews/cards/posts_card.html'),
+}
+
+
+class Command(BaseCommand):
+    help = ("Print the template time of a feed and posts page with the "
+            "cards rendered from scratch and read from the card cache")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page-size', type=int, default=5)
+        parser.add_argument('--repeat', type=int, default=200,
+                            help="renders of each page, the median is kept")
+
+    def handle(self, *args, **options):
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False)
+        try:
+            user = self.seed(options['page_size'])
+            request = RequestFactory().get('/')
+            request.user = user
+            for name, (feed, template_name, card_template) in PAGES.items():
+                page = feed(user).cursor_page(options['page_size'])
+                cache.clear()
+                results = {
+                    'before': self.measure(request, page, template_name,
+                                           card_template, False,
+                                           options['repeat']),
+                    'after': self.measure(request, page, template_name,
+                                          card_template, True,
+                                          options['repeat']),
+                }
+                self.stdout.write(self.style.MIGRATE_HEADING(
+                    '%s page (%d posts)' % (name, len(page))))
+                for title, duration in results.items():
+                    self.stdout.write(
+                        '  %s: %.3f ms' % (title, duration * 1000))
+        finally:
+            cache.clear()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def seed(self, page_size):
+        """ a user following another one, both posting tickets and
+            reviews, enough for a full page
+        """
+        User = get_user_model()
+        user = User.objects.create(username='reader')
+        author = User.objects.create(username='author')
+        models.UserFollows.objects.create(user=user, followed_user=author)
+        for number in range(page_size):
+            for poster, other in ((user, author), (author, user)):
+                ticket = models.Ticket.objects.create(
+                    title='Ticket %d' % number,
+                    description='Description du ticket %d' % number,
+                    user=poster)
+                models.Review.objects.create(
+                    ticket=ticket, user=other, rating=number % 6,
+                    headline='Critique %d' % number,
+                    body='Contenu de la critique %d' % number)
+        return user
+
+    def measure(self, request, page, template_name, card_template, cached,
+                repeat):
+        """ median time to render the cards and the page template """
+        durations = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            cards.render_cards(request, page, card_template, cached=cached)
+            render_to_string(template_name, {'page_obj': page}, request)
+            durations.append(time.perf_counter() - start)
+        return statistics.median(durations)
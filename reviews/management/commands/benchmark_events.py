@@ -0,0 +1,174 @@
+import asyncio
+import json
+import resource
+import time
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import (
+    BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY, get_user_model)
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import override_settings
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+
+from reviews import events
+from reviews import models
+from reviews import seeding
+
+
+def rss_kb():
+    """ peak resident memory of the process """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class Connection:
+    """ an idle events stream, driven like an ASGI server would """
+
+    def __init__(self, session_key):
+        self.scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': 'GET',
+            'scheme': 'http',
+            'path': '/events/',
+            'raw_path': b'/events/',
+            'root_path': '',
+            'query_string': b'',
+            'headers': [(b'host', b'localhost'), (b'cookie', b'%s=%s' % (
+                settings.SESSION_COOKIE_NAME.encode(),
+                session_key.encode()))],
+            'client': ('127.0.0.1', 0),
+            'server': ('127.0.0.1', 80),
+        }
+        self.requested = False
+        self.closed = asyncio.Event()
+        self.opened = asyncio.Event()
+        self.received = asyncio.Event()
+        self.status = None
+        self.received_at = None
+
+    async def receive(self):
+        if not self.requested:
+            self.requested = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await self.closed.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(self, message):
+        if message['type'] == 'http.response.start':
+            self.status = message['status']
+        elif message.get('body', b'').startswith(b'event: post'):
+            self.received_at = time.perf_counter()
+            self.received.set()
+        elif message.get('body', b'').startswith(b'retry'):
+            self.opened.set()
+        if not message.get('more_body', False):
+            self.opened.set()
+
+
+class Command(BaseCommand):
+    help = ("Hold many idle events streams in one event loop of the ASGI "
+            "application, publish a post to all of them and print, as "
+            "JSON, the connection time, the memory by connection and the "
+            "delivery latency")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=10000)
+        parser.add_argument('--hold', type=float, default=5,
+                            help="seconds the idle streams are held")
+
+    def handle(self, *args, **options):
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False)
+        try:
+            author_id, session_keys = self.create_viewers(
+                options['connections'])
+            # the read-only alias is still the configured database
+            with override_settings(DATABASE_READ_ALIAS=None,
+                                   EVENT_BUS='reviews.events.LocalBus'):
+                report = asyncio.run(
+                    self.measure(author_id, session_keys, options['hold']))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+        self.stdout.write(json.dumps(report, indent=2))
+
+    def create_viewers(self, count):
+        """ an author followed by count users having a session each """
+        User = get_user_model()
+        User.objects.bulk_create(
+            [User(username='viewer%d' % number, password='!')
+             for number in range(count)] + [User(username='author',
+                                                 password='!')],
+            batch_size=1000)
+        author = User.objects.get(username='author')
+        viewers = list(User.objects.exclude(id=author.id))
+        seeding.insert(models.UserFollows, ['user_id', 'followed_user_id'],
+                       ((viewer.id, author.id) for viewer in viewers))
+        store = SessionStore()
+        expire_date = timezone.now() + timedelta(days=1)
+        session_keys = [get_random_string(32) for _ in viewers]
+        seeding.insert(
+            Session, ['session_key', 'session_data', 'expire_date'],
+            ((session_key, store.encode({
+                SESSION_KEY: str(viewer.id),
+                BACKEND_SESSION_KEY: settings.AUTHENTICATION_BACKENDS[0],
+                HASH_SESSION_KEY: viewer.get_session_auth_hash(),
+            }), expire_date)
+             for session_key, viewer in zip(session_keys, viewers)))
+        return author.id, session_keys
+
+    async def measure(self, author_id, session_keys, hold):
+        from litreview.asgi import application
+
+        bus = events.bus()
+        memory_before = rss_kb()
+        start = time.perf_counter()
+        connections = [Connection(session_key)
+                       for session_key in session_keys]
+        tasks = [asyncio.create_task(application(
+            each.scope, each.receive, each.send)) for each in connections]
+        await asyncio.gather(*(each.opened.wait() for each in connections))
+        connected = time.perf_counter() - start
+        refused = sum(1 for each in connections if each.status != 200)
+        if refused:
+            raise CommandError('%d streams refused' % refused)
+
+        cpu_before = time.process_time()
+        await asyncio.sleep(hold)
+        idle_cpu = time.process_time() - cpu_before
+        memory_after = rss_kb()
+        subscribers = bus.subscribers()
+
+        def publish():
+            models.Ticket.objects.create(user_id=author_id, title='Nouveau')
+
+        published = time.perf_counter()
+        await sync_to_async(publish)()
+        await asyncio.gather(*(each.received.wait()
+                               for each in connections))
+        latencies = sorted(each.received_at - published
+                           for each in connections)
+
+        for each in connections:
+            each.closed.set()
+        await asyncio.gather(*tasks)
+        return {
+            'connections': len(connections),
+            'subscribers': subscribers,
+            'subscribers_after_close': bus.subscribers(),
+            'connect_seconds': round(connected, 2),
+            'memory_by_connection_kb': round(
+                (memory_after - memory_before) / len(connections), 2),
+            'idle_cpu_seconds': round(idle_cpu, 3),
+            'hold_seconds': hold,
+            'delivery_first_ms': round(latencies[0] * 1000, 1),
+            'delivery_median_ms': round(
+                latencies[len(latencies) // 2] * 1000, 1),
+            'delivery_last_ms': round(latencies[-1] * 1000, 1),
+        }
@@ -0,0 +1,107 @@
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from reviews import feed as feed_engine
+from reviews import models
+from reviews import seeding
+
+# indexes of the feed access patterns, by model
+FEED_INDEXES = [
+    (models.Ticket, 'ticket_user_time_idx'),
+    (models.Review, 'review_user_time_idx'),
+    (models.Review, 'review_ticket_user_idx'),
+    (models.UserFollows, 'userfollows_followed_idx'),
+]
+
+
+class Command(BaseCommand):
+    help = ("Print the query plans and timings of the feed queries "
+            "without and with the feed indexes, on a seeded throwaway "
+            "database")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=1_000_000,
+                            help="number of tickets and reviews to seed")
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--follows', type=int, default=20,
+                            help="mean number of users followed by a user")
+        parser.add_argument('--repeat', type=int, default=20,
+                            help="runs of each query, the median is kept")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self.seed(options)
+            user = get_user_model().objects.order_by('?').first()
+
+            indexes = [(model, index) for model, name in FEED_INDEXES
+                       for index in model._meta.indexes if index.name == name]
+            with connection.schema_editor() as schema_editor:
+                for model, index in indexes:
+                    schema_editor.remove_index(model, index)
+            connection.cursor().execute('ANALYZE')
+            before = self.measure(user, options['repeat'])
+
+            with connection.schema_editor() as schema_editor:
+                for model, index in indexes:
+                    schema_editor.add_index(model, index)
+            connection.cursor().execute('ANALYZE')
+            after = self.measure(user, options['repeat'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        for label in before:
+            self.stdout.write(self.style.MIGRATE_HEADING(label))
+            for title, (duration, plan) in (('before', before[label]),
+                                            ('after', after[label])):
+                self.stdout.write('  %s: %.3f ms' % (title, duration * 1000))
+                for line in plan.splitlines():
+                    self.stdout.write('    ' + line)
+
+    def seed(self, options):
+        seeding.Generator(
+            users=options['users'], follows=options['follows'],
+            posts=options['posts'] / options['users'], seed=options['seed'],
+            prefix='bench',
+        ).run(rebuild_feeds=False)
+
+    def measure(self, user, repeat):
+        """ median duration and query plan of each feed query """
+        followed = user.following.values('followed_user')
+        ticket = models.Ticket.objects.filter(user=user).first()
+        page = feed_engine.FEED_ORDERING
+        queries = {
+            'posts page': lambda: feed_engine.user_posts(user).rows()
+            .order_by(*page)[:5],
+            'posts count': lambda: feed_engine.user_posts(user).rows(),
+            'followed users page': lambda: feed_engine.Feed(
+                models.Ticket.objects.filter(user__in=followed),
+                models.Review.objects.filter(user__in=followed),
+            ).rows().order_by(*page)[:5],
+            'already reviewed flag': lambda: feed_engine.tickets_for_display()
+            .filter(user=user).order_by('-time_created')[:5],
+            'review of a ticket by a user': lambda: models.Review.objects
+            .filter(ticket=ticket, user=user),
+            'followers of a user': lambda: models.UserFollows.objects
+            .filter(followed_user=user).values_list('user_id', flat=True),
+        }
+
+        results = {}
+        for label, queryset in queries.items():
+            durations = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                if label.endswith('count'):
+                    queryset().count()
+                else:
+                    list(queryset())
+                durations.append(time.perf_counter() - start)
+            results[label] = (statistics.median(durations),
+                              queryset().explain())
+        return results
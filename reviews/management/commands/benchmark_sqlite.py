@@ -0,0 +1,135 @@
+import json
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections
+from django.test.utils import override_settings
+
+from litreview import database
+from reviews import feed as feed_engine
+from reviews import models
+from reviews import seeding
+
+# settings of the default alias compared, the read alias is only used
+# by the tuned profile. The migrations switch the file to WAL, the
+# baseline switches it back on every connection
+PROFILES = {
+    'baseline': {'PRAGMAS': {'journal_mode': 'DELETE'},
+                 'read_alias': None},
+    'tuned': {'PRAGMAS': database.PRAGMAS,
+              'read_alias': database.READ_ALIAS},
+}
+
+
+class Command(BaseCommand):
+    help = ("Measure the throughput of concurrent feed readers and ticket "
+            "writers on a seeded SQLite file, without and with the "
+            "production profile (litreview.database)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=8)
+        parser.add_argument('--writers', type=int, default=2)
+        parser.add_argument('--seconds', type=float, default=5)
+        parser.add_argument('--users', type=int, default=300)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        if connections[DEFAULT_DB_ALIAS].vendor != 'sqlite':
+            raise CommandError("The default database is not SQLite")
+        report = {name: self.run_profile(name, profile, options)
+                  for name, profile in PROFILES.items()}
+        self.stdout.write(json.dumps(report, indent=2))
+
+    def run_profile(self, name, profile, options):
+        """ seed a new file database with the profile and measure it """
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, '%s.sqlite3' % name)
+        default = connections[DEFAULT_DB_ALIAS]
+        read_only = connections[database.READ_ALIAS]
+        saved = (dict(default.settings_dict), dict(read_only.settings_dict))
+        connections.close_all()
+        default.settings_dict['TEST'] = {**default.settings_dict['TEST'],
+                                         'NAME': path}
+        default.settings_dict['PRAGMAS'] = profile['PRAGMAS']
+        old_name = default.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False)
+        read_only.settings_dict['NAME'] = 'file:%s?mode=ro' % path
+        try:
+            seeding.Generator(users=options['users'],
+                              seed=options['seed']).run()
+            with override_settings(
+                    DATABASE_READ_ALIAS=profile['read_alias']):
+                return self.measure(options)
+        finally:
+            connections.close_all()
+            default.creation.destroy_test_db(old_name, verbosity=0)
+            default.settings_dict.update(saved[0])
+            read_only.settings_dict.update(saved[1])
+            for file_name in os.listdir(directory):
+                os.remove(os.path.join(directory, file_name))
+            os.rmdir(directory)
+
+    def measure(self, options):
+        """ readers and writers in separate processes, as separate server
+            workers would be (threads would be serialized by the GIL)
+        """
+        user_ids = list(get_user_model().objects.values_list('id', flat=True))
+        # the forked processes open their own connections
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        results = context.Queue()
+        start = context.Event()
+        processes = [
+            context.Process(target=worker, args=(
+                kind, number, user_ids, options['seconds'], start, results))
+            for kind, count in (('read', options['readers']),
+                                ('write', options['writers']))
+            for number in range(count)]
+        for process in processes:
+            process.start()
+        start.set()
+        totals = {'read': 0, 'write': 0, 'locked': 0}
+        for _ in processes:
+            for kind, count in results.get().items():
+                totals[kind] += count
+        for process in processes:
+            process.join()
+
+        return {
+            'reads_per_second': round(totals['read'] / options['seconds']),
+            'writes_per_second': round(totals['write'] / options['seconds']),
+            'locked_errors': totals['locked'],
+            'read_alias': settings.DATABASE_READ_ALIAS,
+        }
+
+
+def worker(kind, seed, user_ids, seconds, start, results):
+    """ read feeds or create tickets for seconds, put the counts """
+    rand = random.Random('%s%d' % (kind, seed))
+    counts = {kind: 0, 'locked': 0}
+    start.wait()
+    end = time.perf_counter() + seconds
+    try:
+        with database.reading():
+            while time.perf_counter() < end:
+                user_id = rand.choice(user_ids)
+                try:
+                    if kind == 'read':
+                        list(feed_engine.user_feed(
+                            get_user_model()(id=user_id)).cursor_page(5))
+                    else:
+                        models.Ticket.objects.create(
+                            title='Benchmark', user_id=user_id)
+                    counts[kind] += 1
+                except OperationalError:
+                    # database is locked, after busy_timeout
+                    counts['locked'] += 1
+    finally:
+        connections.close_all()
+        results.put(counts)
@@ -0,0 +1,147 @@
+import json
+import random
+import statistics
+import time
+import tracemalloc
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from reviews import models
+from reviews import seeding
+
+VIEWS = ['home', 'feed', 'posts', 'follow_user']
+
+
+class Command(BaseCommand):
+    help = ("Request the feed views through the test client as random "
+            "users of a synthetic site and print, as JSON, the latency "
+            "percentiles, query counts and peak memory of each view")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--follows', type=int, default=20)
+        parser.add_argument('--posts', type=int, default=20,
+                            help="mean number of posts by user")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--requests', type=int, default=200,
+                            help="measured requests by view")
+        parser.add_argument('--memory-requests', type=int, default=20,
+                            help="requests by view traced for the peak "
+                                 "memory, tracing slows them down")
+        parser.add_argument('--views', nargs='+', default=VIEWS,
+                            choices=VIEWS)
+        parser.add_argument(
+            '--existing', action='store_true',
+            help="run on the configured database (seeded with seed_load) "
+                 "instead of a seeded throwaway database")
+        parser.add_argument('--output', help="JSON file to write")
+
+    def handle(self, *args, **options):
+        old_name = None
+        if not options['existing']:
+            old_name = connection.creation.create_test_db(
+                verbosity=0, autoclobber=True, serialize=False)
+        try:
+            if old_name is not None:
+                seeding.Generator(
+                    users=options['users'], follows=options['follows'],
+                    posts=options['posts'], seed=options['seed']).run()
+            hosts = settings.ALLOWED_HOSTS + ['testserver']
+            overrides = {'ALLOWED_HOSTS': hosts}
+            if old_name is not None:
+                # the read-only alias is still the configured database
+                overrides['DATABASE_READ_ALIAS'] = None
+            with override_settings(**overrides):
+                report = {
+                    'dataset': self.dataset(),
+                    'views': {name: self.measure(name, options)
+                              for name in options['views']},
+                }
+        finally:
+            if old_name is not None:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as result:
+                result.write(output + '\n')
+        self.stdout.write(output)
+
+    def dataset(self):
+        followers = models.UserFollows.objects.values(
+            'followed_user').annotate(count=Count('id')).order_by('-count')
+        return {
+            'users': get_user_model().objects.count(),
+            'follows': models.UserFollows.objects.count(),
+            'max_followers': followers[0]['count'] if followers else 0,
+            'tickets': models.Ticket.objects.count(),
+            'reviews': models.Review.objects.count(),
+            'feed_entries': models.FeedEntry.objects.count(),
+        }
+
+    def measure(self, name, options):
+        """ latency percentiles, query counts and peak memory of a view
+            each request is made by a random user
+        """
+        rand = random.Random(options['seed'])
+        user_ids = list(get_user_model().objects.values_list('id', flat=True))
+        clients = {}
+
+        def client(user_id):
+            """ client logged in as the user, logged in once """
+            if user_id not in clients:
+                clients[user_id] = Client()
+                clients[user_id].force_login(
+                    get_user_model().objects.get(id=user_id))
+            return clients[user_id]
+
+        def request(logged_in):
+            response = logged_in.get(url)
+            if response.status_code != 200:
+                raise CommandError('%s answered %d' % (
+                    url, response.status_code))
+
+        url = reverse(name)
+        # warm up the caches and the connections
+        for user_id in rand.sample(user_ids, min(10, len(user_ids))):
+            request(client(user_id))
+
+        durations, queries = [], []
+        for _ in range(options['requests']):
+            logged_in = client(rand.choice(user_ids))
+            with ExitStack() as stack:
+                # the reads may go to the read-only alias
+                contexts = [stack.enter_context(CaptureQueriesContext(each))
+                            for each in connections.all()]
+                start = time.perf_counter()
+                request(logged_in)
+                durations.append(time.perf_counter() - start)
+            queries.append(sum(len(context) for context in contexts))
+
+        peaks = []
+        for _ in range(options['memory_requests']):
+            logged_in = client(rand.choice(user_ids))
+            tracemalloc.start()
+            request(logged_in)
+            peaks.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+
+        percentiles = statistics.quantiles(
+            durations, n=100, method='inclusive')
+        return {
+            'requests': len(durations),
+            'p50_ms': round(percentiles[49] * 1000, 3),
+            'p95_ms': round(percentiles[94] * 1000, 3),
+            'p99_ms': round(percentiles[98] * 1000, 3),
+            'queries_median': statistics.median(queries),
+            'queries_max': max(queries),
+            'peak_memory_kb': round(max(peaks) / 1024, 1) if peaks else None,
+        }
@@ -0,0 +1,92 @@
+import os
+
+from django.core.files import File
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from reviews import cards
+from reviews import images
+from reviews import models
+from reviews import thumbnails
+from reviews.storage import HASHED_DIRECTORY, content_hash, hashed_name
+
+
+class Command(BaseCommand):
+    help = ("Move the ticket images to the content-addressed layout, "
+            "keeping one file per distinct content")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help="only print what would be done")
+        parser.add_argument(
+            '--delete-orphans', action='store_true',
+            help="also delete the files of the media root (not of its "
+                 "subdirectories) referenced by no ticket")
+
+    def handle(self, *args, **options):
+        storage = models.Ticket._meta.get_field('image').storage
+        dry_run = options['dry_run']
+        names = models.Ticket.objects.exclude(image='').exclude(
+            image__isnull=True).exclude(
+            image__startswith=HASHED_DIRECTORY + '/'
+        ).values_list('image', flat=True).distinct()
+
+        moved = duplicates = freed = 0
+        for name in list(names):
+            if not storage.exists(name):
+                self.stderr.write("Missing file: %s" % name)
+                continue
+            with storage.open(name) as image:
+                target = hashed_name(name, content_hash(File(image)))
+
+            if storage.exists(target):
+                duplicates += 1
+                freed += storage.size(name)
+                self.stdout.write("%s is a copy of %s" % (name, target))
+                if not dry_run:
+                    storage.delete(name)
+            else:
+                moved += 1
+                self.stdout.write("%s -> %s" % (name, target))
+                if not dry_run:
+                    os.makedirs(os.path.dirname(storage.path(target)),
+                                exist_ok=True)
+                    os.replace(storage.path(name), storage.path(target))
+            if not dry_run:
+                self.retarget(name, target)
+
+        orphans = 0
+        if options['delete_orphans']:
+            referenced = set(models.Ticket.objects.values_list(
+                'image', flat=True))
+            _, files = storage.listdir('')
+            for name in files:
+                if name in referenced \
+                        or thumbnails.variant_stem(name) in referenced:
+                    continue
+                orphans += 1
+                freed += storage.size(name)
+                self.stdout.write("Orphan: %s" % name)
+                if not dry_run:
+                    storage.delete(name)
+
+        self.stdout.write(self.style.SUCCESS(
+            "%s%d files moved, %d duplicates and %d orphans removed, "
+            "%d bytes freed" % ('[dry run] ' if dry_run else '', moved,
+                                duplicates, orphans, freed)))
+
+    def retarget(self, name, target):
+        """ point the tickets to the new file and rebuild its thumbnails,
+            their cards show its url
+        """
+        tickets = models.Ticket.objects.filter(image=name)
+        ticket_ids = list(tickets.values_list('id', flat=True))
+        tickets.update(image=target, thumbnail_ready=False,
+                       time_updated=timezone.now())
+        images.reference(target, len(ticket_ids))
+        models.StoredImage.objects.filter(name=name).delete()
+        images.delete_thumbnails(name)
+        for ticket_id in ticket_ids:
+            cards.invalidate(models.FeedEntry.TICKET, ticket_id)
+            images.process(ticket_id)
@@ -0,0 +1,31 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from reviews import export
+
+
+class Command(BaseCommand):
+    help = "Export the tickets, reviews and follows of a user"
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('--format', choices=sorted(export.FORMATS),
+                            default='ndjson')
+        parser.add_argument('--output',
+                            help="file to write, the standard output if "
+                                 "not given")
+
+    def handle(self, *args, **options):
+        user = get_user_model().objects.filter(
+            username=options['username']).first()
+        if user is None:
+            raise CommandError("Unknown user: %s" % options['username'])
+
+        lines = export.lines(user, options['format'])
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8',
+                      newline='') as output:
+                output.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
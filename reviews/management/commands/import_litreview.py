@@ -0,0 +1,83 @@
+import os
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from reviews import bulk_import
+
+
+class Command(BaseCommand):
+    help = ("Import tickets, reviews and follows from a NDJSON or CSV file "
+            "(the format of export_user, with a user column). "
+            "An interrupted import run again restarts from its checkpoint")
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument(
+            '--format', choices=['ndjson', 'csv'],
+            help="format of the file, guessed from its extension by default")
+        parser.add_argument(
+            '--user',
+            help="author of the records without a user column")
+        parser.add_argument(
+            '--images',
+            help="directory of the image files, the file directory "
+                 "by default")
+        parser.add_argument('--batch-size', type=int,
+                            default=bulk_import.BATCH_SIZE)
+        parser.add_argument(
+            '--checkpoint',
+            help="name of the checkpoint, the absolute path of the file "
+                 "by default")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.exists(path):
+            raise CommandError("No such file: %s" % path)
+        input_format = options['format'] or (
+            'csv' if path.lower().endswith('.csv') else 'ndjson')
+        if options['user'] and not get_user_model().objects.filter(
+                username=options['user']).exists():
+            raise CommandError("Unknown user: %s" % options['user'])
+
+        checkpoint = bulk_import.Checkpoint(
+            options['checkpoint'] or os.path.abspath(path))
+        position, tickets = checkpoint.load()
+        if position:
+            self.stdout.write("Restarting after record %d" % position)
+
+        importer = bulk_import.Importer(
+            default_username=options['user'],
+            image_directory=options['images'] or os.path.dirname(
+                os.path.abspath(path)),
+            tickets=tickets, report=self.report)
+        start = time.perf_counter()
+        done = 0
+
+        def progress(count):
+            nonlocal done
+            done += count
+            self.stdout.write("%d records, %.0f records/s" % (
+                done, done / (time.perf_counter() - start)))
+
+        importer.run(bulk_import.read_records(path, input_format),
+                     checkpoint=checkpoint, position=position,
+                     batch_size=options['batch_size'], progress=progress)
+
+        duration = time.perf_counter() - start
+        counts = importer.counts
+        self.stdout.write(self.style.SUCCESS(
+            "Imported %d tickets, %d reviews and %d follows, %d rejected, "
+            "in %.1f s (%.0f records/s)" % (
+                counts['ticket'], counts['review'], counts['follow'],
+                counts['rejected'], duration,
+                done / duration if duration else 0)))
+        if counts['image']:
+            self.stdout.write(
+                "%d images queued, the thumbnails are built in the "
+                "background (manage.py process_images builds the ones "
+                "left)" % counts['image'])
+
+    def report(self, number, error):
+        self.stderr.write("Record %d rejected: %s" % (number, error))
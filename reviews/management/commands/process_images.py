@@ -0,0 +1,31 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from reviews import images
+from reviews import models
+
+
+class Command(BaseCommand):
+    help = "Build the thumbnails of the ticket images not processed yet"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help="process every ticket image, not only the backlog")
+        parser.add_argument(
+            '--workers', type=int, default=max(settings.IMAGE_WORKERS, 1))
+
+    def handle(self, *args, **options):
+        tickets = models.Ticket.objects.exclude(image='').exclude(
+            image__isnull=True)
+        if not options['all']:
+            tickets = tickets.filter(thumbnail_ready=False)
+        ticket_ids = list(tickets.values_list('id', flat=True))
+
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            list(pool.map(images.process_in_worker, ticket_ids))
+
+        self.stdout.write(self.style.SUCCESS(
+            "Processed %d ticket images" % len(ticket_ids)))
@@ -0,0 +1,30 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from reviews import fanout
+
+
+class Command(BaseCommand):
+    help = "Rebuild the materialized feed (FeedEntry) of the users"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'usernames', nargs='*',
+            help="users to rebuild, all the users if none is given")
+
+    def handle(self, *args, **options):
+        users = get_user_model().objects.order_by('id')
+        if options['usernames']:
+            users = users.filter(username__in=options['usernames'])
+            missing = set(options['usernames']) - set(
+                users.values_list('username', flat=True))
+            if missing:
+                raise CommandError(
+                    "Unknown users: %s" % ', '.join(sorted(missing)))
+
+        count = 0
+        for user_id in users.values_list('id', flat=True).iterator():
+            fanout.rebuild(user_id)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(
+            "Rebuilt the feed of %d users" % count))
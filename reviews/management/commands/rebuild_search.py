@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from reviews import search
+
+
+class Command(BaseCommand):
+    help = ("Index the existing tickets and reviews in the full-text "
+            "search table, in batches")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int,
+                            default=search.REBUILD_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        def progress(content_type, indexed):
+            self.stdout.write('%s: %d posts indexed' % (content_type, indexed))
+
+        indexed = search.rebuild(options['batch_size'], progress)
+        self.stdout.write(self.style.SUCCESS(
+            "Indexed %d tickets and reviews" % indexed))
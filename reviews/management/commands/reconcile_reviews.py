@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from reviews import aggregates
+
+
+class Command(BaseCommand):
+    help = ("Compare the review aggregates stored on the tickets with "
+            "their reviews, in batches, and repair the drifted tickets")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int,
+                            default=aggregates.RECONCILE_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        def progress(checked, repaired):
+            self.stdout.write('%d tickets checked, %d repaired'
+                              % (checked, repaired))
+
+        repaired = aggregates.reconcile(options['batch_size'], progress)
+        self.stdout.write(self.style.SUCCESS(
+            "Repaired %d tickets" % repaired))
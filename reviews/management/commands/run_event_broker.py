@@ -0,0 +1,29 @@
+import asyncio
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from reviews import events
+
+
+class Command(BaseCommand):
+    help = ("Relay the real-time events between the worker processes "
+            "(EVENT_BUS = 'reviews.events.SocketBus') on a unix socket")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--socket', default=str(
+            settings.EVENT_BROKER_SOCKET))
+
+    def handle(self, *args, **options):
+        path = options['socket']
+        if os.path.exists(path):
+            os.remove(path)
+        self.stdout.write("Event broker listening on %s" % path)
+        try:
+            asyncio.run(events.run_broker(path))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,45 @@
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+
+from reviews import seeding
+
+
+class Command(BaseCommand):
+    help = ("Add synthetic users, follows, tickets and reviews to the "
+            "database (power-law follow graph, see reviews.seeding)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--follows', type=int, default=20,
+                            help="mean number of users followed by a user")
+        parser.add_argument('--posts', type=int, default=20,
+                            help="mean number of posts by user")
+        parser.add_argument('--review-ratio', type=float, default=0.4,
+                            help="part of the posts that are reviews")
+        parser.add_argument('--days', type=int, default=365,
+                            help="age of the oldest post")
+        parser.add_argument('--exponent', type=float, default=1.2,
+                            help="exponent of the power laws")
+        parser.add_argument('--prefix', default='load',
+                            help="prefix of the usernames")
+        parser.add_argument('--password',
+                            help="password of the users, they cannot log "
+                                 "in if not given")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        generator = seeding.Generator(
+            users=options['users'], follows=options['follows'],
+            posts=options['posts'], review_ratio=options['review_ratio'],
+            days=options['days'], exponent=options['exponent'],
+            seed=options['seed'], prefix=options['prefix'],
+            # hashed once, shared by all the users
+            password=make_password(options['password'])
+            if options['password'] else '!')
+        user_ids = generator.run()
+        self.stdout.write(self.style.SUCCESS(
+            "Created %d users in %.1f s" % (
+                len(user_ids), time.perf_counter() - start)))
@@ -0,0 +1,100 @@
+# Generated by Django 4.2.1 on 2026-10-17 20:12
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_feed(apps, schema_editor):
+    """fill the materialized feed of the existing users"""
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    Ticket = apps.get_model("reviews", "Ticket")
+    Review = apps.get_model("reviews", "Review")
+    UserFollows = apps.get_model("reviews", "UserFollows")
+    FeedEntry = apps.get_model("reviews", "FeedEntry")
+
+    fields = ("id", "user_id", "time_created")
+    for owner_id in User.objects.values_list("id", flat=True):
+        authors = [owner_id] + list(
+            UserFollows.objects.filter(user_id=owner_id).values_list(
+                "followed_user_id", flat=True
+            )
+        )
+        tickets = Ticket.objects.filter(user_id__in=authors)
+        reviews = Review.objects.filter(
+            models.Q(user_id__in=authors) | models.Q(ticket__user_id=owner_id)
+        )
+        entries = [
+            FeedEntry(
+                owner_id=owner_id,
+                author_id=author_id,
+                content_type=content_type,
+                item_id=item_id,
+                time_created=time_created,
+            )
+            for content_type, queryset in (("TICKET", tickets), ("REVIEW", reviews))
+            for item_id, author_id, time_created in queryset.values_list(*fields)
+        ]
+        FeedEntry.objects.bulk_create(entries, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("reviews", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="FeedEntry",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "content_type",
+                    models.CharField(
+                        choices=[("TICKET", "Ticket"), ("REVIEW", "Critique")],
+                        max_length=6,
+                    ),
+                ),
+                ("item_id", models.PositiveBigIntegerField()),
+                ("time_created", models.DateTimeField()),
+                (
+                    "author",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                (
+                    "owner",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="feed_entries",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["owner", "-time_created"],
+                        name="feedentry_owner_time_idx",
+                    ),
+                    models.Index(
+                        fields=["content_type", "item_id"], name="feedentry_item_idx"
+                    ),
+                ],
+                "unique_together": {("owner", "content_type", "item_id")},
+            },
+        ),
+        migrations.RunPython(backfill_feed, migrations.RunPython.noop),
+    ]
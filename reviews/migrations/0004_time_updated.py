@@ -0,0 +1,29 @@
+# Generated by Django 4.2.1 on 2026-10-17 20:31
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("reviews", "0003_feed_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="review",
+            name="time_updated",
+            field=models.DateTimeField(
+                auto_now=True, default=django.utils.timezone.now
+            ),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name="ticket",
+            name="time_updated",
+            field=models.DateTimeField(
+                auto_now=True, default=django.utils.timezone.now
+            ),
+            preserve_default=False,
+        ),
+    ]
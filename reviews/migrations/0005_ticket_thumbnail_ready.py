@@ -0,0 +1,24 @@
+# Generated by Django 4.2.1 on 2026-10-17 20:42
+
+from django.db import migrations, models
+
+
+def mark_existing_thumbnails_ready(apps, schema_editor):
+    """the existing images were resized when their ticket was saved"""
+    Ticket = apps.get_model("reviews", "Ticket")
+    Ticket.objects.update(thumbnail_ready=True)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("reviews", "0004_time_updated"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="ticket",
+            name="thumbnail_ready",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(mark_existing_thumbnails_ready, migrations.RunPython.noop),
+    ]
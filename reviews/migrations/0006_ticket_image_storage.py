@@ -0,0 +1,24 @@
+# Generated by Django 4.2.1 on 2026-10-17 20:22
+
+from django.db import migrations, models
+import reviews.storage
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("reviews", "0005_ticket_thumbnail_ready"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="ticket",
+            name="image",
+            field=models.ImageField(
+                blank=True,
+                db_index=True,
+                null=True,
+                storage=reviews.storage.image_storage,
+                upload_to="",
+            ),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.1 on 2026-10-17 20:25
+
+from django.db import migrations, models
+
+
+def reset_thumbnails(apps, schema_editor):
+    """the existing images have no WebP thumbnails yet,
+    run manage.py process_images to build them"""
+    Ticket = apps.get_model("reviews", "Ticket")
+    Ticket.objects.exclude(image="").exclude(image__isnull=True).update(
+        thumbnail_ready=False
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("reviews", "0006_ticket_image_storage"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="ticket",
+            name="image_height",
+            field=models.PositiveIntegerField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="ticket",
+            name="image_width",
+            field=models.PositiveIntegerField(editable=False, null=True),
+        ),
+        migrations.RunPython(reset_thumbnails, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,89 @@
+# Generated by Django 4.2.1 on 2026-10-17 23:10
+
+from django.db import migrations
+
+# full-text index of the tickets and reviews (reviews.search)
+# a ticket is the row 2 * id, a review the row 2 * id + 1,
+# run manage.py rebuild_search to index the existing posts
+CREATE_SEARCH = [
+    """
+    CREATE VIRTUAL TABLE reviews_search USING fts5(
+        title,
+        body,
+        content_type UNINDEXED,
+        item_id UNINDEXED,
+        user_id UNINDEXED,
+        tokenize = 'unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER reviews_search_ticket_insert AFTER INSERT ON reviews_ticket
+    BEGIN
+        INSERT INTO reviews_search(rowid, title, body, content_type, item_id, user_id)
+        VALUES (new.id * 2, new.title, new.description, 'TICKET', new.id, new.user_id);
+    END
+    """,
+    """
+    CREATE TRIGGER reviews_search_ticket_update AFTER UPDATE OF title, description, user_id
+    ON reviews_ticket
+    WHEN old.title IS NOT new.title
+        OR old.description IS NOT new.description
+        OR old.user_id IS NOT new.user_id
+    BEGIN
+        UPDATE reviews_search
+        SET title = new.title, body = new.description, user_id = new.user_id
+        WHERE rowid = new.id * 2;
+    END
+    """,
+    """
+    CREATE TRIGGER reviews_search_ticket_delete AFTER DELETE ON reviews_ticket
+    BEGIN
+        DELETE FROM reviews_search WHERE rowid = old.id * 2;
+    END
+    """,
+    """
+    CREATE TRIGGER reviews_search_review_insert AFTER INSERT ON reviews_review
+    BEGIN
+        INSERT INTO reviews_search(rowid, title, body, content_type, item_id, user_id)
+        VALUES (new.id * 2 + 1, new.headline, new.body, 'REVIEW', new.id, new.user_id);
+    END
+    """,
+    """
+    CREATE TRIGGER reviews_search_review_update AFTER UPDATE OF headline, body, user_id
+    ON reviews_review
+    WHEN old.headline IS NOT new.headline
+        OR old.body IS NOT new.body
+        OR old.user_id IS NOT new.user_id
+    BEGIN
+        UPDATE reviews_search
+        SET title = new.headline, body = new.body, user_id = new.user_id
+        WHERE rowid = new.id * 2 + 1;
+    END
+    """,
+    """
+    CREATE TRIGGER reviews_search_review_delete AFTER DELETE ON reviews_review
+    BEGIN
+        DELETE FROM reviews_search WHERE rowid = old.id * 2 + 1;
+    END
+    """,
+]
+
+DROP_SEARCH = [
+    "DROP TRIGGER reviews_search_ticket_insert",
+    "DROP TRIGGER reviews_search_ticket_update",
+    "DROP TRIGGER reviews_search_ticket_delete",
+    "DROP TRIGGER reviews_search_review_insert",
+    "DROP TRIGGER reviews_search_review_update",
+    "DROP TRIGGER reviews_search_review_delete",
+    "DROP TABLE reviews_search",
+]
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("reviews", "0007_ticket_image_size"),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_SEARCH, DROP_SEARCH),
+    ]
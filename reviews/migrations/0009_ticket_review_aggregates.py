@@ -0,0 +1,69 @@
+# Generated by Django 4.2.1 on 2026-10-18 09:40
+
+from importlib import import_module
+
+from django.db import migrations, models
+from django.db.models import Count, Max, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+# SQLite adds the columns by copying the table, the triggers of the
+# full-text index on reviews_ticket are lost with the old table
+search = import_module("reviews.migrations.0008_search")
+TICKET_TRIGGERS = [
+    statement for statement in search.CREATE_SEARCH
+    if "ON reviews_ticket" in statement
+]
+DROP_TICKET_TRIGGERS = [
+    "DROP TRIGGER IF EXISTS reviews_search_ticket_insert",
+    "DROP TRIGGER IF EXISTS reviews_search_ticket_update",
+    "DROP TRIGGER IF EXISTS reviews_search_ticket_delete",
+]
+
+
+def fill_aggregates(apps, schema_editor):
+    """the aggregates of the existing tickets, in one update"""
+    Ticket = apps.get_model("reviews", "Ticket")
+    Review = apps.get_model("reviews", "Review")
+    reviews = Review.objects.filter(ticket=OuterRef("pk")).order_by().values(
+        "ticket"
+    )
+    Ticket.objects.update(
+        review_count=Coalesce(
+            Subquery(reviews.annotate(count=Count("id")).values("count")), 0
+        ),
+        rating_sum=Coalesce(
+            Subquery(reviews.annotate(sum=Sum("rating")).values("sum")), 0
+        ),
+        last_review_at=Subquery(
+            reviews.annotate(last=Max("time_created")).values("last")
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("reviews", "0008_search"),
+    ]
+
+    operations = [
+        # unapplied: the triggers are created again after the copy
+        migrations.RunSQL(migrations.RunSQL.noop, TICKET_TRIGGERS),
+        migrations.AddField(
+            model_name="ticket",
+            name="last_review_at",
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="ticket",
+            name="rating_sum",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="ticket",
+            name="review_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunSQL(DROP_TICKET_TRIGGERS + TICKET_TRIGGERS,
+                          DROP_TICKET_TRIGGERS),
+        migrations.RunPython(fill_aggregates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.2.1 on 2026-10-17 21:45
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_references(apps, schema_editor):
+    """the tickets using each stored image"""
+    Ticket = apps.get_model("reviews", "Ticket")
+    StoredImage = apps.get_model("reviews", "StoredImage")
+    counts = (
+        Ticket.objects.exclude(image="")
+        .exclude(image__isnull=True)
+        .values("image")
+        .annotate(count=Count("id"))
+        .values_list("image", "count")
+    )
+    StoredImage.objects.bulk_create(
+        StoredImage(name=name, reference_count=count) for name, count in counts
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("reviews", "0009_ticket_review_aggregates"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StoredImage",
+            fields=[
+                (
+                    "name",
+                    models.CharField(max_length=100, primary_key=True, serialize=False),
+                ),
+                ("reference_count", models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(count_references, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 4.2.1 on 2026-10-17 22:40
+
+import os
+import re
+import shutil
+
+from django.db import migrations
+
+
+def rename_thumbnails(apps, schema_editor):
+    """the thumbnails are named after the full name of their image,
+    abc...123_250w.webp -> abc...123.jpg_250w.webp, one copy for each
+    stored image sharing the old ones"""
+    Ticket = apps.get_model("reviews", "Ticket")
+    storage = Ticket._meta.get_field("image").storage
+    names = (
+        Ticket.objects.filter(thumbnail_ready=True)
+        .exclude(image="")
+        .values_list("image", flat=True)
+        .distinct()
+    )
+    old_names = set()
+    for name in names:
+        directory, base = os.path.split(name)
+        if not storage.exists(directory):
+            continue
+        pattern = re.compile(
+            re.escape(os.path.splitext(base)[0]) + r"(_\d+w(\.webp|\.jpg))"
+        )
+        for file_name in storage.listdir(directory)[1]:
+            match = pattern.fullmatch(file_name)
+            if match:
+                old_name = os.path.join(directory, file_name)
+                shutil.copyfile(
+                    storage.path(old_name),
+                    storage.path(os.path.join(directory, base + match[1])),
+                )
+                old_names.add(old_name)
+    for old_name in old_names:
+        storage.delete(old_name)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("reviews", "0011_import_checkpoint"),
+    ]
+
+    operations = [
+        migrations.RunPython(rename_thumbnails, migrations.RunPython.noop),
+    ]
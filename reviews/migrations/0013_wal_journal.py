@@ -0,0 +1,32 @@
+# Generated by Django 4.2.1 on 2026-10-17 22:55
+
+from django.db import migrations
+
+
+def enable_wal(apps, schema_editor):
+    """readers and writer do not block each other, the journal mode is
+    kept in the file for every later connection (litreview.database)"""
+    connection = schema_editor.connection
+    if connection.vendor == "sqlite":
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA journal_mode = WAL")
+
+
+def disable_wal(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == "sqlite":
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA journal_mode = DELETE")
+
+
+class Migration(migrations.Migration):
+    # the journal mode cannot change in a transaction
+    atomic = False
+
+    dependencies = [
+        ("reviews", "0012_thumbnail_names"),
+    ]
+
+    operations = [
+        migrations.RunPython(enable_wal, disable_wal),
+    ]
@@ -1,7 +1,10 @@
 from django.conf import settings
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
-from PIL import Image
+from django.templatetags.static import static
+
+from . import thumbnails
+from .storage import image_storage
 
 
 class Ticket(models.Model):
@@ -10,19 +13,93 @@ class Ticket(models.Model):
                                    verbose_name="Description")
     user = models.ForeignKey(settings.AUTH_USER_MODEL,
                              on_delete=models.CASCADE)
-    image = models.ImageField(null=True, blank=True)
+    # stored under the hash of its content, shared by the tickets
+    image = models.ImageField(null=True, blank=True, db_index=True,
+                              storage=image_storage)
+    # the thumbnails are built in the background (reviews.images)
+    thumbnail_ready = models.BooleanField(default=False)
+    # size of the uploaded image, known once processed
+    image_width = models.PositiveIntegerField(null=True, editable=False)
+    image_height = models.PositiveIntegerField(null=True, editable=False)
+    # aggregates of the reviews answering the ticket, maintained with F()
+    # expressions (reviews.aggregates), repaired by reconcile_reviews
+    review_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    last_review_at = models.DateTimeField(null=True, editable=False)
     time_created = models.DateTimeField(auto_now_add=True)
-    IMAGE_MAX_SIZE = (250, 300)
+    # version of the rendered cards, changes on edit
+    time_updated = models.DateTimeField(auto_now=True)
+    IMAGE_MAX_SIZE = thumbnails.IMAGE_MAX_SIZE
+    PLACEHOLDER_IMAGE = 'images/thumbnail_placeholder.svg'
+    # written by the image worker only
+    PROCESSED_FIELDS = ('thumbnail_ready', 'image_width', 'image_height')
+    # written by the review signals only
+    AGGREGATE_FIELDS = ('review_count', 'rating_sum', 'last_review_at')
+
+    class Meta:
+        indexes = [
+            # posts of a user, most recent first
+            models.Index(fields=['user', '-time_created'],
+                         name='ticket_user_time_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # the stored image is released when replaced (reviews.signals)
+        if 'image' in field_names:
+            instance.loaded_image = instance.image.name
+        return instance
+
+    @property
+    def already_reviewed(self):
+        return self.review_count > 0
 
-    def resize_image(self):
-        image = Image.open(self.image)
-        image.thumbnail(self.IMAGE_MAX_SIZE)
-        image.save(self.image.path)
+    @property
+    def average_rating(self):
+        if not self.review_count:
+            return None
+        return self.rating_sum / self.review_count
+
+    @property
+    def thumbnail_size(self):
+        """ displayed (width, height) of the cover """
+        return thumbnails.display_size((self.image_width, self.image_height))
+
+    @property
+    def image_url(self):
+        """ url of the JPEG thumbnail, a placeholder while it is processed """
+        if not self.thumbnail_ready:
+            return static(self.PLACEHOLDER_IMAGE)
+        return self.image.storage.url(thumbnails.variant_name(
+            self.image.name, self.thumbnail_size[0], thumbnails.JPEG))
+
+    @property
+    def image_srcset(self):
+        """ srcset of the WebP thumbnails """
+        sizes = thumbnails.variant_sizes((self.image_width, self.image_height))
+        return ', '.join(
+            '%s %dw' % (self.image.storage.url(thumbnails.variant_name(
+                self.image.name, width, thumbnails.WEBP)), width)
+            for width, _ in sizes)
 
     def save(self, *args, **kwargs):
+        # a new file is uploaded, the post_save signal schedules its
+        # processing, nothing to do when only the text changed
+        self.image_changed = bool(self.image) and not self.image._committed
+        if self.image_changed:
+            self.thumbnail_ready = False
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            # written by the review signals (and by the worker for the
+            # same image), do not overwrite them with the values loaded
+            # before
+            excluded = self.AGGREGATE_FIELDS
+            if not self.image_changed:
+                excluded += self.PROCESSED_FIELDS
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in excluded]
         super().save(*args, **kwargs)
-        if self.image:
-            self.resize_image()
 
     def __str__(self):
         return self.title
@@ -39,6 +116,28 @@ class Review(models.Model):
     body = models.TextField(max_length=8192, blank=True,
                             verbose_name="Contenu")
     time_created = models.DateTimeField(auto_now_add=True)
+    # version of the rendered cards, changes on edit
+    time_updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # posts of a user, most recent first
+            models.Index(fields=['user', '-time_created'],
+                         name='review_user_time_idx'),
+            # reviews of a ticket, review of a ticket by a user
+            models.Index(fields=['ticket', 'user'],
+                         name='review_ticket_user_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # the aggregates of the ticket are updated by difference on edit
+        # (reviews.signals)
+        if 'rating' in field_names and 'ticket_id' in field_names:
+            instance.loaded_rating = instance.rating
+            instance.loaded_ticket_id = instance.ticket_id
+        return instance
 
     def __str__(self):
         return self.headline
@@ -54,3 +153,59 @@ class UserFollows(models.Model):
 
     class Meta:
         unique_together = ('user', 'followed_user')
+        indexes = [
+            # followers of a user
+            models.Index(fields=['followed_user', 'user'],
+                         name='userfollows_followed_idx'),
+        ]
+
+
+class FeedEntry(models.Model):
+    """ materialized feed: one row per post visible in the owner feed
+        written when the post is saved (fan-out on write)
+    """
+    TICKET = 'TICKET'
+    REVIEW = 'REVIEW'
+    CONTENT_TYPE_CHOICES = [
+        (TICKET, 'Ticket'),
+        (REVIEW, 'Critique'),
+    ]
+
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL,
+                              on_delete=models.CASCADE,
+                              related_name='feed_entries')
+    author = models.ForeignKey(settings.AUTH_USER_MODEL,
+                               on_delete=models.CASCADE,
+                               related_name='+')
+    content_type = models.CharField(max_length=6,
+                                    choices=CONTENT_TYPE_CHOICES)
+    item_id = models.PositiveBigIntegerField()
+    time_created = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('owner', 'content_type', 'item_id')
+        indexes = [
+            models.Index(fields=['owner', '-time_created'],
+                         name='feedentry_owner_time_idx'),
+            models.Index(fields=['content_type', 'item_id'],
+                         name='feedentry_item_idx'),
+        ]
+
+
+class StoredImage(models.Model):
+    """ references to a stored image file (reviews.storage), taken before
+        the file is looked up and released with the tickets
+        (reviews.images): the file is deleted with its last reference
+    """
+    name = models.CharField(max_length=100, primary_key=True)
+    reference_count = models.PositiveIntegerField(default=0)
+
+
+class ImportCheckpoint(models.Model):
+    """ one row by batch of a bulk import (reviews.bulk_import), written
+        in the transaction of the batch
+    """
+    name = models.CharField(max_length=255, db_index=True)
+    # records done, ids of the tickets of the batch {file id: ticket id}
+    position = models.PositiveIntegerField()
+    tickets = models.JSONField(default=dict)
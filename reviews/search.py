@@ -0,0 +1,141 @@
+""" full-text search over the tickets and reviews
+    SQLite FTS5 table kept in sync by triggers (migration 0008):
+    a ticket is the row 2 * id, a review the row 2 * id + 1.
+    Results are ranked by bm25, the title weighing more than the text,
+    and browsed with (score, rowid) cursors like the feeds
+"""
+from django.db import connections, router, transaction
+
+from . import feed as feed_engine
+from . import models
+
+SEARCH_TABLE = 'reviews_search'
+# bm25 weights of the title and body columns
+TITLE_WEIGHT = 10.0
+BODY_WEIGHT = 1.0
+REBUILD_BATCH_SIZE = 5000
+
+# the ticket title and description, the review headline and body
+SOURCES = {
+    models.FeedEntry.TICKET: (
+        'reviews_ticket', 'id * 2', 'title', 'description'),
+    models.FeedEntry.REVIEW: (
+        'reviews_review', 'id * 2 + 1', 'headline', 'body'),
+}
+
+
+def match_query(text):
+    """ FTS5 query matching all the words of the text
+        each word is quoted: the operators and the syntax errors
+        of the FTS5 query language are not available to the users
+    """
+    return ' '.join('"%s"' % word.replace('"', '""')
+                    for word in text.split())
+
+
+def encode_cursor(row):
+    """ opaque cursor from a search row """
+    return feed_engine.pack_cursor([repr(row['score']), str(row['rowid'])])
+
+
+def decode_cursor(cursor):
+    """ (score, rowid) from a cursor, None if there is no valid cursor """
+    values = feed_engine.unpack_cursor(cursor)
+    try:
+        score, rowid = values
+        return float(score), int(rowid)
+    except (TypeError, ValueError):
+        return None
+
+
+def search_page(text, size, user=None, after=None, before=None):
+    """ page of the tickets and reviews matching the text, best first
+        with a user, only the posts of the user and of the users it
+        follows. The scores move a little when posts are indexed, a
+        cursor still never returns a row twice in a direction
+    """
+    query = match_query(text)
+    if not query:
+        return feed_engine.CursorPage([])
+    after, before = feed_engine.page_cursors(after, before, decode_cursor)
+
+    sql = ('SELECT rowid, content_type, item_id, score FROM ('
+           ' SELECT rowid, content_type, item_id, user_id,'
+           ' bm25({table}, %s, %s) AS score'
+           ' FROM {table} WHERE {table} MATCH %s'
+           ') WHERE 1').format(table=SEARCH_TABLE)
+    params = [TITLE_WEIGHT, BODY_WEIGHT, query]
+    if user is not None:
+        sql += (' AND (user_id = %s OR user_id IN ('
+                ' SELECT followed_user_id FROM reviews_userfollows'
+                ' WHERE user_id = %s))')
+        params += [user.id, user.id]
+    cursor = before or after
+    if cursor:
+        operator = '<' if before else '>'
+        sql += ' AND (score {0} %s OR (score = %s AND rowid {0} %s))'.format(
+            operator)
+        params += [cursor[0], cursor[0], cursor[1]]
+    direction = 'DESC' if before else 'ASC'
+    sql += ' ORDER BY score {0}, rowid {0} LIMIT %s'.format(direction)
+    # one extra row tells if there is more in that direction
+    params.append(size + 1)
+
+    alias = router.db_for_read(models.Ticket)
+    with connections[alias].cursor() as db_cursor:
+        db_cursor.execute(sql, params)
+        rows = [{'rowid': rowid, 'content_type': content_type,
+                 'id': item_id, 'score': score}
+                for rowid, content_type, item_id, score in db_cursor]
+
+    rows, cursors = feed_engine.page_rows(rows, size, after, before,
+                                          encode_cursor)
+    return feed_engine.CursorPage(feed_engine.hydrate(rows), **cursors)
+
+
+def rebuild(batch_size=REBUILD_BATCH_SIZE, progress=None):
+    """ index again all the tickets and reviews, in place
+        one transaction by batch of ids, the search keeps working and
+        the triggers keep the rows written meanwhile in sync.
+        Return the number of indexed posts
+    """
+    connection = connections[router.db_for_write(models.Ticket)]
+    indexed = 0
+    for content_type, (table, rowid, title, body) in SOURCES.items():
+        last_id = done = 0
+        while True:
+            with transaction.atomic(using=connection.alias), \
+                    connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT MAX(id), COUNT(*) FROM (SELECT id FROM {table}'
+                    ' WHERE id > %s ORDER BY id LIMIT %s)'.format(table=table),
+                    [last_id, batch_size])
+                batch_last_id, count = cursor.fetchone()
+                if not count:
+                    break
+                cursor.execute(
+                    'INSERT OR REPLACE INTO {search}'
+                    '(rowid, title, body, content_type, item_id, user_id)'
+                    ' SELECT {rowid}, {title}, {body}, %s, id, user_id'
+                    ' FROM {table} WHERE id > %s AND id <= %s'.format(
+                        search=SEARCH_TABLE, rowid=rowid, title=title,
+                        body=body, table=table),
+                    [content_type, last_id, batch_last_id])
+            last_id = batch_last_id
+            done += count
+            if progress:
+                progress(content_type, done)
+        indexed += done
+    with connection.cursor() as cursor:
+        # rows of the posts deleted without their trigger
+        cursor.execute(
+            'DELETE FROM {search} WHERE rowid NOT IN ('
+            ' SELECT {ticket_rowid} FROM reviews_ticket UNION ALL'
+            ' SELECT {review_rowid} FROM reviews_review)'.format(
+                search=SEARCH_TABLE,
+                ticket_rowid=SOURCES[models.FeedEntry.TICKET][1],
+                review_rowid=SOURCES[models.FeedEntry.REVIEW][1]))
+        # merge the b-trees written by the batches
+        cursor.execute(
+            "INSERT INTO {0}({0}) VALUES ('optimize')".format(SEARCH_TABLE))
+    return indexed
@@ -0,0 +1,217 @@
+""" synthetic data for the benchmarks
+    users follow each other along a power law: most users follow a few
+    others, some follow many, and a few users are followed by a large
+    part of the site. The most active users post most of the tickets,
+    the reviews mostly answer the tickets of the followed users and the
+    recent days hold more posts than the older ones.
+
+    The rows are inserted with executemany, signals and auto_now_add
+    would be too slow (and would overwrite time_created), the review
+    aggregates are reconciled and the feeds rebuilt afterwards
+"""
+import random
+import re
+from bisect import bisect_left
+from datetime import timedelta
+from itertools import accumulate, islice
+
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.db.models import BigIntegerField, Max
+from django.db.models.functions import Cast, Substr
+from django.utils import timezone
+
+from . import activity
+from . import aggregates
+from . import conditional
+from . import fanout
+from . import follow_graph
+from . import models
+from . import usernames
+
+BATCH_SIZE = 10000
+WORDS = ("livre roman auteur histoire personnage lecture chapitre fin "
+         "intrigue style page tome suite série héros monde magie amour "
+         "enquête voyage souvenir famille guerre secret nuit ville "
+         "excellent décevant captivant lent surprenant drôle sombre").split()
+
+
+def insert(model, columns, rows):
+    """ insert the rows (tuples of the columns values) by batches """
+    sql = 'INSERT INTO %s (%s) VALUES (%s)' % (
+        model._meta.db_table, ', '.join(columns),
+        ', '.join(['%s'] * len(columns)))
+    rows = iter(rows)
+    with connection.cursor() as cursor:
+        while True:
+            batch = list(islice(rows, BATCH_SIZE))
+            if not batch:
+                break
+            cursor.executemany(sql, batch)
+
+
+class Generator:
+    """ writes a synthetic site in the database
+
+        users: number of users
+        follows: mean number of users followed by a user
+        posts: mean number of posts (tickets and reviews) by user
+        review_ratio: part of the posts that are reviews
+        days: age of the oldest post
+        exponent: of the power laws, a larger one gives a more
+            unequal site
+    """
+
+    def __init__(self, users=1000, follows=20, posts=20, review_ratio=0.4,
+                 days=365, exponent=1.2, seed=0, prefix='user',
+                 password='!'):
+        self.users = users
+        self.follows = follows
+        self.posts = posts
+        self.review_ratio = review_ratio
+        self.days = days
+        self.exponent = exponent
+        self.prefix = prefix
+        self.password = password
+        self.rand = random.Random(seed)
+        self.now = timezone.now()
+
+    def run(self, rebuild_feeds=True):
+        """ create everything, return the ids of the new users """
+        with transaction.atomic():
+            user_ids = self.create_users()
+            self.create_follows(user_ids)
+            tickets = self.create_tickets(user_ids)
+            self.create_reviews(user_ids, tickets)
+        aggregates.reconcile()
+        # written without signals, like an import
+        follow_graph.invalidate(user_ids)
+        activity.invalidate()
+        conditional.invalidate()
+        usernames.invalidate()
+        if rebuild_feeds:
+            for user_id in user_ids:
+                fanout.rebuild(user_id)
+        return user_ids
+
+    def weights(self, count):
+        """ cumulative power-law weights, shuffled between the users """
+        weights = [1 / (rank ** self.exponent)
+                   for rank in range(1, count + 1)]
+        self.rand.shuffle(weights)
+        return list(accumulate(weights))
+
+    def pick(self, population, cumulative_weights):
+        return population[bisect_left(
+            cumulative_weights, self.rand.random() * cumulative_weights[-1])]
+
+    def text(self, words):
+        return ' '.join(self.rand.choice(WORDS) for _ in range(words))
+
+    def timestamp(self, oldest=None):
+        """ more posts on the recent days, after oldest if given """
+        age = self.days * 86400 * self.rand.random() ** 2
+        if oldest is not None:
+            age = min(age, (self.now - oldest).total_seconds())
+        return self.now - timedelta(seconds=age)
+
+    def create_users(self):
+        User = get_user_model()
+        # after the largest number used, some users may have been deleted
+        last = User.objects.filter(
+            username__regex=r'^%s[0-9]+$' % re.escape(self.prefix)
+        ).annotate(number=Cast(
+            Substr('username', len(self.prefix) + 1), BigIntegerField())
+        ).aggregate(last=Max('number'))['last']
+        first = 0 if last is None else last + 1
+        User.objects.bulk_create(
+            [User(username='%s%d' % (self.prefix, number),
+                  password=self.password)
+             for number in range(first, first + self.users)],
+            batch_size=1000)
+        return list(User.objects.filter(
+            username__startswith=self.prefix).order_by('-id').values_list(
+            'id', flat=True)[:self.users])[::-1]
+
+    def create_follows(self, user_ids):
+        """ number of follows and followers along power laws """
+        self.followed = {}
+        popularity = self.weights(len(user_ids))
+        # pareto distributed out degree, of mean self.follows
+        shape = 2.0
+        for user_id in user_ids:
+            wanted = min(int(self.rand.paretovariate(shape)
+                             * self.follows * (shape - 1) / shape),
+                         len(user_ids) - 1)
+            followed = set()
+            for _ in range(wanted * 3):
+                if len(followed) >= wanted:
+                    break
+                followed_id = self.pick(user_ids, popularity)
+                if followed_id != user_id:
+                    followed.add(followed_id)
+            self.followed[user_id] = list(followed)
+        insert(models.UserFollows, ['user_id', 'followed_user_id'],
+               ((user_id, followed_id)
+                for user_id, followed in self.followed.items()
+                for followed_id in followed))
+
+    def create_tickets(self, user_ids):
+        """ {user id: [(ticket id, time_created)]} """
+        activity = self.weights(len(user_ids))
+        count = int(self.users * self.posts * (1 - self.review_ratio))
+        last_id = models.Ticket.objects.order_by('-id').values_list(
+            'id', flat=True).first() or 0
+        adapt = connection.ops.adapt_datetimefield_value
+
+        def rows():
+            for number in range(count):
+                time_created = adapt(self.timestamp())
+                yield ('Livre %d' % number,
+                       self.text(self.rand.randint(0, 40)),
+                       self.pick(user_ids, activity), '', False,
+                       time_created, time_created, 0, 0)
+
+        # review aggregates reconciled once the reviews are written
+        insert(models.Ticket, ['title', 'description', 'user_id', 'image',
+                               'thumbnail_ready', 'time_created',
+                               'time_updated', 'review_count',
+                               'rating_sum'], rows())
+        tickets = {}
+        for ticket_id, user_id, time_created in models.Ticket.objects.filter(
+                id__gt=last_id).values_list(
+                'id', 'user_id', 'time_created').iterator(BATCH_SIZE):
+            tickets.setdefault(user_id, []).append((ticket_id, time_created))
+        return tickets
+
+    def create_reviews(self, user_ids, tickets):
+        """ reviews of the tickets of the followed users, or else of any
+            ticket, one review by user and ticket
+        """
+        activity = self.weights(len(user_ids))
+        authors = list(tickets)
+        count = int(self.users * self.posts * self.review_ratio)
+        adapt = connection.ops.adapt_datetimefield_value
+        reviewed = set()
+
+        def rows():
+            for number in range(count):
+                user_id = self.pick(user_ids, activity)
+                followed = [followed_id for followed_id in
+                            self.followed.get(user_id, [])
+                            if followed_id in tickets]
+                author = self.rand.choice(followed or authors)
+                ticket_id, ticket_time = self.rand.choice(tickets[author])
+                if (ticket_id, user_id) in reviewed:
+                    continue
+                reviewed.add((ticket_id, user_id))
+                time_created = adapt(self.timestamp(ticket_time))
+                yield (ticket_id, self.rand.randint(0, 5), user_id,
+                       self.text(self.rand.randint(2, 8)).capitalize(),
+                       self.text(self.rand.randint(10, 120)),
+                       time_created, time_created)
+
+        if authors:
+            insert(models.Review, ['ticket_id', 'rating', 'user_id',
+                                   'headline', 'body', 'time_created',
+                                   'time_updated'], rows())
@@ -0,0 +1,143 @@
+""" keep the materialized feed, the cached latest activity,
+    the cached cards and the stored images in sync with the posts
+    and follows, the cached follow graph in sync with the follows and
+    the username index in sync with the users, the review aggregates of
+    the tickets in sync with the reviews. New posts are published
+    to the events streams, the changes stamped for the conditional GET
+    of the pages
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import activity
+from . import aggregates
+from . import cards
+from . import conditional
+from . import events
+from . import fanout
+from . import follow_graph
+from . import images
+from . import models
+from . import usernames
+
+
+@receiver(post_save, sender=models.Ticket)
+def ticket_saved(sender, instance, created, **kwargs):
+    if getattr(instance, 'image_changed', False):
+        images.schedule(instance.id)
+    previous_image = getattr(instance, 'loaded_image', None)
+    if previous_image and previous_image != instance.image.name:
+        images.dereference(previous_image)
+    instance.loaded_image = instance.image.name
+    if created:
+        fanout.fan_out_ticket(instance)
+        item_id, author_id = instance.id, instance.user_id
+        transaction.on_commit(
+            lambda: events.post_created(fanout.TICKET, item_id, author_id))
+        transaction.on_commit(lambda: conditional.post_changed(author_id))
+    else:
+        transaction.on_commit(
+            lambda: cards.invalidate(fanout.TICKET, instance.id))
+        item_id, author_id = instance.id, instance.user_id
+        transaction.on_commit(
+            lambda: conditional.ticket_changed(item_id, author_id))
+    transaction.on_commit(
+        lambda: activity.post_saved(instance, fanout.TICKET))
+
+
+@receiver(post_save, sender=models.Review)
+def review_saved(sender, instance, created, **kwargs):
+    if created:
+        aggregates.review_created(instance)
+        fanout.fan_out_review(instance)
+        item_id, author_id = instance.id, instance.user_id
+        owner_id = instance.ticket.user_id
+        transaction.on_commit(lambda: events.post_created(
+            fanout.REVIEW, item_id, author_id, owner_id))
+        transaction.on_commit(
+            lambda: conditional.post_changed(author_id, owner_id))
+        transaction.on_commit(
+            lambda: activity.tickets_reviewed({instance.ticket_id}))
+    else:
+        # the ticket of the review as loaded, the review may be moved
+        ticket_ids = {getattr(instance, 'loaded_ticket_id', None),
+                      instance.ticket_id}
+        aggregates.review_changed(instance)
+        transaction.on_commit(
+            lambda: activity.tickets_reviewed(ticket_ids))
+        transaction.on_commit(
+            lambda: cards.invalidate(fanout.REVIEW, instance.id))
+        author_id, ticket_id = instance.user_id, instance.ticket_id
+        transaction.on_commit(
+            lambda: conditional.review_changed(author_id, ticket_id))
+    transaction.on_commit(
+        lambda: activity.post_saved(instance, fanout.REVIEW))
+
+
+@receiver(post_delete, sender=models.Ticket)
+def ticket_deleted(sender, instance, **kwargs):
+    fanout.remove(fanout.TICKET, instance.id)
+    item_id = instance.id
+    if instance.image:
+        images.dereference(instance.image.name)
+    author_id = instance.user_id
+    transaction.on_commit(lambda: conditional.post_changed(author_id))
+    transaction.on_commit(
+        lambda: cards.invalidate(fanout.TICKET, item_id))
+    transaction.on_commit(
+        lambda: activity.post_deleted(fanout.TICKET, item_id))
+
+
+@receiver(post_delete, sender=models.Review)
+def review_deleted(sender, instance, **kwargs):
+    aggregates.review_removed(instance.ticket_id, instance.rating)
+    fanout.remove(fanout.REVIEW, instance.id)
+    item_id = instance.id
+    author_id, ticket_id = instance.user_id, instance.ticket_id
+    transaction.on_commit(
+        lambda: conditional.review_changed(author_id, ticket_id))
+    transaction.on_commit(
+        lambda: cards.invalidate(fanout.REVIEW, item_id))
+    transaction.on_commit(
+        lambda: activity.post_deleted(fanout.REVIEW, item_id))
+    transaction.on_commit(lambda: activity.tickets_reviewed({ticket_id}))
+
+
+@receiver(post_save, sender=models.UserFollows)
+def follow_saved(sender, instance, created, **kwargs):
+    if created:
+        fanout.follow_created(instance)
+        user_id, followed_id = instance.user_id, instance.followed_user_id
+        transaction.on_commit(
+            lambda: follow_graph.follow_created(user_id, followed_id))
+        transaction.on_commit(lambda: conditional.follows_changed(user_id))
+
+
+@receiver(post_delete, sender=models.UserFollows)
+def follow_deleted(sender, instance, **kwargs):
+    fanout.follow_deleted(instance)
+    user_id, followed_id = instance.user_id, instance.followed_user_id
+    transaction.on_commit(
+        lambda: follow_graph.follow_deleted(user_id, followed_id))
+    transaction.on_commit(lambda: conditional.follows_changed(user_id))
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def user_saved(sender, instance, created, update_fields, **kwargs):
+    user_id, username = instance.id, instance.username
+    if created:
+        transaction.on_commit(
+            lambda: usernames.user_created(user_id, username))
+    elif update_fields is None or 'username' in update_fields:
+        # not on login, only last_login is saved
+        transaction.on_commit(
+            lambda: usernames.user_changed(user_id, username))
+        transaction.on_commit(lambda: conditional.user_changed(user_id))
+
+
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def user_deleted(sender, instance, **kwargs):
+    user_id = instance.id
+    transaction.on_commit(lambda: usernames.user_changed(user_id, None))
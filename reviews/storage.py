@@ -0,0 +1,68 @@
+""" content-addressed storage of the ticket images
+    an uploaded file is stored under the hash of its content, the same
+    cover uploaded by several users is stored (and processed) once.
+    A file is referenced before it is looked up (models.StoredImage), an
+    upload of a cover being released keeps it or waits for its deletion,
+    the file is deleted with its last reference (reviews.images.release)
+"""
+import hashlib
+import os
+import uuid
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+
+HASHED_DIRECTORY = 'covers'
+
+
+def content_hash(content):
+    """ sha256 of a file, read by chunks """
+    digest = hashlib.sha256()
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    for chunk in content.chunks():
+        digest.update(chunk)
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    return digest.hexdigest()
+
+
+def hashed_name(name, digest):
+    """ covers/ab/abcdef...123.jpg """
+    extension = os.path.splitext(name)[1].lower()
+    return '%s/%s/%s%s' % (HASHED_DIRECTORY, digest[:2], digest, extension)
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """ file system storage naming the files after their content """
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = hashed_name(name, content_hash(content))
+        # in the transaction of the ticket, imported late: the models use
+        # this storage
+        from . import images
+        images.reference(name)
+        if self.exists(name):
+            # already stored, same name means same content
+            return name
+        return super().save(name, content, max_length)
+
+    def get_available_name(self, name, max_length=None):
+        return name
+
+    def _save(self, name, content):
+        # written under a temporary name then renamed, two uploads of the
+        # same file at the same time write the same content
+        temporary_name = super()._save(
+            '%s.%s.part' % (name, uuid.uuid4().hex), content)
+        os.replace(self.path(temporary_name), self.path(name))
+        return name
+
+
+def image_storage():
+    """ storage of Ticket.image """
+    return ContentAddressedStorage()
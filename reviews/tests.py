@@ -1,3 +1,1618 @@
-from django.test import TestCase
+import asyncio
+import csv
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from itertools import chain
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIHandler
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.core.paginator import Paginator
+from django.db import connection, connections
+from django.db.models import Count, Q
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import get_resolver, reverse
+from django.urls.resolvers import URLPattern
+from django.utils import timezone
+from PIL import Image
+
+from litreview import database
+
+from . import activity
+from . import aggregates
+from . import bulk_import
+from . import cards
+from . import conditional
+from . import events
+from . import fanout
+from . import feed as feed_engine
+from . import follow_graph
+from . import forms
+from . import models
+from . import search
+from . import seeding
+from . import thumbnails
+from . import usernames
+
+
+def seed(number_of_users=6, posts_by_user=8, follows_by_user=3):
+    """ fixture: users each following the next ones, with tickets
+        and reviews answering the tickets of the followed users
+    """
+    User = get_user_model()
+    users = [User.objects.create(username='user%d' % index)
+             for index in range(number_of_users)]
+    for index, user in enumerate(users):
+        for offset in range(1, follows_by_user + 1):
+            models.UserFollows.objects.create(
+                user=user,
+                followed_user=users[(index + offset) % number_of_users])
+    for user in users:
+        for number in range(posts_by_user):
+            models.Ticket.objects.create(
+                title='Ticket %d de %s' % (number, user), user=user)
+    for index, user in enumerate(users):
+        tickets = users[(index + 1) % number_of_users].ticket_set.all()
+        for number, ticket in enumerate(tickets[:posts_by_user // 2]):
+            models.Review.objects.create(
+                ticket=ticket, user=user, rating=number % 6,
+                headline='Critique %d de %s' % (number, user))
+    return users
+
+
+class QueryBudgetTestCase(TestCase):
+    """ base class asserting the number of queries run by a request
+        on a seeded database
+    """
+    NUMBER_OF_USERS = 6
+    POSTS_BY_USER = 8
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = seed(cls.NUMBER_OF_USERS, cls.POSTS_BY_USER)
+        cls.user = cls.users[0]
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def assertQueryBudget(self, budget, url, method='get', **kwargs):
+        """ run the request and fail if it needs more than budget queries
+            return the response
+        """
+        with CaptureQueriesContext(connection) as context:
+            response = getattr(self.client, method)(url, **kwargs)
+        queries = '\n'.join(query['sql'] for query in context.captured_queries)
+        self.assertLessEqual(
+            len(context), budget,
+            '%s %s ran %d queries, budget is %d:\n%s'
+            % (method.upper(), url, len(context), budget, queries))
+        self.assertLess(response.status_code, 400)
+        return response
+
+
+# declared number of queries of each named view of litreview/urls.py,
+# session and user loading included. None: view not measured
+VIEW_BUDGETS = {
+    'login': 0,
+    'logout': 4,
+    # the password change templates are not part of the project
+    'password_change': None,
+    'password_change_done': None,
+    'signup': 0,
+    'home': 9,
+    'feed': 6,
+    'posts': 5,
+    'ticket_create': 2,
+    'ticket_edit': 3,
+    'ticket_delete': 6,
+    'review_without_ticket_create': 2,
+    'review_with_ticket_create': 3,
+    'review_edit': 3,
+    # the review aggregates of the ticket are updated
+    'review_delete': 6,
+    'follow_user': 4,
+    # the first request of the process loads the username index
+    'follow_user_autocomplete': 4,
+    'unfollow_user': 6,
+    # the export queries run while the response is streamed (ExportTests)
+    'export': 2,
+    'search': 5,
+    'api_home': 9,
+    'api_feed': 6,
+    'api_posts': 5,
+    # without the ASGI application in front of Django
+    'events': 0,
+    # staff only, the other users are redirected
+    'metrics': 2,
+    'profiles': 2,
+    'profile_file': None,
+}
+
+
+class ViewQueryBudgetTests(QueryBudgetTestCase):
+
+    def request_kwargs(self, name):
+        """ method, url and arguments of a typical request of the view """
+        ticket = self.user.ticket_set.last()
+        review = self.user.review_set.last()
+        follow = self.user.following.last()
+        requests = {
+            'logout': ('post', reverse('logout'), {}),
+            'ticket_edit': (
+                'get', reverse('ticket_edit', args=[ticket.id]), {}),
+            'ticket_delete': ('post', reverse('ticket_delete'), {
+                'data': json.dumps({'item': ticket.id}),
+                'content_type': 'application/json'}),
+            'review_with_ticket_create': (
+                'get', reverse('review_with_ticket_create', args=[ticket.id]),
+                {}),
+            'review_edit': (
+                'get', reverse('review_edit', args=[review.id]), {}),
+            'review_delete': ('post', reverse('review_delete'), {
+                'data': json.dumps({'item': review.id}),
+                'content_type': 'application/json'}),
+            'unfollow_user': ('post', reverse('unfollow_user'), {
+                'data': json.dumps({'relation': follow.id}),
+                'content_type': 'application/json'}),
+            'search': ('get', reverse('search'), {'data': {'q': 'ticket'}}),
+            'follow_user_autocomplete': (
+                'get', reverse('follow_user_autocomplete'),
+                {'data': {'q': 'user'}}),
+        }
+        if name in requests:
+            return requests[name]
+        return 'get', reverse(name), {}
+
+    def test_every_view_has_a_budget(self):
+        names = {pattern.name for pattern in get_resolver().url_patterns
+                 if isinstance(pattern, URLPattern)}
+        self.assertEqual(names - set(VIEW_BUDGETS), set())
+
+    def test_views_within_budget(self):
+        for name, budget in VIEW_BUDGETS.items():
+            if budget is None:
+                continue
+            with self.subTest(view=name):
+                method, url, kwargs = self.request_kwargs(name)
+                if name in ('login', 'signup'):
+                    self.client.logout()
+                self.assertQueryBudget(budget, url, method, **kwargs)
+                self.client.force_login(self.user)
+
+    def test_next_feed_pages_within_budget(self):
+        for name in ('feed', 'posts'):
+            with self.subTest(view=name):
+                response = self.assertQueryBudget(
+                    VIEW_BUDGETS[name], reverse(name))
+                cursor = response.context['page_obj'].next_cursor
+                self.assertIsNotNone(cursor)
+                self.assertQueryBudget(
+                    VIEW_BUDGETS[name], reverse(name), data={'after': cursor})
+                self.assertQueryBudget(
+                    VIEW_BUDGETS[name] + 1, reverse(name), data={'page': 2})
+
+    def test_feed_budget_does_not_depend_on_history_size(self):
+        for number in range(3 * self.POSTS_BY_USER):
+            ticket = models.Ticket.objects.create(
+                title='Ticket %d' % number, user=self.users[1])
+            models.Review.objects.create(
+                ticket=ticket, user=self.users[2], rating=3,
+                headline='Critique %d' % number)
+        for name in ('home', 'feed'):
+            with self.subTest(view=name):
+                self.assertQueryBudget(VIEW_BUDGETS[name], reverse(name))
+
+
+class FeedPaginationTests(TestCase):
+
+    def setUp(self):
+        self.author = get_user_model().objects.create(username='auteur')
+        self.start = timezone.now() - timedelta(days=1)
+        # a review after every other ticket, interleaved in time
+        for number in range(15):
+            ticket = self.post(models.Ticket, 3 * number,
+                               title='Ticket %d' % number)
+            if number % 2:
+                self.post(models.Review, 3 * number + 1, ticket=ticket,
+                          rating=3, headline='Critique %d' % number)
+
+    def post(self, model, minutes, **fields):
+        """ a post of the author created at start + minutes """
+        post = model.objects.create(user=self.author, **fields)
+        post.time_created = self.start + timedelta(minutes=minutes)
+        model.objects.filter(id=post.id).update(
+            time_created=post.time_created)
+        return post
+
+    def keys(self, posts):
+        return [(type(post).__name__, post.id) for post in posts]
+
+    def test_union_matches_the_sorted_chain(self):
+        # the order of the feeds before the union
+        expected = self.keys(sorted(
+            chain(models.Ticket.objects.filter(user=self.author),
+                  models.Review.objects.filter(user=self.author)),
+            key=lambda post: post.time_created, reverse=True))
+        for feed in (feed_engine.user_posts(self.author),
+                     feed_engine.general_feed()):
+            paginator = Paginator(feed, 6)
+            self.assertEqual(paginator.count, len(expected))
+            self.assertEqual(paginator.num_pages, 4)
+            pages = [self.keys(paginator.page(number))
+                     for number in paginator.page_range]
+            self.assertEqual(pages[1], expected[6:12])
+            self.assertEqual(list(chain(*pages)), expected)
+            self.assertEqual(self.keys([feed[7]]), expected[7:8])
+
+    def cursor_pages(self, feed, size):
+        """ keys of the pages read with the next cursors """
+        page = feed.cursor_page(size)
+        pages = [self.keys(page)]
+        while page.has_next():
+            page = feed.cursor_page(size, after=page.next_cursor)
+            pages.append(self.keys(page))
+        return pages
+
+    def test_posts_created_together(self):
+        first = self.post(models.Ticket, 100, title='Ensemble 1')
+        second = self.post(models.Ticket, 100, title='Ensemble 2')
+        review = self.post(models.Review, 100, ticket=first, rating=5,
+                           headline='Ensemble')
+        feed = feed_engine.user_posts(self.author)
+        pages = self.cursor_pages(feed, 1)
+        # tickets before reviews, then the latest id first
+        self.assertEqual(pages[:3], [[('Ticket', second.id)],
+                                     [('Ticket', first.id)],
+                                     [('Review', review.id)]])
+        self.assertEqual(list(chain(*pages)), self.keys(feed[0:len(feed)]))
+        self.assertEqual(self.cursor_pages(feed, 2)[1],
+                         [('Review', review.id)] + pages[3])
+
+    def test_previous_page_of_the_next_page(self):
+        feed = feed_engine.user_posts(self.author)
+        first = feed.cursor_page(5)
+        second = feed.cursor_page(5, after=first.next_cursor)
+        third = feed.cursor_page(5, after=second.next_cursor)
+        back = feed.cursor_page(5, before=third.previous_cursor)
+        self.assertEqual(self.keys(back), self.keys(second))
+        self.assertEqual((back.previous_cursor, back.next_cursor),
+                         (second.previous_cursor, second.next_cursor))
+        back = feed.cursor_page(5, before=back.previous_cursor)
+        self.assertEqual(self.keys(back), self.keys(first))
+        self.assertFalse(back.has_previous())
+        self.assertEqual(back.next_cursor, first.next_cursor)
+
+    def test_pages_are_stable_when_posts_are_added(self):
+        feed = feed_engine.user_posts(self.author)
+        first = feed.cursor_page(5)
+        second = feed.cursor_page(5, after=first.next_cursor)
+        for number in range(3):
+            self.post(models.Ticket, 1000 + number,
+                      title='Nouveau %d' % number)
+            self.post(models.Ticket, -1000 - number,
+                      title='Ancien %d' % number)
+        self.assertEqual(
+            self.keys(feed.cursor_page(5, after=first.next_cursor)),
+            self.keys(second))
+        self.assertEqual(
+            self.keys(feed.cursor_page(5, before=second.previous_cursor)),
+            self.keys(first))
+        # the numbered pages shift
+        self.assertNotEqual(self.keys(Paginator(feed, 5).page(2)),
+                            self.keys(second))
+
+    def test_invalid_cursor_gives_the_first_page(self):
+        feed = feed_engine.user_posts(self.author)
+        first = self.keys(feed.cursor_page(5))
+        cursors = ['pas-un-curseur', '%%%', feed_engine.encode_cursor(
+            {'time_created': timezone.now(), 'content_type': 'AUTRE',
+             'id': 1})]
+        for cursor in cursors:
+            for direction in ('after', 'before'):
+                with self.subTest(cursor=cursor, direction=direction):
+                    page = feed.cursor_page(5, **{direction: cursor})
+                    self.assertEqual(self.keys(page), first)
+                    self.assertFalse(page.has_previous())
+
+
+@override_settings(FEED_FANOUT_FOLLOWER_LIMIT=2)
+class FanoutTests(TestCase):
+    """ the materialized feed against the feed of the three subqueries
+        it replaced
+    """
+
+    def setUp(self):
+        cache.clear()
+        User = get_user_model()
+        self.users = [User.objects.create(username=name) for name in (
+            'lecteur', 'auteur', 'star', 'fan', 'passant')]
+        self.reader, self.author, self.star, self.fan, self.passer = \
+            self.users
+        for user in self.users:
+            ticket = models.Ticket.objects.create(
+                title='Ticket de %s' % user, user=user)
+            models.Review.objects.create(
+                ticket=ticket, user=user, rating=2,
+                headline='Critique de %s' % user)
+        # answering a ticket of the reader without being followed
+        models.Review.objects.create(
+            ticket=self.reader.ticket_set.get(), user=self.passer,
+            rating=4, headline='Réponse au lecteur')
+
+    def follow(self, user, followed):
+        with self.captureOnCommitCallbacks(execute=True):
+            models.UserFollows.objects.create(user=user,
+                                              followed_user=followed)
+
+    def unfollow(self, user, followed):
+        with self.captureOnCommitCallbacks(execute=True):
+            models.UserFollows.objects.get(
+                user=user, followed_user=followed).delete()
+
+    def reference_feed(self, user):
+        followed_users = user.following.values('followed_user')
+        return feed_engine.Feed(
+            models.Ticket.objects.filter(
+                Q(user__in=followed_users) | Q(user=user)),
+            models.Review.objects.filter(
+                Q(user__in=followed_users) | Q(user=user)
+                | Q(ticket__user=user)))
+
+    def keys(self, feed):
+        return [(post.content_type, post.id) for post in feed[0:len(feed)]]
+
+    def assertFeedsMatch(self):
+        for user in self.users:
+            with self.subTest(user=user.username):
+                self.assertEqual(self.keys(feed_engine.user_feed(user)),
+                                 self.keys(self.reference_feed(user)))
+
+    def test_follow_and_unfollow(self):
+        self.assertFeedsMatch()
+        self.follow(self.reader, self.author)
+        self.assertFeedsMatch()
+        # kept after the unfollow, it answers the reader
+        models.Review.objects.create(
+            ticket=self.reader.ticket_set.get(), user=self.author,
+            rating=5, headline='Réponse suivie')
+        self.unfollow(self.reader, self.author)
+        self.assertFeedsMatch()
+        self.assertIn(
+            'Réponse suivie',
+            [getattr(post, 'headline', None)
+             for post in feed_engine.user_feed(self.reader)[0:10]])
+
+    def test_deleted_posts(self):
+        self.follow(self.reader, self.author)
+        self.author.review_set.get().delete()
+        self.assertFeedsMatch()
+        # with the reviews answering it
+        self.reader.ticket_set.get().delete()
+        self.assertFeedsMatch()
+        self.assertFalse(models.FeedEntry.objects.filter(
+            owner=self.reader, author=self.passer).exists())
+
+    def test_author_crossing_the_follower_limit(self):
+        self.follow(self.reader, self.star)
+        self.follow(self.fan, self.star)
+        self.assertFeedsMatch()
+        # three followers, over the limit: merged at read time
+        self.follow(self.passer, self.star)
+        models.Ticket.objects.create(title='Ticket célèbre', user=self.star)
+        self.assertFalse(models.FeedEntry.objects.filter(
+            owner=self.reader, author=self.star,
+            item_id=self.star.ticket_set.latest('id').id).exists())
+        self.assertFeedsMatch()
+        # back to the limit: copied in the remaining feeds
+        self.unfollow(self.passer, self.star)
+        self.assertTrue(models.FeedEntry.objects.filter(
+            owner=self.reader, author=self.star,
+            item_id=self.star.ticket_set.latest('id').id).exists())
+        self.assertFeedsMatch()
+
+    def test_rebuild_feed(self):
+        self.follow(self.reader, self.author)
+        self.follow(self.reader, self.star)
+        entries = set(models.FeedEntry.objects.values_list(
+            'owner', 'content_type', 'item_id'))
+        models.FeedEntry.objects.all().delete()
+        call_command('rebuild_feed', 'lecteur', stdout=io.StringIO())
+        self.assertEqual(
+            set(models.FeedEntry.objects.values_list(
+                'owner', 'content_type', 'item_id')),
+            {entry for entry in entries if entry[0] == self.reader.id})
+        call_command('rebuild_feed', stdout=io.StringIO())
+        self.assertEqual(set(models.FeedEntry.objects.values_list(
+            'owner', 'content_type', 'item_id')), entries)
+        self.assertFeedsMatch()
+        with self.assertRaises(CommandError):
+            call_command('rebuild_feed', 'inconnu', stdout=io.StringIO())
+
+    @override_settings(FEED_MERGE_FOLLOWER_MARGIN=1)
+    def test_cached_counts_behind_the_database(self):
+        self.follow(self.reader, self.star)
+        self.follow(self.fan, self.star)
+        feed_engine.user_feed(self.reader)
+        # followed in another process, over the limit without the
+        # counts of this one knowing it
+        models.UserFollows.objects.create(user=self.passer,
+                                          followed_user=self.star)
+        with self.captureOnCommitCallbacks(execute=True):
+            models.Ticket.objects.create(title='Ticket célèbre',
+                                         user=self.star)
+        self.assertEqual(follow_graph.followers_counts([self.star.id]),
+                         {self.star.id: 2})
+        self.assertFeedsMatch()
+
+
+class LatestActivityTests(QueryBudgetTestCase):
+
+    def test_cached_latest_activity_costs_no_query(self):
+        expected = feed_engine.general_feed()[:activity.LATEST_ACTIVITY_SIZE]
+        self.assertEqual(activity.latest_activity(), expected)
+        with self.assertNumQueries(0):
+            items = activity.latest_activity()
+            [(item.user.username, item.content_type) for item in items]
+        self.assertEqual(items, expected)
+
+    def test_latest_activity_follows_saves_and_deletes(self):
+        activity.latest_activity()
+        with self.captureOnCommitCallbacks(execute=True):
+            ticket = models.Ticket.objects.create(
+                title='Nouveau', user=self.users[3])
+        self.assertEqual(activity.latest_activity()[0], ticket)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            review = models.Review.objects.create(
+                ticket=ticket, user=self.users[4], rating=4, headline='Bien')
+        self.assertEqual(activity.latest_activity()[:2], [review, ticket])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ticket.title = 'Modifié'
+            ticket.save()
+        with self.assertNumQueries(0):
+            self.assertEqual(activity.latest_activity()[0].ticket.title,
+                             'Modifié')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ticket.delete()
+        self.assertEqual(
+            activity.latest_activity(),
+            feed_engine.general_feed()[:activity.LATEST_ACTIVITY_SIZE])
+
+    def test_reviews_refresh_the_displayed_ticket(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            ticket = models.Ticket.objects.create(
+                title='Noté', user=self.users[5])
+        self.client.get(reverse('home'))
+        with self.captureOnCommitCallbacks(execute=True):
+            review = models.Review.objects.create(
+                ticket=ticket, user=self.users[4], rating=4, headline='Bien')
+        self.assertEqual(activity.latest_activity()[1].review_count, 1)
+        self.assertContains(self.client.get(reverse('home')),
+                            'Note moyenne : 4,0 / 5 (1 critique)')
+        with self.captureOnCommitCallbacks(execute=True):
+            review.rating = 2
+            review.save()
+        self.assertContains(self.client.get(reverse('home')),
+                            'Note moyenne : 2,0 / 5 (1 critique)')
+        with self.captureOnCommitCallbacks(execute=True):
+            review.delete()
+        self.assertEqual(activity.latest_activity()[0].review_count, 0)
+
+    def test_concurrent_writer_invalidates_the_list(self):
+        activity.latest_activity()
+        # another process holds the lock
+        cache.add(activity.LOCK_KEY, True)
+        with self.captureOnCommitCallbacks(execute=True):
+            ticket = models.Ticket.objects.create(
+                title='Nouveau', user=self.users[3])
+        cache.delete(activity.LOCK_KEY)
+        self.assertEqual(activity.latest_activity()[0], ticket)
+
+
+class CardCacheTests(QueryBudgetTestCase):
+
+    def test_cards_are_rendered_once_per_variant(self):
+        first = self.client.get(reverse('feed')).content
+        posts = feed_engine.user_feed(self.user)[:5]
+        cached = cache.get_many([cards.card_key(post.content_type, post.id)
+                                 for post in posts])
+        self.assertEqual(len(cached), len(posts))
+        self.assertEqual(self.client.get(reverse('feed')).content, first)
+
+    def test_viewer_relative_cards(self):
+        ticket = models.Ticket.objects.create(title='Vu', user=self.user)
+        self.assertContains(self.client.get(reverse('feed')),
+                            'Vous avez demandé une critique')
+        follower = models.UserFollows.objects.filter(
+            followed_user=self.user).first().user
+        self.client.force_login(follower)
+        self.assertContains(self.client.get(reverse('feed')),
+                            '%s a demandé une critique' % ticket.user)
+
+    def test_edit_and_delete_invalidate_the_card(self):
+        ticket = models.Ticket.objects.create(title='Avant', user=self.user)
+        self.assertContains(self.client.get(reverse('posts')), 'Avant')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('ticket_edit', args=[ticket.id]),
+                             {'title': 'Après', 'description': ''})
+        self.assertIsNone(
+            cache.get(cards.card_key(feed_engine.TICKET, ticket.id)))
+        response = self.client.get(reverse('posts'))
+        self.assertContains(response, 'Après')
+        self.assertNotContains(response, 'Avant')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ticket.delete()
+        self.assertIsNone(
+            cache.get(cards.card_key(feed_engine.TICKET, ticket.id)))
+
+
+def uploaded_image(name='cover.jpg', size=(1000, 1200)):
+    """ jpeg file as received from the ticket form """
+    content = io.BytesIO()
+    Image.new('RGB', size, 'blue').save(content, 'JPEG')
+    return SimpleUploadedFile(name, content.getvalue(), 'image/jpeg')
+
+
+class TemporaryMediaMixin:
+    """ uploaded files go to a temporary MEDIA_ROOT """
+
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+
+@override_settings(IMAGE_WORKERS=0)
+class ImageProcessingTests(TemporaryMediaMixin, QueryBudgetTestCase):
+
+    def test_thumbnail_is_built_after_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.client.post(reverse('ticket_create'), {
+                'title': 'Couverture', 'description': '',
+                'image': uploaded_image()})
+        ticket = models.Ticket.objects.get(title='Couverture')
+        self.assertFalse(ticket.thumbnail_ready)
+        self.assertIn(models.Ticket.PLACEHOLDER_IMAGE, ticket.image_url)
+
+        for callback in callbacks:
+            callback()
+        ticket.refresh_from_db()
+        self.assertTrue(ticket.thumbnail_ready)
+        self.assertEqual((ticket.image_width, ticket.image_height),
+                         (1000, 1200))
+        self.assertEqual(ticket.thumbnail_size, (250, 300))
+        self.assertTrue(ticket.image_url.endswith('_250w.jpg'))
+        self.assertEqual(
+            [candidate.split(' ')[1] for candidate in
+             ticket.image_srcset.split(', ')],
+            ['125w', '250w', '375w', '500w'])
+        for width, height, extension in ((125, 150, '.webp'),
+                                         (500, 600, '.webp'),
+                                         (250, 300, '.jpg')):
+            name = thumbnails.variant_name(ticket.image.name, width,
+                                           extension)
+            with Image.open(ticket.image.storage.path(name)) as picture:
+                self.assertEqual(picture.size, (width, height))
+
+        response = self.client.get(reverse('posts'))
+        self.assertContains(response, ticket.image_srcset)
+        self.assertContains(response, 'sizes="250px"')
+
+    def test_small_image_is_not_enlarged(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            ticket = models.Ticket.objects.create(
+                title='Petite', user=self.user,
+                image=uploaded_image(size=(200, 100)))
+        ticket.refresh_from_db()
+        self.assertEqual(ticket.thumbnail_size, (200, 100))
+        self.assertEqual(
+            [candidate.split(' ')[1] for candidate in
+             ticket.image_srcset.split(', ')], ['125w', '200w'])
+
+    def test_image_edit_keeps_the_aggregates(self):
+        # loaded before the review, as by the edit form
+        ticket = models.Ticket.objects.get(
+            id=self.users[1].ticket_set.first().id)
+        models.Review.objects.create(
+            ticket=ticket, user=self.users[2], rating=4, headline='Bien')
+        ticket.image = uploaded_image()
+        with self.captureOnCommitCallbacks(execute=True):
+            ticket.save()
+        ticket.refresh_from_db()
+        self.assertEqual(
+            (ticket.review_count, ticket.rating_sum, ticket.last_review_at),
+            aggregates.actual([ticket.id])[ticket.id])
+        self.assertTrue(ticket.thumbnail_ready)
+
+    def test_text_edit_does_not_process_the_image(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            ticket = models.Ticket.objects.create(
+                title='Avant', user=self.user, image=uploaded_image())
+        with mock.patch('reviews.images.process') as process, \
+                self.captureOnCommitCallbacks(execute=True):
+            # instance loaded before the thumbnail was ready
+            ticket.title = 'Après'
+            ticket.save()
+        process.assert_not_called()
+        ticket.refresh_from_db()
+        self.assertEqual(ticket.title, 'Après')
+        self.assertTrue(ticket.thumbnail_ready)
+
+
+@override_settings(IMAGE_WORKERS=0)
+class ImageStorageTests(TemporaryMediaMixin, QueryBudgetTestCase):
+
+    def create_ticket(self, title, image):
+        with self.captureOnCommitCallbacks(execute=True):
+            return models.Ticket.objects.create(
+                title=title, user=self.user, image=image)
+
+    def test_same_image_is_stored_once(self):
+        first = self.create_ticket('Premier', uploaded_image('a.jpg'))
+        second = self.create_ticket('Second', uploaded_image('b.jpg'))
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertTrue(first.image.name.startswith('covers/'))
+        other = self.create_ticket('Autre', uploaded_image(size=(100, 100)))
+        self.assertNotEqual(other.image.name, first.image.name)
+
+    def test_file_is_deleted_with_its_last_ticket(self):
+        first = self.create_ticket('Premier', uploaded_image())
+        second = self.create_ticket('Second', uploaded_image())
+        path = first.image.path
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(os.path.exists(path))
+        with self.captureOnCommitCallbacks(execute=True):
+            second.image = uploaded_image(size=(100, 100))
+            second.save()
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(os.listdir(os.path.dirname(path)), [])
+        self.assertTrue(os.path.exists(second.image.path))
+
+    @override_settings(IMAGE_WORKERS=0)
+    def test_same_content_under_two_extensions(self):
+        jpg = self.create_ticket('Jpg', uploaded_image('a.jpg'))
+        jpeg = self.create_ticket('Jpeg', uploaded_image('a.jpeg'))
+        self.assertNotEqual(jpg.image.name, jpeg.image.name)
+        jpeg.refresh_from_db()
+        with self.captureOnCommitCallbacks(execute=True):
+            jpg.delete()
+        # the thumbnails of the other name are kept
+        directory = os.path.dirname(jpeg.image.path)
+        self.assertEqual(
+            sorted(os.listdir(directory)),
+            sorted([os.path.basename(jpeg.image.name)] + [
+                os.path.basename(thumbnails.variant_name(
+                    jpeg.image.name, width, extension))
+                for width, extension in ((125, '.webp'), (250, '.webp'),
+                                         (375, '.webp'), (500, '.webp'),
+                                         (250, '.jpg'))]))
+
+    def test_upload_during_the_release_keeps_the_file(self):
+        first = self.create_ticket('Premier', uploaded_image())
+        path = first.image.path
+        with self.captureOnCommitCallbacks() as callbacks:
+            first.delete()
+        # the same cover stored by a ticket not saved yet
+        second = models.Ticket(title='Second', user=self.user)
+        second.image.save('autre.jpg', uploaded_image(), save=False)
+        self.assertEqual(second.image.path, path)
+        for callback in callbacks:
+            callback()
+        self.assertTrue(os.path.exists(path))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.save()
+        self.assertEqual(models.StoredImage.objects.get(
+            name=second.image.name).reference_count, 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(models.StoredImage.objects.exists())
+
+
+class ExportTests(QueryBudgetTestCase):
+
+    def streamed(self, url):
+        """ status, content type and lines of a streamed response
+            with the number of queries run to stream it
+        """
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+            content = b''.join(response.streaming_content).decode()
+        return response, content.splitlines(), len(context)
+
+    def test_ndjson_export(self):
+        response, lines, queries = self.streamed(reverse('export'))
+        self.assertEqual(response['Content-Type'],
+                         'application/x-ndjson; charset=utf-8')
+        self.assertIn('attachment', response['Content-Disposition'])
+        records = [json.loads(line) for line in lines]
+        counts = {kind: sum(record['type'] == kind for record in records)
+                  for kind in ('ticket', 'review', 'follow')}
+        self.assertEqual(counts, {
+            'ticket': self.user.ticket_set.count(),
+            'review': self.user.review_set.count(),
+            'follow': self.user.following.count()})
+        self.assertEqual(records[0]['title'], 'Ticket 0 de user0')
+        self.assertEqual(records[-1]['followed_user'], 'user3')
+        # session, user, one query by kind of record whatever the size
+        self.assertEqual(queries, 5)
+
+    def test_csv_export(self):
+        response, lines, queries = self.streamed(
+            reverse('export') + '?format=csv')
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        rows = list(csv.DictReader(lines))
+        self.assertEqual(len(rows), 8 + 4 + 3)
+        self.assertEqual(rows[8]['type'], 'review')
+        self.assertEqual(rows[8]['headline'], 'Critique 0 de user0')
+        self.assertEqual(queries, 5)
+
+    def test_unknown_format(self):
+        response = self.client.get(reverse('export') + '?format=xml')
+        self.assertEqual(response.status_code, 400)
+
+    def test_command(self):
+        output = io.StringIO()
+        call_command('export_user', 'user0', stdout=output)
+        self.assertEqual(len(output.getvalue().splitlines()), 8 + 4 + 3)
+
+
+@override_settings(IMAGE_WORKERS=0)
+class ImportTests(TemporaryMediaMixin, QueryBudgetTestCase):
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'catalogue.ndjson')
+        with open(os.path.join(directory, 'cover.jpg'), 'wb') as image:
+            image.write(uploaded_image().read())
+
+    def write(self, records, mode='w'):
+        with open(self.path, mode) as source:
+            for record in records:
+                source.write(json.dumps(record) + '\n')
+
+    def run_import(self, *args):
+        output, errors = io.StringIO(), io.StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('import_litreview', self.path, '--user', 'user1',
+                         '--batch-size', '2', *args,
+                         stdout=output, stderr=errors)
+        return output.getvalue(), errors.getvalue()
+
+    def feeds(self):
+        return set(models.FeedEntry.objects.values_list(
+            'owner', 'content_type', 'item_id'))
+
+    def test_import(self):
+        self.write([
+            {'type': 'ticket', 'id': 'a', 'title': 'Importé',
+             'image': 'cover.jpg'},
+            {'type': 'ticket', 'id': 'b', 'title': 'Autre', 'user': 'user2'},
+            {'type': 'review', 'ticket': 'a', 'rating': 4,
+             'headline': 'Critique importée', 'user': 'user0'},
+            {'type': 'review', 'ticket': 'z', 'rating': 4, 'headline': 'x'},
+            {'type': 'follow', 'followed_user': 'user5'},
+            {'type': 'ticket', 'title': 'Inconnu', 'user': 'nobody'},
+        ])
+        output, errors = self.run_import()
+        self.assertIn('Imported 2 tickets, 1 reviews and 1 follows, '
+                      '2 rejected', output)
+        self.assertIn('Record 4 rejected', errors)
+        self.assertIn('Record 6 rejected', errors)
+
+        ticket = models.Ticket.objects.get(title='Importé')
+        self.assertEqual(ticket.user.username, 'user1')
+        self.assertTrue(ticket.thumbnail_ready)
+        review = models.Review.objects.get(headline='Critique importée')
+        self.assertEqual(review.ticket, ticket)
+        self.assertTrue(models.UserFollows.objects.filter(
+            user__username='user1', followed_user__username='user5').exists())
+
+        # the feeds are those the signals would have written
+        imported = self.feeds()
+        for user in self.users:
+            fanout.rebuild(user.id)
+        self.assertEqual(imported, self.feeds())
+
+    def test_rejected_ticket_keeps_no_image(self):
+        self.write([{'type': 'ticket', 'title': 'x' * 129,
+                     'image': 'cover.jpg'}])
+        output, errors = self.run_import()
+        self.assertIn('Imported 0 tickets', output)
+        self.assertIn('Record 1 rejected', errors)
+        self.assertFalse(models.StoredImage.objects.exists())
+        self.assertEqual(os.listdir(settings.MEDIA_ROOT), [])
+
+    def test_follows_already_present(self):
+        self.write([
+            {'type': 'follow', 'user': 'user0', 'followed_user': 'user1'},
+            {'type': 'follow', 'user': 'user0', 'followed_user': 'user5'},
+            {'type': 'follow', 'user': 'user0', 'followed_user': 'user5'},
+        ])
+        output, _ = self.run_import()
+        self.assertIn('Imported 0 tickets, 0 reviews and 1 follows', output)
+        self.assertEqual(self.users[0].following.filter(
+            followed_user=self.users[5]).count(), 1)
+
+    def test_restart_from_checkpoint(self):
+        self.write([{'type': 'ticket', 'id': number, 'title': str(number)}
+                    for number in range(3)])
+        self.run_import()
+        self.write([{'type': 'review', 'ticket': 2, 'rating': 3,
+                     'headline': 'Suite', 'user': 'user0'}], mode='a')
+        output, _ = self.run_import()
+        self.assertIn('Restarting after record 3', output)
+        self.assertIn('Imported 0 tickets, 1 reviews', output)
+        self.assertEqual(models.Ticket.objects.filter(
+            title__in=['0', '1', '2']).count(), 3)
+        self.assertEqual(models.Review.objects.get(headline='Suite').ticket,
+                         models.Ticket.objects.get(title='2'))
+
+    def test_import_by_batch(self):
+        self.write([{'type': 'ticket', 'title': str(number)}
+                    for number in range(10)])
+        with CaptureQueriesContext(connection) as small:
+            self.run_import('--checkpoint', self.path + '.1')
+        with CaptureQueriesContext(connection) as large:
+            self.run_import('--checkpoint', self.path + '.2',
+                            '--batch-size', '10')
+        # user check, checkpoint, then by batch: savepoint, usernames,
+        # tickets, followers (2 queries), feed entries, checkpoint, release
+        self.assertEqual(len(large), 2 + 8)
+        self.assertEqual(len(small), 2 + 5 * 8)
+
+    def test_checkpoint_in_the_batch_transaction(self):
+        self.write([{'type': 'ticket', 'id': number, 'title': str(number)}
+                    for number in range(4)])
+        saved = bulk_import.Checkpoint.save
+
+        def crash_on_second_batch(checkpoint, position, tickets):
+            if position > 2:
+                raise KeyboardInterrupt
+            saved(checkpoint, position, tickets)
+
+        with mock.patch.object(bulk_import.Checkpoint, 'save',
+                               crash_on_second_batch), \
+                self.assertRaises(KeyboardInterrupt):
+            self.run_import()
+        # the second batch is rolled back with its checkpoint
+        self.assertEqual(models.Ticket.objects.filter(
+            title__in=['0', '1', '2', '3']).count(), 2)
+        output, _ = self.run_import()
+        self.assertIn('Restarting after record 2', output)
+        self.assertEqual(models.Ticket.objects.filter(
+            title__in=['0', '1', '2', '3']).count(), 4)
+
+    def test_follows_backfilled_by_follower(self):
+        self.write([
+            {'type': 'follow', 'user': 'user0', 'followed_user': 'user4'},
+            {'type': 'follow', 'user': 'user0', 'followed_user': 'user5'},
+            {'type': 'follow', 'user': 'user1', 'followed_user': 'user5'},
+        ])
+        with mock.patch('reviews.fanout.backfill',
+                        wraps=fanout.backfill) as backfill:
+            self.run_import('--batch-size', '3')
+        self.assertEqual(sorted((call.args[0], sorted(call.args[1]))
+                                for call in backfill.call_args_list),
+                         [(self.users[0].id, [self.users[4].id,
+                                              self.users[5].id]),
+                          (self.users[1].id, [self.users[5].id])])
+        imported = self.feeds()
+        for user in self.users:
+            fanout.rebuild(user.id)
+        self.assertEqual(imported, self.feeds())
+
+
+class SeedingTests(TestCase):
+
+    def test_power_law_site(self):
+        user_ids = seeding.Generator(users=200, follows=10, posts=10).run()
+        self.assertEqual(len(user_ids), 200)
+        followers = sorted(models.UserFollows.objects.filter(
+            followed_user__in=user_ids).values('followed_user').annotate(
+            count=Count('id')).values_list('count', flat=True))
+        # a few users are followed by many, most by few
+        self.assertGreater(followers[-1], 10 * followers[len(followers) // 2])
+        self.assertEqual(models.Ticket.objects.count(), 200 * 10 * 6 // 10)
+        for review in models.Review.objects.select_related('ticket')[:100]:
+            self.assertGreaterEqual(review.time_created,
+                                    review.ticket.time_created)
+        self.assertTrue(models.FeedEntry.objects.exists())
+
+    def test_numbers_after_the_largest(self):
+        User = get_user_model()
+        seeding.Generator(users=3, follows=1, posts=1).run()
+        User.objects.filter(username='user1').delete()
+        User.objects.create(username='userbob')
+        with mock.patch('reviews.activity.invalidate') as activity_changed, \
+                mock.patch('reviews.conditional.invalidate') as pages_changed:
+            seeding.Generator(users=2, follows=1, posts=1).run()
+        self.assertEqual(
+            sorted(User.objects.values_list('username', flat=True)),
+            ['user0', 'user2', 'user3', 'user4', 'userbob'])
+        activity_changed.assert_called_once_with()
+        pages_changed.assert_called_once_with()
+
+
+class PerformanceMiddlewareTests(QueryBudgetTestCase):
+
+    def test_server_timing(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('feed'))
+        timing = response['Server-Timing']
+        self.assertIn('sql;dur=', timing)
+        self.assertIn('desc="%d queries"' % len(context), timing)
+        for name in ('template', 'python', 'view', 'total'):
+            self.assertIn('%s;dur=' % name, timing)
+
+    @override_settings(SLOW_REQUEST_MS=0)
+    def test_slow_request_log(self):
+        with self.assertLogs('litreview.performance', 'WARNING') as logs:
+            self.client.get(reverse('posts'))
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['view'], 'posts')
+        self.assertEqual(record['status'], 200)
+        self.assertEqual(record['user'], self.user.id)
+        self.assertGreater(record['sql_queries'], 0)
+
+    def test_metrics_are_staff_only(self):
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 302)
+
+        self.client.get(reverse('feed'))
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        content = response.content.decode()
+        self.assertIn('# TYPE litreview_request_duration_seconds histogram',
+                      content)
+        self.assertRegex(
+            content, r'litreview_request_sql_queries_bucket'
+                     r'\{view="feed",le="\+Inf"\} [1-9]')
+
+
+class ProfilerTests(QueryBudgetTestCase):
+
+    def setUp(self):
+        super().setUp()
+        profiles_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, profiles_dir)
+        settings_override = override_settings(PROFILES_DIR=profiles_dir,
+                                              PROFILES_KEPT=2)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.profiles_dir = profiles_dir
+
+    def test_switch_is_staff_only(self):
+        response = self.client.get(reverse('feed') + '?_profile')
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(os.listdir(self.profiles_dir), [])
+
+    def test_profiles_ring_buffer(self):
+        self.user.is_staff = True
+        self.user.save()
+        ids = [self.client.get(reverse('feed'), HTTP_X_PROFILE='1')[
+            'X-Profile-Id'] for _ in range(3)]
+        self.assertEqual(len(os.listdir(self.profiles_dir)), 2 * 3)
+
+        response = self.client.get(reverse('profiles'))
+        self.assertNotContains(response, ids[0])
+        self.assertContains(response, ids[2])
+        response = self.client.get(
+            reverse('profile_file', args=[ids[2], 'collapsed']))
+        stacks = b''.join(response.streaming_content).decode()
+        self.assertIn('feed (views.py', stacks)
+        response = self.client.get(
+            reverse('profile_file', args=['..settings', 'pstats']))
+        self.assertEqual(response.status_code, 404)
+
+
+class SearchTests(QueryBudgetTestCase):
+
+    def found(self, text, user=None, size=100):
+        return [(post.content_type, post.id)
+                for post in search.search_page(text, size, user=user)]
+
+    def test_triggers_keep_the_index_in_sync(self):
+        ticket = models.Ticket.objects.create(
+            title='Les Misérables', description='roman', user=self.user)
+        review = models.Review.objects.create(
+            ticket=ticket, user=self.user, rating=4, headline='Superbe',
+            body='Une fresque')
+        self.assertEqual(self.found('miserables'), [('TICKET', ticket.id)])
+        self.assertEqual(self.found('fresque'), [('REVIEW', review.id)])
+
+        ticket.title = 'Notre-Dame de Paris'
+        ticket.save()
+        review.body = 'Une cathédrale'
+        review.save()
+        self.assertEqual(self.found('miserables'), [])
+        self.assertEqual(self.found('paris'), [('TICKET', ticket.id)])
+        self.assertEqual(self.found('cathedrale'), [('REVIEW', review.id)])
+
+        ticket.delete()
+        self.assertEqual(self.found('paris'), [])
+        self.assertEqual(self.found('cathedrale'), [])
+
+    def test_title_ranks_first(self):
+        in_body = models.Ticket.objects.create(
+            title='Essai', description='un livre sur la baleine',
+            user=self.user)
+        in_title = models.Ticket.objects.create(
+            title='La baleine', user=self.users[1])
+        self.assertEqual(self.found('baleine'), [('TICKET', in_title.id),
+                                                 ('TICKET', in_body.id)])
+
+    def test_follows_scope(self):
+        authors = {self.user.id} | set(self.user.following.values_list(
+            'followed_user', flat=True))
+        posts = search.search_page('ticket', 100, user=self.user)
+        self.assertTrue(posts.items)
+        self.assertLessEqual({post.user_id for post in posts}, authors)
+        self.assertGreater(len(self.found('ticket')), len(posts))
+
+    def test_cursor_pages(self):
+        expected = self.found('ticket')
+        pages, after = [], None
+        while True:
+            page = search.search_page('ticket', 7, after=after)
+            pages.append(page)
+            if not page.has_next():
+                break
+            after = page.next_cursor
+        self.assertEqual([(post.content_type, post.id)
+                          for page in pages for post in page], expected)
+        previous = search.search_page(
+            'ticket', 7, before=pages[1].previous_cursor)
+        self.assertEqual([post.id for post in previous],
+                         [post.id for post in pages[0]])
+        # the cursors of the feeds are not search cursors
+        first = [post.id for post in pages[0]]
+        for cursor in ('pas-un-curseur', feed_engine.encode_cursor(
+                {'time_created': timezone.now(), 'content_type': 'TICKET',
+                 'id': 1})):
+            with self.subTest(cursor=cursor):
+                page = search.search_page('ticket', 7, after=cursor)
+                self.assertEqual([post.id for post in page], first)
+                self.assertFalse(page.has_previous())
+
+    def test_query_syntax_is_not_exposed(self):
+        self.assertEqual(self.found('"ticket AND (* NEAR'), [])
+        self.assertEqual(self.found('   '), [])
+
+    def test_rebuild(self):
+        expected = self.found('ticket')
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM reviews_search')
+            # a row left by a post deleted without its trigger
+            cursor.execute(
+                "INSERT INTO reviews_search(rowid, title, content_type,"
+                " item_id, user_id) VALUES (999998, 'ticket', 'TICKET',"
+                " 499999, %s)", [self.user.id])
+        indexed = search.rebuild(batch_size=10)
+        self.assertEqual(indexed, models.Ticket.objects.count()
+                         + models.Review.objects.count())
+        self.assertEqual(self.found('ticket'), expected)
+
+    def test_view_keeps_the_query_in_the_pagination(self):
+        response = self.assertQueryBudget(
+            VIEW_BUDGETS['search'], reverse('search'),
+            data={'q': 'ticket', 'scope': 'follows'})
+        cursor = response.context['page_obj'].next_cursor
+        self.assertContains(
+            response, '?q=ticket&amp;scope=follows&amp;after=%s' % cursor)
+
+
+class UsernameAutocompleteTests(QueryBudgetTestCase):
+
+    def complete(self, prefix):
+        response = self.client.get(reverse('follow_user_autocomplete'),
+                                   {'q': prefix})
+        return response.json()['usernames']
+
+    def test_suggestions(self):
+        # user0 follows user1 to user3
+        self.assertEqual(self.complete('USER'), ['user4', 'user5'])
+        self.assertEqual(self.complete('user5'), ['user5'])
+        self.assertEqual(self.complete('other'), [])
+        self.assertEqual(self.complete(''), [])
+
+    def test_warm_index_runs_no_query(self):
+        self.complete('user')
+        # session, user and followed users
+        self.assertQueryBudget(3, reverse('follow_user_autocomplete'),
+                               data={'q': 'user'})
+
+    def test_signup_updates_the_index(self):
+        self.complete('user')
+        with self.captureOnCommitCallbacks(execute=True):
+            get_user_model().objects.create(username='User6')
+        self.assertQueryBudget(3, reverse('follow_user_autocomplete'),
+                               data={'q': 'user'})
+        self.assertEqual(self.complete('user'), ['user4', 'user5', 'User6'])
+
+    def test_signup_in_another_process(self):
+        self.complete('user')
+        get_user_model().objects.create(username='user7')
+        cache.set(usernames.VERSION_KEY,
+                  cache.get(usernames.VERSION_KEY, 0) + 1)
+        # the new users only
+        self.assertQueryBudget(4, reverse('follow_user_autocomplete'),
+                               data={'q': 'user'})
+        self.assertIn('user7', self.complete('user'))
+
+    def test_signup_after_another_process(self):
+        self.complete('user')
+        # committed by another process first
+        get_user_model().objects.create(username='user7')
+        cache.set(usernames.VERSION_KEY,
+                  cache.get(usernames.VERSION_KEY, 0) + 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            get_user_model().objects.create(username='user8')
+        self.assertEqual(self.complete('user'),
+                         ['user4', 'user5', 'user7', 'user8'])
+
+    def test_seeded_users(self):
+        self.complete('user')
+        seeding.Generator(users=3, posts=1, follows=1,
+                          prefix='seed').run(rebuild_feeds=False)
+        self.assertEqual(self.complete('seed'), ['seed0', 'seed1', 'seed2'])
+
+    def test_deleted_user_is_removed(self):
+        self.complete('user')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.users[5].delete()
+        self.assertEqual(self.complete('user'), ['user4'])
+
+    def test_follow_form_validation(self):
+        with CaptureQueriesContext(connection) as context:
+            form = forms.FollowUserForm({'followed_user': 'user4'})
+            self.assertTrue(form.is_valid())
+        self.assertEqual(len(context), 1)
+        self.assertEqual(form.cleaned_data['followed_user'], self.users[4])
+        form = forms.FollowUserForm({'followed_user': 'nobody'})
+        self.assertEqual(form.errors['followed_user'],
+                         ['Utilisateur inconnu'])
+
+
+class FollowGraphTests(QueryBudgetTestCase):
+
+    def followed_ids(self, user):
+        return sorted(user.following.values_list('followed_user', flat=True))
+
+    def test_warm_feed_runs_no_follow_query(self):
+        self.client.get(reverse('feed'))
+        response = self.assertQueryBudget(VIEW_BUDGETS['feed'] - 1,
+                                          reverse('feed'))
+        self.assertEqual(len(response.context['page_obj']), 5)
+
+    def test_compact_arrays(self):
+        followed = follow_graph.following(self.user.id)
+        self.assertEqual(list(followed), self.followed_ids(self.user))
+        self.assertEqual(
+            len(cache.get(follow_graph.following_key(self.user.id))[1]),
+            8 * len(followed))
+        self.assertEqual(follow_graph.followers_counts(list(followed)),
+                         dict.fromkeys(followed, 3))
+
+    def test_follow_views_update_the_cache_in_place(self):
+        follow_graph.following(self.user.id)
+        follow_graph.followers_counts([self.users[4].id])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('follow_user'),
+                             {'followed_user': self.users[4].username})
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(list(follow_graph.following(self.user.id)),
+                             self.followed_ids(self.user))
+            self.assertEqual(follow_graph.followers_counts(
+                [self.users[4].id]), {self.users[4].id: 4})
+        # the expected ids only
+        self.assertEqual(len(context), 1)
+
+        follow = self.user.following.get(followed_user=self.users[1])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('unfollow_user'),
+                             json.dumps({'relation': follow.id}),
+                             content_type='application/json')
+        self.assertNotIn(self.users[1].id,
+                         follow_graph.following(self.user.id))
+        self.assertEqual(follow_graph.followers_counts([self.users[1].id]),
+                         {self.users[1].id: 2})
+
+    @override_settings(FOLLOW_GRAPH_SECONDS=10)
+    def test_follow_of_another_process(self):
+        follow_graph.following(self.user.id)
+        # without the signals of this process
+        models.UserFollows.objects.create(user=self.user,
+                                          followed_user=self.users[4])
+        self.assertNotIn(self.users[4].id,
+                         follow_graph.following(self.user.id))
+        with mock.patch('django.core.cache.backends.locmem.time.time',
+                        return_value=time.time() + 11):
+            self.assertIn(self.users[4].id,
+                          follow_graph.following(self.user.id))
+
+    def test_follow_while_the_array_is_locked(self):
+        follow_graph.following(self.user.id)
+        # held by the writer of another follow
+        cache.add(follow_graph.lock_key(self.user.id), True)
+        with self.captureOnCommitCallbacks(execute=True):
+            models.UserFollows.objects.create(user=self.user,
+                                              followed_user=self.users[4])
+        cache.delete(follow_graph.lock_key(self.user.id))
+        self.assertIn(self.users[4].id, follow_graph.following(self.user.id))
+
+    def test_array_loaded_before_a_follow(self):
+        # read by a request before the commit, stored after it
+        version = follow_graph._cached(self.user.id)[1]
+        with self.captureOnCommitCallbacks(execute=True):
+            models.UserFollows.objects.create(user=self.user,
+                                              followed_user=self.users[4])
+        cache.set(follow_graph.following_key(self.user.id),
+                  (version, follow_graph.pack([self.users[1].id])))
+        self.assertEqual(list(follow_graph.following(self.user.id)),
+                         self.followed_ids(self.user))
+
+    @override_settings(FEED_FANOUT_FOLLOWER_LIMIT=2,
+                       FEED_MERGE_FOLLOWER_MARGIN=0)
+    def test_celebrities(self):
+        self.assertEqual(
+            follow_graph.followed_celebrities(self.user.id),
+            sorted(fanout.celebrities(self.followed_ids(self.user))))
+        follow = self.user.following.get(followed_user=self.users[1])
+        with self.captureOnCommitCallbacks(execute=True):
+            follow.delete()
+            models.UserFollows.objects.filter(
+                followed_user=self.users[2]).first().delete()
+        self.assertEqual(follow_graph.followed_celebrities(self.user.id),
+                         [self.users[3].id])
+
+
+class ApiTests(QueryBudgetTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.async_client.force_login(self.user)
+
+    def test_pages_match_the_html_pages(self):
+        for name in ('feed', 'posts'):
+            with self.subTest(view=name):
+                html_page = self.client.get(reverse(name)).context['page_obj']
+                response = self.assertQueryBudget(
+                    VIEW_BUDGETS['api_' + name], reverse('api_' + name))
+                data = response.json()
+                self.assertEqual(
+                    [(item['type'], item['id']) for item in data['items']],
+                    [(post.content_type, post.id) for post in html_page])
+                self.assertEqual(data['next'], html_page.next_cursor)
+                following = self.client.get(
+                    reverse('api_' + name), {'after': data['next']}).json()
+                previous = self.client.get(
+                    reverse('api_' + name),
+                    {'before': following['previous']}).json()
+                self.assertEqual(previous['items'], data['items'])
+
+    def test_cards(self):
+        response = self.client.get(reverse('api_posts'), {'cards': 1})
+        items = response.json()['items']
+        self.assertTrue(all('card' in item for item in items))
+        # the links of the cards come back to the HTML page
+        self.assertIn('next=/posts/', ''.join(item['card'] for item in items))
+        self.assertNotIn('card', self.client.get(
+            reverse('api_feed')).json()['items'][0])
+
+    def test_cards_draw_the_stars(self):
+        # inserted by the infinite scroll, the scripts of a card never run
+        review = self.user.review_set.get(rating=3)
+        items = self.client.get(reverse('api_posts'), {'cards': 1}).json()
+        card = next(item['card'] for item in items['items']
+                    if (item['type'], item['id']) == ('REVIEW', review.id))
+        self.assertNotIn('<script', card)
+        self.assertEqual(card.count('bi-star-fill'), 3)
+        self.assertEqual(card.count('"bi bi-star"'), 2)
+
+    def test_json_is_smaller_than_the_page(self):
+        page = self.client.get(reverse('feed'))
+        data = self.client.get(reverse('api_feed'))
+        self.assertLess(len(data.content), len(page.content) / 4)
+
+    def test_home(self):
+        data = self.client.get(reverse('api_home')).json()
+        self.assertEqual(len(data['user_feed']), 3)
+        self.assertEqual(len(data['general_feed']), 3)
+
+    def test_anonymous(self):
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('api_feed')).status_code,
+                         401)
+
+    async def test_served_by_the_async_handler(self):
+        response = await self.async_client.get(reverse('api_posts'))
+        self.assertEqual(len(response.json()['items']), 5)
+        self.assertIn('Server-Timing', response)
+
+    def test_middleware_chain_is_async(self):
+        # a sync only middleware would run the async views in a thread
+        with self.assertNoLogs('django.request', 'DEBUG'):
+            ASGIHandler()
+
+
+class EventsTests(QueryBudgetTestCase):
+
+    def setUp(self):
+        super().setUp()
+        events._bus.cache_clear()
+        # like the test client, keep the connection of the test transaction
+        patcher = mock.patch('reviews.events.close_old_connections')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def communicator(self, logged_in=True):
+        headers = [(b'host', b'testserver')]
+        if logged_in:
+            headers.append((b'cookie', ('%s=%s' % (
+                settings.SESSION_COOKIE_NAME,
+                self.client.cookies[settings.SESSION_COOKIE_NAME].value
+            )).encode()))
+        scope = {'type': 'http', 'method': 'GET', 'path': reverse('events'),
+                 'query_string': b'', 'headers': headers}
+        return ApplicationCommunicator(events.EventsRouter(None), scope)
+
+    async def open(self, communicator):
+        await communicator.send_input({'type': 'http.request', 'body': b''})
+        start = await communicator.receive_output()
+        if start['status'] == 200:
+            body = await communicator.receive_output()
+            self.assertTrue(body['body'].startswith(b'retry:'))
+        return start
+
+    def create_posts(self):
+        """ posts of an unfollowed user, of a followed user and a review
+            of a ticket of the user, by an unfollowed user
+        """
+        with self.captureOnCommitCallbacks(execute=True):
+            models.Ticket.objects.create(title='Inconnu', user=self.users[4])
+            ticket = models.Ticket.objects.create(
+                title='Suivi', user=self.users[1])
+            review = models.Review.objects.create(
+                ticket=self.user.ticket_set.first(), user=self.users[5],
+                rating=4, headline='Réponse')
+        return ticket, review
+
+    async def test_stream_sends_the_new_posts_of_the_follows(self):
+        communicator = self.communicator()
+        start = await self.open(communicator)
+        self.assertEqual(start['status'], 200)
+        self.assertIn((b'content-type', b'text/event-stream'),
+                      start['headers'])
+        ticket, review = await sync_to_async(self.create_posts)()
+        bodies = [(await communicator.receive_output())['body']
+                  for _ in range(2)]
+        self.assertEqual(bodies, [
+            b'event: post\ndata: {"type":"TICKET","id":%d}\n\n' % ticket.id,
+            b'event: post\ndata: {"type":"REVIEW","id":%d}\n\n' % review.id,
+        ])
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.send_input({'type': 'http.disconnect'})
+        await communicator.wait()
+        self.assertEqual(events.bus().subscribers(), 0)
+
+    async def test_anonymous(self):
+        start = await self.open(self.communicator(logged_in=False))
+        self.assertEqual(start['status'], 401)
+
+    @override_settings(EVENTS_HEARTBEAT_SECONDS=0.01,
+                       EVENTS_STREAM_SECONDS=0.05)
+    async def test_heartbeat_and_end_of_stream(self):
+        communicator = self.communicator()
+        await self.open(communicator)
+        self.assertEqual((await communicator.receive_output())['body'],
+                         events.HEARTBEAT)
+        while (await communicator.receive_output()).get('more_body'):
+            pass
+        await communicator.wait()
+        self.assertEqual(events.bus().subscribers(), 0)
+
+    async def test_socket_bus_reaches_the_other_processes(self):
+        path = os.path.join(tempfile.mkdtemp(), 'events.sock')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        broker = asyncio.ensure_future(events.run_broker(path))
+        with override_settings(EVENT_BROKER_SOCKET=path):
+            publisher, receiver = events.SocketBus(), events.SocketBus()
+        subscription = receiver.subscribe(['posts:1'])
+        publish = sync_to_async(publisher.publish, thread_sensitive=False)
+        try:
+            # the receiver may not be connected to the broker yet
+            for _ in range(50):
+                await publish('posts:1', {'type': 'TICKET', 'id': 1})
+                try:
+                    message = await asyncio.wait_for(subscription.get(), 0.1)
+                    break
+                except asyncio.TimeoutError:
+                    pass
+            self.assertEqual(message, {'type': 'TICKET', 'id': 1})
+        finally:
+            # the broker sees the workers leave before it stops
+            readers = list(receiver.readers.values())
+            for reader in readers:
+                reader.cancel()
+            await asyncio.gather(*readers, return_exceptions=True)
+            publisher.publisher.close()
+            await asyncio.sleep(0.05)
+            broker.cancel()
+            await asyncio.gather(broker, return_exceptions=True)
+
+
+# the single process of the tests shares its cache
+@override_settings(CONDITIONAL_GET=True)
+class ConditionalGetTests(QueryBudgetTestCase):
+    PAGES = ['home', 'feed', 'posts', 'api_home', 'api_feed', 'api_posts']
+
+    def test_not_modified_without_feed_query(self):
+        for name in self.PAGES:
+            with self.subTest(view=name):
+                response = self.client.get(reverse(name))
+                self.assertEqual(response['Cache-Control'],
+                                 'private, no-cache')
+                with CaptureQueriesContext(connection) as context:
+                    again = self.client.get(
+                        reverse(name), HTTP_IF_NONE_MATCH=response['ETag'])
+                self.assertEqual(again.status_code, 304)
+                self.assertEqual(again['ETag'], response['ETag'])
+                # session and user only
+                self.assertEqual(len(context), 2)
+                since = self.client.get(
+                    reverse(name),
+                    HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+                self.assertEqual(since.status_code, 304)
+
+    def assertChangedBy(self, name, change):
+        etag = self.client.get(reverse(name))['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            change()
+        response = self.client.get(reverse(name), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_changes_renew_the_validators(self):
+        followed = self.users[1]
+        self.assertChangedBy('feed', lambda: models.Ticket.objects.create(
+            title='Nouveau', user=followed))
+        # a review of a ticket of the user, by an unfollowed user
+        self.assertChangedBy('feed', lambda: models.Review.objects.create(
+            ticket=self.user.ticket_set.first(), user=self.users[5],
+            rating=3, headline='Réponse'))
+        # the ticket of another user, shown by a review of the user
+        ticket = self.user.review_set.first().ticket
+        ticket.title = 'Renommé'
+        self.assertChangedBy('posts', ticket.save)
+        self.assertChangedBy('feed', lambda: self.user.following.filter(
+            followed_user=followed).delete())
+        # the latest activity of the site
+        self.assertChangedBy('home', lambda: models.Ticket.objects.create(
+            title='Ailleurs', user=self.users[4]))
+        self.assertChangedBy('api_posts', conditional.invalidate)
+
+    def test_unrelated_change_keeps_the_page(self):
+        etag = self.client.get(reverse('feed'))['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            models.Ticket.objects.create(title='Ailleurs', user=self.users[4])
+        self.assertEqual(self.client.get(
+            reverse('feed'), HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_validators_depend_on_cursor_and_viewer(self):
+        first = self.client.get(reverse('feed'))
+        following = self.client.get(
+            reverse('feed'), {'after': first.context['page_obj'].next_cursor})
+        self.assertNotEqual(first['ETag'], following['ETag'])
+        self.client.force_login(self.users[1])
+        self.assertEqual(self.client.get(
+            reverse('feed'), HTTP_IF_NONE_MATCH=first['ETag']).status_code,
+            200)
+
+    def test_disabled_without_a_shared_cache(self):
+        etag = self.client.get(reverse('feed'))['ETag']
+        with self.settings(CONDITIONAL_GET=False):
+            for name in self.PAGES:
+                with self.subTest(view=name):
+                    response = self.client.get(reverse(name),
+                                               HTTP_IF_NONE_MATCH=etag)
+                    self.assertEqual(response.status_code, 200)
+                    self.assertNotIn('ETag', response)
+
+
+class ReviewAggregatesTests(QueryBudgetTestCase):
+
+    def stored(self, ticket):
+        ticket.refresh_from_db()
+        return ticket.review_count, ticket.rating_sum, ticket.last_review_at
+
+    def assertInSync(self, ticket):
+        self.assertEqual(self.stored(ticket),
+                         aggregates.actual([ticket.id])[ticket.id])
+
+    def test_reviews_keep_the_aggregates_in_sync(self):
+        ticket = self.users[1].ticket_set.first()
+        self.assertInSync(ticket)
+        first = models.Review.objects.create(
+            ticket=ticket, user=self.users[2], rating=5, headline='Bien')
+        second = models.Review.objects.create(
+            ticket=ticket, user=self.users[3], rating=1, headline='Moyen')
+        self.assertInSync(ticket)
+        self.assertEqual(ticket.last_review_at, second.time_created)
+        edited = models.Review.objects.get(id=first.id)
+        edited.rating = 2
+        edited.save()
+        self.assertInSync(ticket)
+        second.delete()
+        self.assertInSync(ticket)
+        self.assertEqual(ticket.last_review_at, first.time_created)
+
+    def test_ticket_edit_keeps_the_aggregates(self):
+        ticket = models.Ticket.objects.get(
+            id=self.users[1].ticket_set.first().id)
+        models.Review.objects.create(
+            ticket=ticket, user=self.users[2], rating=4, headline='Bien')
+        ticket.title = 'Modifié'
+        ticket.save()
+        self.assertInSync(ticket)
+
+    def test_reconcile_repairs_the_drift(self):
+        models.Ticket.objects.update(review_count=7, rating_sum=0)
+        drifted = models.Ticket.objects.count()
+        output = io.StringIO()
+        call_command('reconcile_reviews', batch_size=10, stdout=output)
+        self.assertIn('Repaired %d tickets' % drifted, output.getvalue())
+        for ticket in models.Ticket.objects.all():
+            self.assertInSync(ticket)
+        self.assertEqual(aggregates.reconcile(), 0)
+
+    def test_cards_show_the_average_rating(self):
+        ticket = models.Ticket.objects.create(title='Noté', user=self.user)
+        for user, rating in ((self.users[2], 4), (self.users[3], 3)):
+            models.Review.objects.create(
+                ticket=ticket, user=user, rating=rating, headline='Avis')
+        ticket.refresh_from_db()
+        self.assertEqual(ticket.average_rating, 3.5)
+        self.assertContains(self.client.get(reverse('posts')),
+                            'Note moyenne : 3,5 / 5 (2 critiques)')
+
+
+class ReadReplicaRouterTests(TestCase):
+
+    def test_routing(self):
+        router = database.ReadReplicaRouter()
+        # TestCase keeps a transaction open on the default alias
+        with mock.patch.object(connections['default'], 'in_atomic_block',
+                               False):
+            self.assertEqual(router.db_for_read(models.Ticket), 'default')
+            with database.reading():
+                self.assertEqual(router.db_for_read(models.Ticket),
+                                 'readonly')
+                self.assertEqual(router.db_for_write(models.Ticket),
+                                 'default')
+        with database.reading():
+            self.assertEqual(router.db_for_read(models.Ticket), 'default')
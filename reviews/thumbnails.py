@@ -0,0 +1,60 @@
+""" sizes and names of the ticket thumbnails
+    a cover is displayed in a box of IMAGE_MAX_SIZE css pixels, its
+    thumbnails are WebP files at several scales of that box (small
+    screens, standard and high density screens) and one JPEG at the
+    displayed size for the browsers without WebP. The thumbnails are
+    stored next to the image, named after its full name: the same content
+    stored as <hash>.jpg and <hash>.jpeg has two sets of thumbnails,
+    covers/ab/<hash>.jpg_250w.webp
+"""
+import os
+import re
+
+IMAGE_MAX_SIZE = (250, 300)
+SCALES = (0.5, 1, 1.5, 2)
+WEBP = '.webp'
+JPEG = '.jpg'
+VARIANT_PATTERN = re.compile(r'(?P<stem>.+)_\d+w(\.webp|\.jpg)')
+
+
+def fit(size, box):
+    """ size shrunk to fit in the box, never enlarged """
+    width, height = size
+    ratio = min(box[0] / width, box[1] / height, 1)
+    return max(round(width * ratio), 1), max(round(height * ratio), 1)
+
+
+def display_size(size):
+    """ css size of the cover of an image of this size """
+    return fit(size, IMAGE_MAX_SIZE)
+
+
+def variant_sizes(size):
+    """ sizes of the WebP thumbnails, smallest first
+        the scales larger than the image itself give the image size
+    """
+    sizes = []
+    for scale in SCALES:
+        variant = fit(size, (IMAGE_MAX_SIZE[0] * scale,
+                             IMAGE_MAX_SIZE[1] * scale))
+        if variant not in sizes:
+            sizes.append(variant)
+    return sizes
+
+
+def variant_name(name, width, extension):
+    """ covers/ab/abc...123.jpg -> covers/ab/abc...123.jpg_250w.webp """
+    return '%s_%dw%s' % (name, width, extension)
+
+
+def variant_stem(name):
+    """ abc...123.jpg_250w.webp -> abc...123.jpg, None if not a
+        thumbnail
+    """
+    match = VARIANT_PATTERN.fullmatch(name)
+    return match['stem'] if match else None
+
+
+def is_variant(name, image_name):
+    """ True if the file name is a thumbnail of the image """
+    return variant_stem(name) == os.path.basename(image_name)
@@ -0,0 +1,160 @@
+""" username prefix index for the follow form autocomplete
+    each process keeps the usernames sorted in memory, a prefix is found
+    by bisection without any query. The index is kept in sync with two
+    shared cache keys:
+    - VERSION_KEY, incremented when users sign up: the other processes
+      load the users created since their last load (id > last_id, the
+      largest id loaded from the database, not the ids added locally:
+      lower ids committed by other processes may still be missing)
+    - GENERATION_KEY, changed when a user is deleted or renamed (and
+      when the cache is lost): the processes load all the users again
+"""
+import bisect
+import threading
+import uuid
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+
+from . import follow_graph
+
+SUGGESTIONS = 10
+
+VERSION_KEY = 'reviews:usernames:version'
+GENERATION_KEY = 'reviews:usernames:generation'
+
+
+def sort_key(username):
+    return username.casefold()
+
+
+class UsernameIndex:
+    """ usernames sorted by sort_key, in parallel lists """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.keys = []
+        self.entries = []
+        self.usernames = {}
+        self.last_id = 0
+        self.generation = None
+        self.version = None
+
+    def load(self, generation, version):
+        """ all the users, in one query """
+        users = get_user_model().objects.values_list('id', 'username')
+        entries = sorted(((sort_key(username), username, user_id)
+                          for user_id, username in users.iterator()))
+        self.keys = [key for key, _, _ in entries]
+        self.entries = [(username, user_id)
+                        for _, username, user_id in entries]
+        self.usernames = {user_id: username
+                          for _, username, user_id in entries}
+        self.last_id = max(self.usernames, default=0)
+        self.generation = generation
+        self.version = version
+
+    def load_new(self, version):
+        """ the users created since the last load, in one query """
+        users = get_user_model().objects.filter(
+            id__gt=self.last_id).values_list('id', 'username')
+        for user_id, username in users:
+            self.add(user_id, username)
+            self.last_id = max(self.last_id, user_id)
+        self.version = version
+
+    def add(self, user_id, username):
+        if user_id in self.usernames:
+            return
+        key = sort_key(username)
+        position = bisect.bisect_right(self.keys, key)
+        self.keys.insert(position, key)
+        self.entries.insert(position, (username, user_id))
+        self.usernames[user_id] = username
+
+    def complete(self, prefix, excluded, limit):
+        """ usernames starting with prefix, whatever the case,
+            skipping the user ids of excluded
+        """
+        key = sort_key(prefix)
+        position = bisect.bisect_left(self.keys, key)
+        found = []
+        while position < len(self.keys) and len(found) < limit \
+                and self.keys[position].startswith(key):
+            username, user_id = self.entries[position]
+            if user_id not in excluded:
+                found.append(username)
+            position += 1
+        return found
+
+
+index = UsernameIndex()
+
+
+def _generation():
+    """ shared generation and version, a new generation if lost """
+    values = cache.get_many([GENERATION_KEY, VERSION_KEY])
+    generation = values.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, uuid.uuid4().hex, None)
+        generation = cache.get(GENERATION_KEY)
+    return generation, values.get(VERSION_KEY, 0)
+
+
+def sync():
+    """ bring the index of the process up to date
+        no query when nothing changed
+    """
+    generation, version = _generation()
+    with index.lock:
+        if index.generation != generation:
+            index.load(generation, version)
+        elif index.version != version:
+            index.load_new(version)
+
+
+def complete(prefix, user, limit=SUGGESTIONS):
+    """ usernames starting with prefix that the user could follow:
+        neither the user nor the users it already follows
+    """
+    if not prefix:
+        return []
+    sync()
+    excluded = set(follow_graph.following(user.id))
+    excluded.add(user.id)
+    with index.lock:
+        return index.complete(prefix, excluded, limit)
+
+
+def user_created(user_id, username):
+    """ after the commit of a new user """
+    with index.lock:
+        index.add(user_id, username)
+    version = _bump_version()
+    with index.lock:
+        # up to date if no other process added users meanwhile
+        if index.version == version - 1:
+            index.version = version
+
+
+def invalidate():
+    """ after users created without signals (seeding) """
+    _bump_version()
+
+
+def _bump_version():
+    try:
+        return cache.incr(VERSION_KEY)
+    except ValueError:
+        # no version yet
+        cache.add(VERSION_KEY, 0, None)
+        return cache.incr(VERSION_KEY)
+
+
+def user_changed(user_id, username):
+    """ after the commit of a renamed or deleted (username None) user """
+    with index.lock:
+        if username is not None \
+                and index.usernames.get(user_id) == username:
+            return
+    cache.set(GENERATION_KEY, uuid.uuid4().hex, None)
@@ -1,65 +1,59 @@
+import functools
 import json
 
-from itertools import chain
-
+from asgiref.sync import sync_to_async
 from django.contrib.auth.decorators import login_required
 from django.core.paginator import Paginator
-from django.db.models import CharField, Value, Q
-from django.http import JsonResponse
+from django.http import (
+    HttpResponse, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse)
 from django.shortcuts import render, redirect, get_object_or_404
+from django.urls import reverse
+from django.utils.http import urlencode
 from django.views.decorators.csrf import csrf_exempt
 
+from . import activity
+from . import api
+from . import cards
+from . import conditional
+from . import export as data_export
+from . import feed as feed_engine
 from . import forms
 from . import models
+from . import search as search_engine
+from . import usernames
 
 NUMBER_OF_ITEMS_BY_PAGE = 5
 
 
+def paginate(feed, request):
+    """ Pagination handling, only the requested page is loaded
+        cursors (?after= / ?before=) by default,
+        page numbers (?page=) are kept as a fallback
+    """
+    if 'page' in request.GET:
+        paginator = Paginator(feed, NUMBER_OF_ITEMS_BY_PAGE)
+        return paginator.get_page(request.GET.get('page'))
+    return feed.cursor_page(NUMBER_OF_ITEMS_BY_PAGE,
+                            after=request.GET.get('after'),
+                            before=request.GET.get('before'))
+
+
 @login_required
+@conditional.page(conditional.home_scopes)
 def home(request):
     """ view for the homepage
         get the 3 most recents items (review and ticket) from all sources
         and the 3 most recents itmes from the user feed
         Send it for display
     """
-    # get user feed tickets and reviews
-    user_tickets = models.Ticket.objects.filter(
-        Q(user__in=request.user.following.values("followed_user")) |
-        Q(user=request.user)
-    )
-    user_tickets = user_tickets.annotate(
-        content_type=Value('TICKET', CharField()))
-
-    user_reviews = models.Review.objects.filter(
-        Q(user__in=request.user.following.values("followed_user")) |
-        Q(user=request.user) |
-        Q(ticket__in=models.Ticket.objects.filter(user=request.user))
-    )
-    user_reviews = user_reviews.annotate(
-        content_type=Value('REVIEW', CharField()))
-
-    # merge the reviews and tickets and select the 3 most recent
-    user_feed = sorted(
-        chain(user_tickets, user_reviews),
-        key=lambda instance: instance.time_created,
-        reverse=True
-    )[:3]
-
-    # get general feed tickets and reviews
-    general_tickets = models.Ticket.objects.all()
-    general_tickets = general_tickets.annotate(
-        content_type=Value('TICKET', CharField()))
-
-    general_reviews = models.Review.objects.all()
-    general_reviews = general_reviews.annotate(
-        content_type=Value('REVIEW', CharField()))
-
-    # merge the reviews and tickets and select the 3 most recent
-    general_feed = sorted(
-        chain(general_tickets, general_reviews),
-        key=lambda instance: instance.time_created,
-        reverse=True
-    )[:3]
+    # the merge and the selection of the 3 most recent is done in SQL
+    user_feed = feed_engine.user_feed(request.user)[:3]
+    # shared by all the users, read from the cache
+    general_feed = activity.latest_activity()
+
+    card_template = 'reviews/cards/home_card.html'
+    cards.render_cards(request, user_feed, card_template)
+    cards.render_cards(request, general_feed, card_template)
 
     context = {'user_feed': user_feed,
                'general_feed': general_feed}
@@ -67,63 +61,34 @@ def home(request):
 
 
 @login_required
+@conditional.page(conditional.feed_scopes)
 def feed(request):
     """ view for the feed page
         get the items (review and ticket) from the user
         and from the users it follows
         sort them in decreasing time send them for display
     """
-    tickets = models.Ticket.objects.filter(
-        Q(user__in=request.user.following.values("followed_user")) |
-        Q(user=request.user)
-    )
-    tickets = tickets.annotate(
-        content_type=Value('TICKET', CharField()))
-
-    reviews = models.Review.objects.filter(
-        Q(user__in=request.user.following.values("followed_user")) |
-        Q(user=request.user) |
-        Q(ticket__in=models.Ticket.objects.filter(user=request.user))
-    )
-    reviews = reviews.annotate(
-        content_type=Value('REVIEW', CharField()))
-
-    feed = sorted(
-        chain(tickets, reviews),
-        key=lambda instance: instance.time_created,
-        reverse=True
-    )
-
-    # Pagination handling
-    paginator = Paginator(feed, NUMBER_OF_ITEMS_BY_PAGE)
-
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    feed = feed_engine.user_feed(request.user)
+
+    page_obj = paginate(feed, request)
+    cards.render_cards(request, page_obj, 'reviews/cards/feed_card.html')
+
     context = {'page_obj': page_obj}
     return render(request, 'reviews/feed.html', context)
 
 
 @login_required
+@conditional.page(conditional.posts_scopes)
 def posts(request):
     """ view for the posts page
         get the items (review and ticket) from the user
         sort them in decreasing time send them for display
     """
-    tickets = models.Ticket.objects.filter(user=request.user)
-    tickets = tickets.annotate(content_type=Value('TICKET', CharField()))
-    reviews = models.Review.objects.filter(user=request.user)
-    reviews = reviews.annotate(content_type=Value('REVIEW', CharField()))
-
-    posts = sorted(
-        chain(tickets, reviews),
-        key=lambda instance: instance.time_created,
-        reverse=True
-    )
-    # Pagination handling
-    paginator = Paginator(posts, NUMBER_OF_ITEMS_BY_PAGE)
-
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    posts = feed_engine.user_posts(request.user)
+
+    page_obj = paginate(posts, request)
+    cards.render_cards(request, page_obj, 'reviews/cards/posts_card.html')
+
     context = {'page_obj': page_obj}
     return render(request, 'reviews/posts.html', context)
 
@@ -221,7 +186,8 @@ def review_with_ticket_create(request, ticket_id):
     """ create a review from a ticket"""
 
     # get the ticket data for dispaly
-    ticket = get_object_or_404(models.Ticket, id=ticket_id)
+    ticket = get_object_or_404(
+        models.Ticket.objects.select_related('user'), id=ticket_id)
 
     if request.method == 'POST':
         review_form = forms.ReviewForm(request.POST)
@@ -248,9 +214,10 @@ def review_with_ticket_create(request, ticket_id):
 @login_required
 def review_edit(request, review_id):
     """ edit a review"""
-    review = get_object_or_404(models.Review, id=review_id)
+    review = get_object_or_404(
+        models.Review.objects.select_related('ticket__user'), id=review_id)
     review_form = forms.ReviewForm(instance=review)
-    ticket = get_object_or_404(models.Ticket, id=review.ticket.id)
+    ticket = review.ticket
 
     if request.method == 'POST':
         review_form = forms.ReviewForm(request.POST, instance=review)
@@ -284,8 +251,8 @@ def review_delete(request):
 @login_required
 def follow_user(request):
     """ add a followed user"""
-    followed_by = request.user.followed_by.all()
-    following = request.user.following.all()
+    followed_by = request.user.followed_by.select_related('user')
+    following = request.user.following.select_related('followed_user')
     if request.method == 'POST':
         form = forms.FollowUserForm(request.POST)
         if form.is_valid():
@@ -306,6 +273,14 @@ def follow_user(request):
                   context)
 
 
+@login_required
+def follow_user_autocomplete(request):
+    """ usernames starting with ?q= the user does not follow yet """
+    suggestions = usernames.complete(request.GET.get('q', '').strip(),
+                                     request.user)
+    return JsonResponse({'usernames': suggestions})
+
+
 @login_required
 @csrf_exempt
 def unfollow_user(request):
@@ -319,3 +294,115 @@ def unfollow_user(request):
         relationship = models.UserFollows.objects.get(id=follow_id)
         relationship.delete()
         return JsonResponse({'success': 'yes'})
+
+
+@login_required
+def export(request):
+    """ download of the tickets, reviews and follows of the user
+        ?format=ndjson (default) or ?format=csv, streamed line by line
+    """
+    export_format = request.GET.get('format', 'ndjson')
+    if export_format not in data_export.FORMATS:
+        return HttpResponseBadRequest("Format inconnu")
+    content_type, extension = data_export.FORMATS[export_format]
+    response = StreamingHttpResponse(
+        data_export.lines(request.user, export_format),
+        content_type=content_type + '; charset=utf-8')
+    response['Content-Disposition'] = 'attachment; filename="%s.%s"' % (
+        request.user.username, extension)
+    return response
+
+
+@login_required
+def search(request):
+    """ full-text search of the tickets and reviews, best match first
+        ?scope=follows keeps the posts of the user and of the users
+        it follows
+    """
+    query = request.GET.get('q', '').strip()
+    scope = request.GET.get('scope', 'all')
+    page_obj = search_engine.search_page(
+        query, NUMBER_OF_ITEMS_BY_PAGE,
+        user=request.user if scope == 'follows' else None,
+        after=request.GET.get('after'),
+        before=request.GET.get('before'))
+    cards.render_cards(request, page_obj, 'reviews/cards/feed_card.html')
+
+    context = {'page_obj': page_obj,
+               'query': query,
+               'scope': scope,
+               # kept by the pagination links
+               'pagination_query': urlencode({'q': query, 'scope': scope})
+               + '&'}
+    return render(request, 'reviews/search.html', context)
+
+
+def api_login_required(view):
+    """ login_required for the async API views
+        the user is loaded in a thread, anonymous users get a 401
+    """
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if not await sync_to_async(lambda: request.user.is_authenticated)():
+            return JsonResponse({'error': "Authentification requise"},
+                                status=401)
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+async def api_page(request, feed, card_template, page_name):
+    """ JSON cursor page of a feed, ?after= / ?before= cursors
+        ?cards=1 adds the cards rendered for the HTML page
+    """
+    page_obj = await feed.acursor_page(NUMBER_OF_ITEMS_BY_PAGE,
+                                       after=request.GET.get('after'),
+                                       before=request.GET.get('before'))
+    with_cards = 'cards' in request.GET
+    if with_cards:
+        await sync_to_async(cards.render_cards)(
+            request, page_obj, card_template, path=reverse(page_name))
+    return api.response(api.page_data(page_obj, with_cards))
+
+
+@api_login_required
+@conditional.page(conditional.feed_scopes)
+async def api_feed(request):
+    """ JSON pages of the feed page """
+    feed = await sync_to_async(feed_engine.user_feed)(request.user)
+    return await api_page(request, feed, 'reviews/cards/feed_card.html',
+                          'feed')
+
+
+@api_login_required
+@conditional.page(conditional.posts_scopes)
+async def api_posts(request):
+    """ JSON pages of the posts page """
+    return await api_page(request, feed_engine.user_posts(request.user),
+                          'reviews/cards/posts_card.html', 'posts')
+
+
+@api_login_required
+@conditional.page(conditional.home_scopes)
+async def api_home(request):
+    """ the two blocks of the homepage as JSON """
+    feed = await sync_to_async(feed_engine.user_feed)(request.user)
+    user_feed = list(await feed.acursor_page(3))
+    general_feed = await sync_to_async(activity.latest_activity)()
+    with_cards = 'cards' in request.GET
+    if with_cards:
+        for posts in (user_feed, general_feed):
+            await sync_to_async(cards.render_cards)(
+                request, posts, 'reviews/cards/home_card.html',
+                path=reverse('home'))
+    return api.response({
+        'user_feed': api.posts_data(user_feed, with_cards),
+        'general_feed': api.posts_data(general_feed, with_cards),
+    })
+
+
+def events(request):
+    """ the events stream is served by the ASGI application in front of
+        Django (reviews.events.EventsRouter). Without it (WSGI server) a 204
+        tells the browser not to reconnect
+    """
+    return HttpResponse(status=204)